@@ -1,9 +1,22 @@
+import hashlib
 import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
 import wavedrom
 import cairosvg
 
+# Rendered diagrams are cached by a hash of their source and output mode, and the PDF is only rebuilt when the README
+# or the diagrams it includes change
+CACHE_DIR = "doc/.cache"
+MODES = {
+    "pdf": dict(convert=cairosvg.svg2pdf, output_width=500),  # PDF diagrams look better with Rinoh
+    "png": dict(convert=cairosvg.svg2png, output_width=1000),  # PNG images are viewable online
+}
+
 # Building the timing diagrams
-diagrams = [    
+diagrams = [
 
 """{ "head": { "text": "Combinatory vs Syncronous assignment" },
 "signal": [
@@ -14,46 +27,73 @@ diagrams = [
  { "name": "d",  "wave": "0...1..." },
  { "name": "e",  "wave": "0.....1." }
 ]}""",
-"""{ "head": { "text": "Button debouncing" },
- "signal": [
- { "name": "CK",   "wave": "P......", "period": 2  },
- { "name": "button",  "wave": "0.10.1..0.1...", "phase": 0.5 },
- { "name": "timer",  "wave": "=.=.=.=...=.=.", "data": ["0", "2", "1", "0", "2", "1"] },
- { "name": "pressed", "wave": "0.1.....0.1..." }
-]}""",
-"""{ "head": { "text": "Combinatory vs Synchronous assignment" },
-"signal": [
- { "name": "CK",   "wave": "P........", "period": 2  },
- { "name": "led_col[0]",  "wave": "1.0.............1." },
- { "name": "led_col[1]",  "wave": "0.1.0............." },
- { "name": "led_col[2]",  "wave": "0...1.0..........." },
- { "name": "led_col[3]",  "wave": "0.....1.0........." },
- { "name": "..." },
- { "name": "led_col[7]",  "wave": "0.............1.0." },
- {},
- { "name": "led_row[0:8]",  "wave": "=.=.=.=.=.=.=.=.=.", "data": ["row 0", "row 1", "row 2", "row 3", "row 4", "row 5", "row 6", "row 7", "row 0"] }
-]}""",
-"""{ "head": { "text": "Stream interface" },
-"signal": [
- { "name": "CK",   "wave": "P........", "period": 2  },
- { "name": "rdy (from sink)",  "wave": "0.....1............." },
- { "name": "ack (from source)",  "wave": "0.1.0...1.0...1...0." },
- { "name": "data (from source)",  "wave": "x.......=.x...=.=.x.", "data": ["#1", "#2", "#3"] }
-]}"""
+# Diagrams traced from the simulation of the designs, see tools/wavetrace.py
+*(open(f"doc/diagram{number:02}.json").read() for number in (2, 3, 4)),
 ]
 
-def build_diagrams(pdf_mode=False):
+def digest(*parts):
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def cache_path(diagram, mode):
+    return f"{CACHE_DIR}/{digest(diagram, mode, str(MODES[mode]['output_width']))}.{mode}"
+
+
+def render(diagram, mode, path):
+    mode = MODES[mode]
+    svg_path = f"{path}.svg"
+    wavedrom.render(diagram).saveas(svg_path)
+    mode["convert"](url=svg_path, write_to=f"{path}.tmp", output_width=mode["output_width"])
+    os.replace(f"{path}.tmp", path)  # only complete files are cached
+    os.remove(svg_path)
+
+
+def build_diagrams():
+    """Render the diagrams missing from the cache, in parallel"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    jobs = [(diagram, mode, cache_path(diagram, mode)) for diagram in diagrams for mode in MODES]
+    jobs = [job for job in jobs if not os.path.exists(job[2])]
+    if not jobs:
+        return
+    print(f"Rendering {len(jobs)} diagrams")
+    with ProcessPoolExecutor() as executor:
+        for future in [executor.submit(render, *job) for job in jobs]:
+            future.result()
+
+
+def install_diagrams(mode):
+    """Copy the rendered diagrams where the README expects them, leaving unchanged files untouched"""
     for i, diagram in enumerate(diagrams):
-        svg_path = f"doc/diagram{i+1:02}.svg"
-        png_path = f"doc/diagram{i+1:02}.png"
-        print(f"Building {png_path}")
-        svg = wavedrom.render(diagram)
-        svg.saveas(svg_path)
-        if pdf_mode:
-            cairosvg.svg2pdf(url=svg_path, write_to=png_path, output_width=500)
-        else:
-            cairosvg.svg2png(url=svg_path, write_to=png_path, output_width=1000)
-
-build_diagrams(True)  # first we make PDF diagrams as they look better with Rinoh
-os.system('rinoh README.md')
-build_diagrams()  # Now we make PNG images so it's viewable online
+        src = cache_path(diagram, mode)
+        dst = f"doc/diagram{i+1:02}.png"
+        with open(src, "rb") as f:
+            data = f.read()
+        if os.path.exists(dst):
+            with open(dst, "rb") as f:
+                if f.read() == data:
+                    continue
+        print(f"Installing {dst} ({mode})")
+        shutil.copyfile(src, dst)
+
+
+def build_pdf():
+    """Run Rinoh on the README, unless it and the PDF diagrams did not change since the last build"""
+    with open("README.md") as f:
+        readme = f.read()
+    stamp = digest(readme, *(cache_path(diagram, "pdf") for diagram in diagrams))
+    stamp_path = f"{CACHE_DIR}/README.stamp"
+    if os.path.exists("README.pdf") and os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if f.read() == stamp:
+                print("README.pdf is up to date")
+                return
+    install_diagrams("pdf")  # rinoh reads the diagrams from the paths of the README
+    subprocess.run(["rinoh", "README.md"], check=True)
+    with open(stamp_path, "w") as f:
+        f.write(stamp)
+
+
+if __name__ == "__main__":
+    build_diagrams()
+    build_pdf()
+    install_diagrams("png")
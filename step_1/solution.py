@@ -51,11 +51,13 @@ class Top(Elaboratable):
                 m.d.sync += [
                     counter.eq(counter + 1),
                     is_pressed.eq(1),
+                    debounce_timer.eq(debounce_count),
                 ]
             with m.If(~buttons[1]):
                 m.d.sync += [
                     counter.eq(counter - 1),
                     is_pressed.eq(1),
+                    debounce_timer.eq(debounce_count),
                 ]
 
         m.d.comb += [
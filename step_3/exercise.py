@@ -299,7 +299,7 @@ class Pong(Elaboratable):
 
         # reset button
         reset = Signal()
-        m.submodules += FFSynchronizer(~platform.request("button", 5), reset)
+        m.submodules += FFSynchronizer(~platform.request("button", 5).i, reset)
         with m.If(reset):
             m.d.comb += ball.reset.eq(1),
             m.d.sync += [
@@ -0,0 +1,564 @@
+from amaranth import *
+
+
+def hex_digit(nibble):
+    """ASCII character of a hexadecimal digit"""
+    return Mux(nibble < 10, ord('0') + nibble, ord('A') - 10 + nibble)
+
+
+class ReportFormatter(Elaboratable):
+    """Send a text report as a stream of bytes.
+
+    The report is described by a list of strings, sent as-is, and of integers: the addresses of words sent as
+    hexadecimal numbers, e.g. `["n=", 0, "\\r\\n"]`. The words are read from a memory of the owner, through `addr`
+    and `word` (a synchronous read port). The text is stored in a ROM, so that long reports cost block RAM instead of
+    logic.
+
+    `command` is the character requesting the report on the UART (see `ScoreUart`). With `period`, the report is
+    also sent every `period` seconds. Setting `start` sends the report through the stream interface: `data`, `ack`
+    (driven by the formatter), `rdy` (driven by the sink). `last` is set with the last byte. The formatter sets
+    `reading` when it uses the read port, and gets the word in the next cycle: the owner can use the port at any
+    other time.
+
+    With `snapshot=True`, the formatter sets `snapshot` and waits for `snapshot_done` before reading the first word,
+    so that the owner can copy the words the report reads.
+    """
+    def __init__(self, items, command, *, width=32, period=None, snapshot=False):
+        if not isinstance(items[-1], str):
+            raise ValueError("the report must end with a string")
+        self.command = command
+        self.start = Signal()  # input: send the report
+        self.reading = Signal()
+        self.snapshot = Signal()
+        self.snapshot_done = Signal()  # input
+        self.data = Signal(8)
+        self.ack = Signal()
+        self.rdy = Signal()
+        self.last = Signal()
+        self.addr = Signal(7)  # output: address of the word to read
+        self.word = Signal(width)  # input: word read, one cycle after `addr`
+        self._width = width
+        self._period = period
+        self._snapshot = snapshot
+
+        # ASCII characters, and the word addresses with the most significant bit set
+        template = []
+        for item in items:
+            if isinstance(item, str):
+                template += [ord(c) for c in item]
+            else:
+                template.append(0x80 | item)
+        self._template = Memory(width=8, depth=len(template), init=template, attrs={"ram_style": "block"})
+
+    def elaborate(self, platform):
+        m = Module()
+
+        text = m.submodules.text = self._template.read_port(transparent=False)
+        index = Signal(range(self._template.depth))
+        shift = Signal(self._width)  # word being sent, most significant digit first
+        digits = Signal(range(self._width // 4 + 1))  # digits left to send
+
+        m.d.comb += [
+            text.addr.eq(index),
+            self.addr.eq(text.data[:7]),
+        ]
+
+        start = Signal()
+        m.d.comb += start.eq(self.start)
+        if self._period is not None:
+            cycles = int(platform.default_clk_frequency * self._period)
+            timer = Signal(range(cycles), reset=cycles - 1)
+            m.d.sync += timer.eq(timer - 1)
+            with m.If(timer == 0):
+                m.d.sync += timer.eq(timer.reset)
+                m.d.comb += start.eq(1)
+
+        with m.FSM(name="report"):
+            with m.State("IDLE"):
+                with m.If(start):
+                    m.d.sync += index.eq(0)
+                    m.next = "SNAPSHOT" if self._snapshot else "FETCH"
+            if self._snapshot:
+                with m.State("SNAPSHOT"):
+                    m.d.comb += self.snapshot.eq(1)
+                    with m.If(self.snapshot_done):
+                        m.next = "FETCH"
+            with m.State("FETCH"):  # wait for the ROM
+                m.next = "CHAR"
+            with m.State("CHAR"):
+                with m.If(text.data[7]):  # read the word at `addr`
+                    m.d.comb += self.reading.eq(1)
+                    m.next = "WORD"
+                with m.Else():
+                    m.d.comb += [
+                        self.data.eq(text.data),
+                        self.ack.eq(1),
+                        self.last.eq(index == self._template.depth - 1),
+                    ]
+                    with m.If(self.rdy):
+                        m.d.sync += index.eq(index + 1)
+                        with m.If(self.last):
+                            m.next = "IDLE"
+                        with m.Else():
+                            m.next = "FETCH"
+            with m.State("WORD"):
+                m.d.sync += [
+                    shift.eq(self.word),
+                    digits.eq(self._width // 4),
+                ]
+                m.next = "DIGITS"
+            with m.State("DIGITS"):
+                nibble = shift[-4:]
+                m.d.comb += [
+                    self.data.eq(hex_digit(nibble)),
+                    self.ack.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.d.sync += [
+                        shift.eq(shift << 4),
+                        digits.eq(digits - 1),
+                    ]
+                    with m.If(digits == 1):
+                        m.d.sync += index.eq(index + 1)
+                        m.next = "FETCH"
+
+        return m
+
+
+class LatencyMeter(Elaboratable):
+    """Input-to-photon latency measurement.
+
+    For each channel (a racket), the latency is the number of clock cycles (modulo `2**width`) between a button press
+    and the moment the racket pixels it changed are displayed, i.e. the first time the LED matrix drives one of the
+    changed rows.
+    Presses which do not move the racket (the button is released before, or the racket is on the side) are ignored.
+
+    The statistics are kept in a block RAM, updated word by word after each measurement, and the report is sent
+    when the `command` character is received on the UART:
+    `L n=<count> min=<cycles> max=<cycles> sum=<cycles> h=<bin 0> ... <bin 7>`, all numbers in hexadecimal. It is a
+    snapshot of the statistics, copied to the second half of the memory between two measurements, before the report
+    starts.
+    Histogram bin `i` counts the latencies whose most significant bit is `bin_shift + i` (bin 0 also counts the
+    shorter ones, and bin 7 the longer ones). The racket pixels are `rows` bits, one per row of the LED matrix.
+    """
+    command = ord('L')
+
+    # addresses of the statistics words
+    COUNT = 0
+    MIN = 1
+    MAX = 2
+    SUM = 3
+    BINS = 4
+    WORDS = BINS + 8  # address of the snapshot
+
+    def __init__(self, channels=2, width=24, bin_shift=10, rows=8):
+        self.presses = [Signal(name=f"press{i}") for i in range(channels)]  # input: synchronized button state
+        self.pixels = [Signal(rows, name=f"pixels{i}") for i in range(channels)]  # input: racket pixels
+        self.row = Signal(range(rows))  # input: row currently driven by the LED matrix
+        self._width = width
+        self._bin_shift = bin_shift
+
+        self._stats = Memory(width=32, depth=2 * self.WORDS, init=[0, 2**32 - 1, 0, 0])
+        self.report = ReportFormatter([
+            "L n=", self.WORDS + self.COUNT, " min=", self.WORDS + self.MIN, " max=", self.WORDS + self.MAX,
+            " sum=", self.WORDS + self.SUM, " h=",
+            *(item for i in range(8) for item in ([" "] if i else []) + [self.WORDS + self.BINS + i]),
+            "\r\n",
+        ], command=self.command, snapshot=True)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        report = m.submodules.report = self.report
+
+        # Measure the latency of each channel: the press time is recorded, and the latency is computed when the
+        # changed row is displayed, if the previous latency has been accumulated (otherwise the channel waits).
+        now = Signal(self._width)
+        m.d.sync += now.eq(now + 1)
+        latency = Signal(self._width)
+        sample = Signal()  # a latency is waiting to be accumulated
+        starts = Array(Signal(self._width, name=f"start{i}") for i in range(len(self.presses)))
+        displayed = Signal(len(self.presses))
+        taken = Signal(range(len(self.presses)))  # channel whose latency is computed
+        for i in reversed(range(len(self.presses))):
+            with m.If(displayed[i]):
+                m.d.comb += taken.eq(i)
+        # select the start time before subtracting, operations on an Array element are replicated for each element
+        start = Signal(self._width)
+        m.d.comb += start.eq(starts[taken])
+        with m.If(displayed.any() & ~sample):
+            m.d.sync += [
+                latency.eq(now - start),
+                sample.eq(1),
+            ]
+
+        for i, (press, pixels) in enumerate(zip(self.presses, self.pixels)):
+            press_prev = Signal(name=f"press_prev{i}")
+            pixels_prev = Signal(len(pixels), name=f"pixels_prev{i}")
+            rows = Signal(len(pixels), name=f"rows{i}")  # rows which changed
+            m.d.sync += [
+                press_prev.eq(press),
+                pixels_prev.eq(pixels),
+            ]
+
+            with m.FSM(name=f"latency{i}"):
+                with m.State("IDLE"):
+                    with m.If(press & ~press_prev):
+                        m.d.sync += starts[i].eq(now)
+                        m.next = "WAIT_MOVE"
+                with m.State("WAIT_MOVE"):
+                    with m.If(pixels != pixels_prev):
+                        m.d.sync += rows.eq(pixels ^ pixels_prev)
+                        m.next = "WAIT_SCAN"
+                    with m.Elif(~press):
+                        m.next = "IDLE"
+                with m.State("WAIT_SCAN"):
+                    with m.If((rows >> self.row)[0]):
+                        m.d.comb += displayed[i].eq(1)
+                        with m.If(~sample & (taken == i)):
+                            m.next = "IDLE"
+
+        # Accumulate the latency into the statistics: each word is read, updated and written back, in 2 cycles. The
+        # report has priority on the read port. Between two measurements, the words are copied to the snapshot the
+        # report reads, in 2 cycles each.
+        read = m.submodules.stats_read = self._stats.read_port(transparent=False)
+        write = m.submodules.stats_write = self._stats.write_port()
+        addr = Signal(range(self.WORDS))
+        rest = Signal(self._width)  # latency >> (bin_shift + 1 + i) at the address of bin i
+        counted = Signal()  # the latency bin has been found
+
+        m.d.comb += [
+            read.addr.eq(Mux(report.reading, report.addr, addr)),
+            report.word.eq(read.data),
+        ]
+        with m.FSM(name="stats"):
+            with m.State("IDLE"):
+                m.d.sync += [
+                    addr.eq(0),
+                    rest.eq(latency >> (self._bin_shift + 1)),
+                    counted.eq(0),
+                ]
+                with m.If(report.snapshot):
+                    m.next = "COPY_READ"
+                with m.Elif(sample):
+                    m.next = "READ"
+            with m.State("COPY_READ"):
+                m.next = "COPY_WRITE"
+            with m.State("COPY_WRITE"):
+                m.d.comb += [
+                    write.addr.eq(self.WORDS + addr),
+                    write.data.eq(read.data),
+                    write.en.eq(1),
+                ]
+                m.d.sync += addr.eq(addr + 1)
+                with m.If(addr == self.WORDS - 1):
+                    m.d.comb += report.snapshot_done.eq(1)
+                    m.next = "IDLE"
+                with m.Else():
+                    m.next = "COPY_READ"
+            with m.State("READ"):
+                with m.If(~report.reading):
+                    m.next = "WRITE"
+            with m.State("WRITE"):
+                value = read.data
+                m.d.comb += [
+                    write.addr.eq(addr),
+                    write.en.eq(1),
+                ]
+                # a single adder and a single comparator for all the words
+                increment = Signal(self._width)
+                with m.Switch(addr):
+                    with m.Case(self.COUNT):
+                        m.d.comb += increment.eq(1)
+                    with m.Case(self.SUM):
+                        m.d.comb += increment.eq(latency)
+                    with m.Case(self.BINS + 7):
+                        m.d.comb += increment.eq(~counted)
+                    with m.Case(*range(self.BINS, self.BINS + 7)):
+                        m.d.comb += increment.eq((rest == 0) & ~counted)
+                        m.d.sync += [
+                            rest.eq(rest >> 1),
+                            counted.eq(counted | (rest == 0)),
+                        ]
+                less = latency < value
+                with m.If((addr == self.MIN) & less | (addr == self.MAX) & ~less):
+                    m.d.comb += write.data.eq(latency)
+                with m.Else():
+                    m.d.comb += write.data.eq(value + increment)
+
+                m.d.sync += addr.eq(addr + 1)
+                with m.If(addr == self.WORDS - 1):
+                    m.d.sync += sample.eq(0)
+                    m.next = "IDLE"
+                with m.Else():
+                    m.next = "READ"
+
+        return m
+
+
+class PerfCounters(Elaboratable):
+    """Performance counters of the game.
+
+    Each input of `events` is set for a cycle per event, or at each cycle of a condition. The counters are kept in a
+    block RAM: every event has a small pending counter, added to its word in turn. The longest rally (number of
+    rebounds between two scores) is computed from the `rebounds` and `scores` events.
+
+    The report is sent when the `command` character is received on the UART, and every `period` seconds if set:
+    `P frames=<count> moves=<count> ... starved=<count> rally=<count>`, all numbers in hexadecimal. It is a snapshot
+    of the counters, copied to the second half of the memory while they are updated, before the report starts.
+    """
+    command = ord('P')
+
+    EVENTS = ["frames", "moves", "rebounds", "scores", "bytes", "busy", "starved"]
+    RALLY = len(EVENTS)  # address of the longest rally word
+    WORDS = len(EVENTS) + 1  # address of the snapshot
+
+    def __init__(self, period=None):
+        self.events = {name: Signal(name=name) for name in self.EVENTS}  # inputs
+
+        self._counters = Memory(width=32, depth=2 * self.WORDS)
+        self.report = ReportFormatter([
+            "P",
+            *(item for i, name in enumerate(self.EVENTS) for item in [f" {name}=", self.WORDS + i]),
+            " rally=", self.WORDS + self.RALLY,
+            "\r\n",
+        ], command=self.command, period=period, snapshot=True)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        report = m.submodules.report = self.report
+        read = m.submodules.read = self._counters.read_port(transparent=False)
+        write = m.submodules.write = self._counters.write_port()
+        addr = Signal(range(self.WORDS))
+        copying = Signal()  # the words are also written to the snapshot during this turn
+        copy = Signal(32)
+
+        # The words are updated in turn, in 2 cycles each, 3 when copied, and one more when the report uses the read
+        # port: the pending counters never count more than 4 * 8 events.
+        pending = Array(Signal(6, name=f"{name}_pending") for name in self.EVENTS)
+        flush = Signal()
+        for i, event in enumerate(self.events.values()):
+            with m.If(flush & (addr == i)):
+                m.d.sync += pending[i].eq(event)
+            with m.Else():
+                m.d.sync += pending[i].eq(pending[i] + event)
+
+        rally = Signal(16)
+        with m.If(self.events["scores"]):
+            m.d.sync += rally.eq(0)
+        with m.Elif(self.events["rebounds"]):
+            m.d.sync += rally.eq(rally + 1)
+
+        m.d.comb += [
+            read.addr.eq(Mux(report.reading, report.addr, addr)),
+            report.word.eq(read.data),
+        ]
+
+        def next_word():
+            with m.If(addr == self.RALLY):
+                m.d.sync += [
+                    addr.eq(0),
+                    copying.eq(0),
+                ]
+                m.d.comb += report.snapshot_done.eq(copying)
+            with m.Else():
+                m.d.sync += addr.eq(addr + 1)
+            m.next = "READ"
+
+        with m.FSM(name="counters"):
+            with m.State("READ"):
+                with m.If((addr == 0) & report.snapshot):
+                    m.d.sync += copying.eq(1)
+                with m.If(~report.reading):
+                    m.next = "WRITE"
+            with m.State("WRITE"):
+                value = read.data
+                m.d.comb += [
+                    write.addr.eq(addr),
+                    write.en.eq(1),
+                ]
+                increment = Signal(6)
+                m.d.comb += increment.eq(pending[addr])  # a single adder, see `LatencyMeter`
+                with m.If(addr == self.RALLY):
+                    m.d.comb += write.data.eq(Mux(rally > value[:16], rally, value))
+                with m.Else():
+                    m.d.comb += [
+                        write.data.eq(value + increment),
+                        flush.eq(1),
+                    ]
+                with m.If(copying):
+                    m.d.sync += copy.eq(write.data)
+                    m.next = "COPY"
+                with m.Else():
+                    next_word()
+            with m.State("COPY"):
+                m.d.comb += [
+                    write.addr.eq(self.WORDS + addr),
+                    write.data.eq(copy),
+                    write.en.eq(1),
+                ]
+                next_word()
+
+        return m
+
+
+class InputRecorder(Elaboratable):
+    """Record the button transitions, to replay them in simulation (see `tools.replay`).
+
+    The synchronized state of the buttons is recorded in a block RAM ring buffer of 256 16-bit words each time it
+    changes, with the number of clock cycles since the previous change:
+      * event word: bit 15 = 0, bits 10 to 14 = `buttons`, bits 0 to 9 = cycles since the previous event (modulo
+        1024), or since the reset for the first event
+      * wait word: bit 15 = 1, bits 0 to 14 = number of 1024 cycle periods to add to the delay of the next event. The
+        last wait word is updated in place while no button changes, and a new one is started after 2**15 - 1 periods.
+    The words are written as the changes happen, so that a replay is exact to the clock cycle. A change costs 1
+    word, and a wait word once more than 1024 cycles have passed, i.e. 2 words at 12 MHz when the buttons change
+    more than 85 us apart, and a wait word every 2.8 s without any change: the buffer holds the last 128 changes,
+    about a minute of play at 2 changes per second. Cycle-exact time stamps cannot be much denser: at 12 MHz, a
+    delay of a second takes 24 bits.
+
+    The recording is sent when the `command` character is received on the UART, oldest word first:
+    `R n=<words> <word> <word> ...`, all numbers in hexadecimal. `n` is the number of words written since the reset,
+    up to 256: above, the oldest words have been overwritten and the recording cannot be replayed from the reset.
+    The report has the stream interface of `ReportFormatter`.
+    """
+    command = ord('R')
+    DEPTH = 256
+    DELTA_BITS = 10
+    HEADER = "R n="
+
+    def __init__(self, buttons=5):
+        self.buttons = Signal(buttons)  # input: synchronized state of the buttons
+        self.start = Signal()  # input: send the recording
+        self.data = Signal(8)
+        self.ack = Signal()
+        self.rdy = Signal()
+        self.last = Signal()
+        # a word overwritten while it is sent is lost anyway: no read-during-write logic
+        self._words = Memory(width=16, depth=self.DEPTH, attrs={"ram_style": "block", "no_rw_check": 1})
+
+    def elaborate(self, platform):
+        m = Module()
+
+        read = m.submodules.read = self._words.read_port(transparent=False)
+        write = m.submodules.write = self._words.write_port()
+
+        # Recording
+        state = Signal(len(self.buttons))
+        elapsed = Signal(self.DELTA_BITS)
+        periods = Signal(15)  # in the last wait word
+        wait_addr = Signal(range(self.DEPTH))
+        addr = Signal(range(self.DEPTH))  # next word
+        full = Signal()  # the DEPTH words have been written
+        lost = Signal()  # a word has been overwritten
+
+        event = Signal()  # the buttons have changed
+        new_wait = Signal()  # start a wait word
+        m.d.comb += [
+            event.eq(self.buttons != state),
+            new_wait.eq((periods == 0) | (periods == 2**15 - 1)),
+            write.en.eq(event | (elapsed == 2**self.DELTA_BITS - 1)),
+            write.addr.eq(Mux(event | new_wait, addr, wait_addr)),
+            write.data.eq(Mux(event, Cat(elapsed, self.buttons, C(0, 1)),
+                              Cat(Mux(new_wait, 1, periods + 1)[:15], C(1, 1)))),
+        ]
+        m.d.sync += elapsed.eq(elapsed + 1)
+        with m.If(event):
+            m.d.sync += [
+                state.eq(self.buttons),
+                elapsed.eq(1),
+                periods.eq(0),
+            ]
+        with m.Elif(write.en):
+            m.d.sync += periods.eq(write.data[:15])
+            with m.If(new_wait):
+                m.d.sync += wait_addr.eq(addr)
+        with m.If(write.en & (event | new_wait)):  # a new word
+            m.d.sync += addr.eq(addr + 1)
+            with m.If(addr == self.DEPTH - 1):
+                m.d.sync += full.eq(1)
+            with m.If(full):
+                m.d.sync += lost.eq(1)
+
+        # Report: the words written before the report started are sent
+        index = Signal(range(len(self.HEADER)))
+        count = Signal(len(addr) + 2)  # words written, above DEPTH when lost
+        digit = Signal(range(4))  # of the number being sent, most significant first
+        nibble = Signal(4)
+        pointer = Signal(range(self.DEPTH))
+        remaining = Signal(range(self.DEPTH + 1))
+        header = Array(C(ord(c), 8) for c in self.HEADER)
+        m.d.comb += read.addr.eq(pointer)
+
+        with m.FSM(name="dump"):
+            with m.State("IDLE"):
+                with m.If(self.start):
+                    m.d.sync += [
+                        index.eq(0),
+                        count.eq(Cat(addr, full, lost)),
+                        digit.eq(3),
+                        pointer.eq(Mux(lost, addr, 0)),
+                        remaining.eq(Mux(full, self.DEPTH, addr)),
+                    ]
+                    m.next = "HEADER"
+            with m.State("HEADER"):
+                m.d.comb += [
+                    self.data.eq(header[index]),
+                    self.ack.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.d.sync += index.eq(index + 1)
+                    with m.If(index == len(self.HEADER) - 1):
+                        m.next = "COUNT"
+            with m.State("COUNT"):
+                m.d.comb += [
+                    nibble.eq(count.word_select(digit, 4)),
+                    self.data.eq(hex_digit(nibble)),
+                    self.ack.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.d.sync += digit.eq(digit - 1)
+                    with m.If(digit == 0):
+                        m.next = "NEXT"
+            with m.State("NEXT"):
+                with m.If(remaining == 0):
+                    m.next = "CR"
+                with m.Else():
+                    m.next = "SPACE"
+            with m.State("SPACE"):
+                m.d.comb += [
+                    self.data.eq(ord(' ')),
+                    self.ack.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.d.sync += remaining.eq(remaining - 1)
+                    m.next = "WORD"
+            with m.State("WORD"):  # the read port holds the word until the pointer moves
+                m.d.comb += [
+                    nibble.eq(read.data.word_select(digit, 4)),
+                    self.data.eq(hex_digit(nibble)),
+                    self.ack.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.d.sync += digit.eq(digit - 1)
+                    with m.If(digit == 0):
+                        m.d.sync += pointer.eq(pointer + 1)
+                        m.next = "NEXT"
+            with m.State("CR"):
+                m.d.comb += [
+                    self.data.eq(ord('\r')),
+                    self.ack.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.next = "LF"
+            with m.State("LF"):
+                m.d.comb += [
+                    self.data.eq(ord('\n')),
+                    self.ack.eq(1),
+                    self.last.eq(1),
+                ]
+                with m.If(self.rdy):
+                    m.next = "IDLE"
+
+        return m
@@ -1,3 +1,4 @@
+import argparse
 import os
 import subprocess
 
@@ -5,7 +6,7 @@ from amaranth import *
 from amaranth.build import *
 from amaranth_boards.resources import *
 from amaranth_boards.icestick import *
-from amaranth.lib.cdc import FFSynchronizer
+from amaranth.lib.cdc import FFSynchronizer, ResetSynchronizer
 
 # IO definitions for our LED matric and push button extension
 workshop_pcba = [
@@ -17,92 +18,354 @@ workshop_pcba = [
     # Buttons
     *ButtonResources(pins={1: "4", 2: "3", 3: "6", 4: "7", 5: "5"}, conn=("j", 3),
                      attrs=Attrs(IO_STANDARD="SB_LVCMOS")),
+    # Cascaded LED matrix boards, driven through a chain of 74HC595 shift registers (see `LEDMatrix`)
+    Resource("led_chain", 0,
+             Subsignal("data", Pins("8", dir="o", conn=("j", 3))),
+             Subsignal("clk", Pins("9", dir="o", conn=("j", 3))),
+             Subsignal("latch", Pins("10", dir="o", conn=("j", 3))),
+             Attrs(IO_STANDARD="SB_LVCMOS")),
 ]
 
 
+def pll_parameters(input_frequency, frequency):
+    """Settings of the iCE40 PLL (`SB_PLL40_CORE` with a simple feedback) generating the frequency closest to
+    `frequency` from `input_frequency`, like `icepll` computes them: `(divr, divf, divq, filter_range, output)`"""
+    if not 16e6 <= frequency <= 275e6:
+        raise ValueError(f"the PLL cannot generate {frequency / 1e6:g} MHz, outside of 16 to 275 MHz")
+    best = None
+    for divr in range(16):
+        pfd = input_frequency / (divr + 1)  # phase detector input, between 10 and 133 MHz
+        if not 10e6 <= pfd <= 133e6:
+            continue
+        for divf in range(128):
+            vco = pfd * (divf + 1)  # between 533 and 1066 MHz
+            if not 533e6 <= vco <= 1066e6:
+                continue
+            for divq in range(1, 7):
+                output = vco / 2 ** divq
+                if best is None or abs(output - frequency) < abs(best[-1] - frequency):
+                    filter_range = sum(pfd >= limit for limit in [17e6, 26e6, 44e6, 66e6, 101e6]) + 1
+                    best = divr, divf, divq, filter_range, output
+    if best is None:
+        raise ValueError(f"the PLL cannot generate {frequency / 1e6:g} MHz from {input_frequency / 1e6:g} MHz")
+    return best
+
+
+class PLLPlatform(ICEStickPlatform):
+    """ICEStick platform clocking the `sync` domain from the PLL of the iCE40, at `frequency` Hz
+
+    The PLL generates the frequency closest to `frequency` from the 12 MHz board clock, and it is reported as
+    `default_clk_frequency`: every timer and divisor of the design is derived from it. The design is held in reset
+    until the PLL is locked, and for 15 us after the configuration like with the board clock.
+    """
+    def __init__(self, frequency, **kwargs):
+        super().__init__(**kwargs)
+        *self._pll, self._frequency = pll_parameters(super().default_clk_frequency, frequency)
+
+    @property
+    def default_clk_frequency(self):
+        return self._frequency
+
+    def create_missing_domain(self, name):
+        if name != "sync":
+            return super().create_missing_domain(name)
+        m = Module()
+
+        clk_i = self.request(self.default_clk).i
+        divr, divf, divq, filter_range = self._pll
+        pll_clk = Signal()
+        locked = Signal()
+        m.submodules.pll = Instance("SB_PLL40_CORE",
+                                    p_FEEDBACK_PATH="SIMPLE",
+                                    p_DIVR=divr,
+                                    p_DIVF=divf,
+                                    p_DIVQ=divq,
+                                    p_FILTER_RANGE=filter_range,
+                                    i_REFERENCECLK=clk_i,
+                                    i_RESETB=1,
+                                    i_BYPASS=0,
+                                    o_PLLOUTGLOBAL=pll_clk,
+                                    o_LOCK=locked)
+        self.add_clock_constraint(pll_clk, self._frequency)
+
+        # power-on reset, counted on the board clock (see `ICE40Platform.create_missing_domain`)
+        m.domains += ClockDomain("por", reset_less=True, local=True)
+        delay = int(15e-6 * super().default_clk_frequency)
+        timer = Signal(range(delay))
+        ready = Signal()
+        m.d.comb += ClockSignal("por").eq(clk_i)
+        with m.If(timer == delay):
+            m.d.por += ready.eq(1)
+        with m.Else():
+            m.d.por += timer.eq(timer + 1)
+
+        m.domains += ClockDomain("sync")
+        m.d.comb += ClockSignal("sync").eq(pll_clk)
+        m.submodules.reset_sync = ResetSynchronizer(~ready | ~locked, domain="sync")
+
+        return m
+
+
+def request_button(m, platform, number, registered=False):
+    """Input pin of a button (active low). With `registered=True`, it is sampled by the flip-flop of its IO tile"""
+    if not registered:
+        return platform.request("button", number).i
+    button = platform.request("button", number, xdr=1)  # SB_IO with a registered input (PIN_TYPE 0b000000)
+    m.d.comb += button.i_clk.eq(ClockSignal())
+    return button.i
+
+
 class LEDMatrix(Elaboratable):
     """LED Matrix scanning module.
     You can access the LED rows through the `pixels` array
+
+    With `line=True`, the pixels of the row currently displayed are taken from the `line` input instead, e.g. from
+    a `Compositor` following `row`.
+    With `registered=True`, the LED pins of a single board are driven by the flip-flops of their IO tiles, a cycle
+    later: the clock to output delay no longer depends on the routing from the logic.
+
+    A display of `width` x `height` pixels larger than 8x8 is made of cascaded 8x8 boards, driven through the
+    `led_chain` resource: each board has a 74HC595 shift register for its columns, followed by one for its rows, and
+    the boards are chained from left to right, then from bottom to top. The bits of a row are shifted out at half the
+    clock frequency when `row` changes, and latched once all the boards have been loaded, the previous row staying
+    displayed meanwhile. All the rows are scanned one after the other, so each LED is lit `1 / height` of the time.
+
+    Each row is displayed for `SCAN_CYCLES` cycles of the 12 MHz board clock, at `ROW_FREQUENCY` (about 11.7 kHz).
+    With a faster clock (see `PLLPlatform`), the rows are displayed for more cycles, a power of two, so that the refresh
+    rate stays at least as high. With a slower one (e.g. in simulation), they are still displayed for `SCAN_CYCLES`.
     """
-    def __init__(self):
-        self.pixels = Array(Array(Signal(name=f"col{i}") for i in range(8)) for j in range(8))
+    SCAN_CYCLES = 1024  # clock cycles each row is displayed, at least
+    ROW_FREQUENCY = 12e6 / SCAN_CYCLES  # Hz
+
+    def __init__(self, line=False, registered=False, width=8, height=8):
+        if width % 8 or height % 8:
+            raise ValueError("the display is made of 8x8 boards")
+        self._registered = registered
+        self.width = width
+        self.height = height
+        self.pixels = Array(Array(Signal(name=f"col{i}") for i in range(height)) for j in range(width))
+        self.line = Signal(width) if line else None  # input: pixels of the row currently displayed
+        self.row = Signal(range(height))  # output: index of the row currently displayed
+        self.advance = Signal()  # output: set for a cycle when `row` changes at the next clock edge
+        self.frame = Signal()  # output: set for a cycle when the last row has been displayed
 
     def elaborate(self, platform):
         m = Module()
 
-        # get the Signal() instances representing LEDs output pins
-        led_row = platform.request("led_row", 0).o
-        led_col = platform.request("led_col", 0).o
-
-        timer = Signal(10)  # Clock divisor for row refresh rate
-        row_select = Signal(8, reset=0b1)  # row selection
-        row_cnt = Signal(3)
-        col = Signal(8)
+        width, height = self.width, self.height
+        # a power of two, so that the timer wraps around by itself
+        cycles = int(platform.default_clk_frequency // self.ROW_FREQUENCY)
+        scan_cycles = max(self.SCAN_CYCLES, 1 << max(cycles.bit_length() - 1, 0))
+        timer = Signal(range(scan_cycles))  # Clock divisor for row refresh rate
+        row_select = Signal(height, reset=0b1)  # row selection
+        row_cnt = self.row
+        led_line = Signal(width)  # pixels of the row currently displayed
 
-        # Since we have to command LEDs per row, not per column, rotate the pixels matrix
-        pixels_rows = Array(Signal(8, name=f"row{i}") for i in range(8))
-        for i in range(8):
-            for j in range(8):
-                m.d.comb += pixels_rows[i].eq(Cat(self.pixels[j][i] for j in range(8)))
+        if self.line is not None:
+            m.d.comb += led_line.eq(self.line)
+        else:
+            # Since we have to command LEDs per row, not per column, rotate the pixels matrix
+            pixels_rows = Array(Signal(width, name=f"row{i}") for i in range(height))
+            for i in range(height):
+                m.d.comb += pixels_rows[i].eq(Cat(self.pixels[j][i] for j in range(width)))
+            m.d.comb += led_line.eq(pixels_rows[row_cnt])
 
+        m.d.sync += timer.eq(timer + 1)
         m.d.comb += [
-            led_col.eq(pixels_rows[row_cnt]),
-            led_row.eq(row_select),
+            self.advance.eq(timer == 0),
+            self.frame.eq(self.advance & (row_cnt == height - 1)),
         ]
-        m.d.sync += timer.eq(timer + 1)
-        with m.If(timer == 0):
+        with m.If(self.advance):
             m.d.sync += [
-                row_cnt.eq(row_cnt + 1),
-                row_select.eq(Cat(row_select[7], row_select[0:7])),  # 1 bit circular shift column selection
+                row_cnt.eq(Mux(row_cnt == height - 1, 0, row_cnt + 1)),
+                row_select.eq(row_select.rotate_left(1)),  # 1 bit circular shift row selection
             ]
 
+        if (width, height) == (8, 8):
+            # get the Signal() instances representing LEDs output pins
+            if self._registered:
+                # SB_IO with a registered output (PIN_TYPE 0b010100)
+                led_row_pins = platform.request("led_row", 0, xdr=1)
+                led_col_pins = platform.request("led_col", 0, xdr=1)
+                m.d.comb += [
+                    led_row_pins.o_clk.eq(ClockSignal()),
+                    led_col_pins.o_clk.eq(ClockSignal()),
+                ]
+            else:
+                led_row_pins = platform.request("led_row", 0)
+                led_col_pins = platform.request("led_col", 0)
+            m.d.comb += [
+                led_row_pins.o.eq(row_select),
+                led_col_pins.o.eq(led_line),
+            ]
+            return m
+
+        # cascaded boards: the columns then the rows of each board, the last board shifted first
+        chain = platform.request("led_chain", 0)
+        bits = Cat(Cat(led_line[x:x + 8], row_select[y:y + 8])
+                   for y in range(0, height, 8) for x in range(0, width, 8))
+        if 2 * len(bits) + 2 > scan_cycles:
+            raise ValueError(f"{len(bits) // 16} boards cannot be loaded while a row is displayed")
+        shift = Signal(len(bits))
+        count = Signal(range(len(bits) + 1))  # bits left to shift
+        with m.If(timer == 1):  # `row` has changed, and the line of the new row is composed
+            m.d.sync += [
+                shift.eq(bits),
+                count.eq(len(bits)),
+            ]
+        with m.Elif(count != 0):
+            # the data changes after the falling edges of the shift clock, and is sampled on its rising edges
+            m.d.sync += chain.clk.o.eq(~chain.clk.o)
+            with m.If(chain.clk.o):
+                m.d.sync += [
+                    shift.eq(shift << 1),
+                    count.eq(count - 1),
+                ]
+        m.d.comb += chain.data.o.eq(shift[-1])
+        m.d.sync += chain.latch.o.eq(chain.clk.o & (count == 1))
+
+        return m
+
+
+class Compositor(Elaboratable):
+    """Compose the display from sprites.
+
+    A sprite is a bitmap drawn from position (`x`, `y`), where `x` and `y` are constants or signals: `x` indexes
+    the first dimension of `LEDMatrix.pixels`, and `y` the rows displayed by the LED matrix. Each sprite costs the
+    same logic wherever it is drawn: the bitmap row falling on the display row is selected, then shifted to `x`.
+
+    With `scan=True`, only the display row `row` (input) is composed, to `line` (output), for `LEDMatrix(line=True)`.
+    Otherwise the whole display is composed to the `pixels` array, one row after the other, like `LEDMatrix.pixels`.
+    The display is `width` x `height` pixels.
+    """
+    def __init__(self, scan=True, width=8, height=8):
+        self.scan = scan
+        self.width = width
+        self.height = height
+        self.row = Signal(range(height))  # input: display row to compose, when scanning
+        self.line = Signal(width)  # output: pixels of the display row, when scanning
+        self.pixels = Array(Array(Signal(name=f"col{i}") for i in range(height)) for j in range(width))
+        self._sprites = []
+        self._layers = []
+
+    def add_sprite(self, bitmap, *, x=0, y=0):
+        """Draw `bitmap`, a list of rows from top to bottom. Bit `i` of a row is drawn at `x + i`"""
+        self._sprites.append((bitmap, x, y))
+
+    def add_layer(self, line):
+        """Draw `line`, the pixels of the display row `row` composed by another module (e.g. `Balls`)"""
+        if not self.scan:
+            raise ValueError("layers can only be drawn when scanning")
+        self._layers.append(line)
+
+    def _compose(self, m, row):
+        line = 0
+        for bitmap, x, y in self._sprites:
+            # the sprite row on the display row: the subtraction wraps negative offsets above the bitmap height
+            offset = Signal(range(2 * self.height))
+            bits = Signal(max(len(Value.cast(bitmap_row)) for bitmap_row in bitmap))
+            m.d.comb += offset.eq(row - y)
+            with m.If(offset < len(bitmap)):
+                m.d.comb += bits.eq(Array(bitmap)[offset] if len(bitmap) > 1 else bitmap[0])
+            line |= bits << x
+        for layer in self._layers:
+            line |= layer
+        return line[:self.width] if self._sprites or self._layers else C(0, self.width)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        if self.scan:
+            m.d.comb += self.line.eq(self._compose(m, self.row))
+        else:
+            for i in range(self.height):
+                line = self._compose(m, i)
+                m.d.comb += [self.pixels[j][i].eq(line[j]) for j in range(self.width)]
+
         return m
 
 
 class Racket(Elaboratable):
-    def __init__(self, player=1):
+    """A player's racket, moved by its buttons, or by `driver` (e.g. a `RacketAI`) pressing them instead
+
+    With `registered_buttons=True`, the buttons are sampled in their IO tiles (see `request_button`).
+    With `accelerate=True`, the racket moves as soon as a button is pressed, then again after each interval of
+    `REPEAT_INTERVALS` while it is held, the last one repeating: a short press moves a single pixel, and a long one
+    crosses the field faster and faster. The intervals are counted in milliseconds of the `tick` input, shared by
+    the rackets. The racket moves along the `height` rows of the display.
+    """
+    REPEAT_INTERVALS = [120, 70, 50, 35, 25]  # ms: the repeat delay, then the acceleration ramp
+
+    def __init__(self, player=1, driver=None, registered_buttons=False, accelerate=False, height=8):
         if player not in [1, 2]:
             raise ValueError("player must be 1 or 2")
         self._player = player
-        self.pixels = Array(Signal() for _ in range(8))
+        self._driver = driver
+        self._registered_buttons = registered_buttons
+        self._accelerate = accelerate
+        self.height = height
+        self.pixels = Array(Signal() for _ in range(height))
         self.left = Signal()  # output: set to 1 when the left button is pressed
         self.right = Signal()  # output: set to 1 when the right button is pressed
+        self.tick = Signal()  # input: set for a cycle every millisecond, with `accelerate=True`
         self.move_speed=10
 
     def elaborate(self, platform):
         m = Module()
 
         player = self._player
-        if player == 1:
-            m.submodules += FFSynchronizer(~platform.request("button", 1).i, self.right)
-            m.submodules += FFSynchronizer(~platform.request("button", 2).i, self.left)
+        if self._driver is not None:
+            m.d.comb += [
+                self.right.eq(self._driver.right),
+                self.left.eq(self._driver.left),
+            ]
         else:
-            m.submodules += FFSynchronizer(~platform.request("button", 3).i, self.right)
-            m.submodules += FFSynchronizer(~platform.request("button", 4).i, self.left)
+            right, left = (1, 2) if player == 1 else (3, 4)
+            registered = self._registered_buttons
+            m.submodules += FFSynchronizer(~request_button(m, platform, right, registered), self.right)
+            m.submodules += FFSynchronizer(~request_button(m, platform, left, registered), self.left)
 
         left = self.left
         right = self.right
-        leds = Signal(8, reset=0b00011000)  # The racket is 2 pixel wide
+        leds = Signal(self.height, reset=0b11 << (self.height // 2 - 1))  # The racket is 2 pixel wide
 
         # These signals will be set when the rack has to be moved
         move_left = Signal()
         move_right = Signal()
 
-        # We use a counter to lower the racket speed.
-        # Otherwise, the racket would move at clock speed (12 MHz!)
-        clk_divisor = int(platform.default_clk_frequency // self.move_speed)
-        timer = Signal(range(clk_divisor), reset=clk_divisor)
-        with m.If(timer == 0):
-            with m.If(left | right):
-                m.d.sync += timer.eq(timer.reset),
-            m.d.comb += [
-                # By default, Signal() instances value are 0. Here the move_* signals will be set
-                # for a single clock cycle, each time the button is pressed and timer has expired
-                move_left.eq(left),
-                move_right.eq(right),
-            ]
-        with m.Else():
-            m.d.sync += timer.eq(timer - 1)
+        if self._accelerate:
+            # milliseconds until the next move, looked up in the intervals by the number of moves since the press
+            intervals = Array(self.REPEAT_INTERVALS)
+            repeats = Signal(range(len(self.REPEAT_INTERVALS)))
+            timer = Signal(range(max(self.REPEAT_INTERVALS) + 1))
+            with m.If(~(left | right)):
+                m.d.sync += [timer.eq(0), repeats.eq(0)]
+            with m.Elif((timer == 0) | self.tick & (timer == 1)):  # at the press, then at the last tick of the interval
+                m.d.sync += timer.eq(intervals[repeats])
+                with m.If(repeats != len(self.REPEAT_INTERVALS) - 1):
+                    m.d.sync += repeats.eq(repeats + 1)
+                m.d.comb += [
+                    move_left.eq(left),
+                    move_right.eq(right),
+                ]
+            with m.Elif(self.tick):
+                m.d.sync += timer.eq(timer - 1)
+        else:
+            # We use a counter to lower the racket speed.
+            # Otherwise, the racket would move at clock speed (12 MHz!)
+            clk_divisor = int(platform.default_clk_frequency // self.move_speed)
+            timer = Signal(range(clk_divisor), reset=clk_divisor)
+            with m.If(timer == 0):
+                with m.If(left | right):
+                    m.d.sync += timer.eq(timer.reset),
+                m.d.comb += [
+                    # By default, Signal() instances value are 0. Here the move_* signals will be set
+                    # for a single clock cycle, each time the button is pressed and timer has expired
+                    move_left.eq(left),
+                    move_right.eq(right),
+                ]
+            with m.Else():
+                m.d.sync += timer.eq(timer - 1)
 
         # move racket left and right, making sure it does not go outside of the field
         with m.If(move_left & ~move_right):
@@ -113,23 +376,34 @@ class Racket(Elaboratable):
                 m.d.sync += leds.eq(leds >> 1)
 
         # present the pixels as an Array for easier access
-        for i in range(8):
+        for i in range(self.height):
             m.d.comb += self.pixels[i].eq(leds[i])
 
         return m
 
 
 class Ball(Elaboratable):
+    """The ball, on a display of `width` x `height` pixels, the rackets being on its first and last columns"""
     move_speed = 7
 
-    def __init__(self):
-        self.row = Signal(3, reset=3) # output: ball's row position
-        self.col = Signal(3, reset=1) # output: ball's column position
+    def __init__(self, width=8, height=8):
+        self.width = width
+        self.height = height
+        self.row = Signal(range(height), reset=height // 2 - 1) # output: ball's row position
+        self.col = Signal(range(width), reset=1) # output: ball's column position
         self.move_up = Signal() # input: set the vertical movement direction to up
         self.move_down = Signal() # input: set the vertical movement direction to down
         self.reset = Signal()  # input: set to 1 to reset the ball position
         self.two_scored = Signal()  # player 2 scored
         self.one_scored = Signal()  # player 1 scored
+        self.moved = Signal()  # output: set for a cycle when the ball moves
+        self.tick = Signal()  # output: set for a cycle when the ball moves, or would move if it was served
+        self.enable = Signal(reset=1)  # input: cleared while the clock of the ball is disabled, to clear `tick`
+        self.rebounded = Signal()  # output: set for a cycle when the ball rebounds off a racket
+        self.will_rebound = Signal()  # output: set when the ball rebounds within its next 2 moves, if the racket stays
+        self.moving = Signal()  # output: set while the ball is moving, cleared until it is served
+        self.move_row = Signal()  # output: vertical movement direction, 1 when moving up
+        self.move_col = Signal()  # output: horizontal movement direction, 1 when moving towards player 1
 
     def set_two_racket_pixels(self, racket_pixels):
         self._racket_two_pixels = racket_pixels
@@ -140,13 +414,15 @@ class Ball(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        moving = Signal()
+        width, height = self.width, self.height
+        moving = self.moving
         row = self.row
+        row_mask = Signal(height, reset=1 << row.reset)  # one-hot row, moved along with `row`
         col = self.col
         move_down = self.move_down
         move_up = self.move_up
-        move_row = Signal()
-        move_col = Signal()
+        move_row = self.move_row
+        move_col = self.move_col
 
         # We use a counter to lower the racket speed.
         # Otherwise, the racket would move at clock speed (12 MHz!)
@@ -159,22 +435,41 @@ class Ball(Elaboratable):
             m.d.sync += timer.eq(timer.reset),
         with m.Else():
             m.d.sync += timer.eq(timer - 1)
+        m.d.comb += self.tick.eq((timer == 0) & self.enable)
 
-        # rebound detection
+        # rebound detection: the racket pixels are AND-ed with the one-hot row, instead of being selected by `row`
+        racket_two = Cat(*self._racket_two_pixels)
+        racket_one = Cat(*self._racket_one_pixels)
         rebound = Signal()
-        with m.If((col == 1) & self._racket_two_pixels[row] & ~move_col):
+        with m.If((col == 1) & (racket_two & row_mask).any() & ~move_col):
             m.d.comb += rebound.eq(1)
-        with m.If((col == 6) & self._racket_one_pixels[row] & move_col):
+        with m.If((col == width - 2) & (racket_one & row_mask).any() & move_col):
             m.d.comb += rebound.eq(1)
 
+        # the same detection at the next position of the ball, a move early. The rackets only steer the ball on the
+        # goal columns, so its vertical direction cannot change before the rebound
+        next_row_mask = Signal(height)
+        with m.If(move_row):
+            m.d.comb += next_row_mask.eq(Mux(row_mask[-1], row_mask >> 1, row_mask << 1))
+        with m.Else():
+            m.d.comb += next_row_mask.eq(Mux(row_mask[0], row_mask << 1, row_mask >> 1))
+        with m.If(moving):
+            with m.If(rebound):
+                m.d.comb += self.will_rebound.eq(1)
+            with m.If((col == 2) & (racket_two & next_row_mask).any() & ~move_col):
+                m.d.comb += self.will_rebound.eq(1)
+            with m.If((col == width - 3) & (racket_one & next_row_mask).any() & move_col):
+                m.d.comb += self.will_rebound.eq(1)
+
         with m.If(moving):
             # Horizontal movement
             with m.If(timer == 0):
                 with m.If(rebound):
                     m.d.sync += move_col.eq(~move_col)
+                    m.d.comb += self.rebounded.eq(1)
                 with m.Elif(col == 0):
                     m.d.comb += self.two_scored.eq(1)
-                with m.Elif(col == 7):
+                with m.Elif(col == width - 1):
                     m.d.comb += self.one_scored.eq(1)
                 with m.Else():
                     m.d.sync += timer.eq(timer.reset),
@@ -186,25 +481,34 @@ class Ball(Elaboratable):
             # Vertical movement
             with m.If(timer == 0):
                 m.d.sync += timer.eq(timer.reset),
+                m.d.comb += self.moved.eq(1)
                 with m.If(move_row):  # ball moving up
-                    with m.If(row==7):  # ball is on the ceiling: reverse vertical movement direction
+                    with m.If(row == height - 1):  # ball is on the ceiling: reverse vertical movement direction
                         m.d.sync += [
                             move_row.eq(0),
                             row.eq(row - 1),
+                            row_mask.eq(row_mask.rotate_right(1)),
                         ]
                     with m.Else():
-                        m.d.sync += row.eq(row + 1)
+                        m.d.sync += [
+                            row.eq(row + 1),
+                            row_mask.eq(row_mask.rotate_left(1)),
+                        ]
                 with m.Else():  # ball moving down
                     with m.If(row==0):  # ball is on the floor: reverse vertical movement direction
                         m.d.sync += [
                             move_row.eq(1),
                             row.eq(row + 1),
+                            row_mask.eq(row_mask.rotate_left(1)),
                         ]
                     with m.Else():
-                        m.d.sync += row.eq(row - 1)
+                        m.d.sync += [
+                            row.eq(row - 1),
+                            row_mask.eq(row_mask.rotate_right(1)),
+                        ]
 
             # To change the ball vertical direction using the racket
-            with m.If((col == 0) | (col == 7)):
+            with m.If((col == 0) | (col == width - 1)):
                 with m.If(move_down & ~move_up):
                     m.d.sync += move_row.eq(0)
                 with m.If(move_up & ~move_down):
@@ -218,17 +522,19 @@ class Ball(Elaboratable):
                 m.d.sync += [
                     move_col.eq(~move_col),
                     row.eq(row + 1),
+                    row_mask.eq(row_mask.rotate_left(1)),
                 ]
             with m.Elif(move_down):
                 m.d.sync += [
                     move_col.eq(~move_col),
                     row.eq(row - 1),
+                    row_mask.eq(row_mask.rotate_right(1)),
                 ]
 
         with m.If(self.reset):
-            with m.If(col[-1]): # player one side
+            with m.If(col >= width // 2): # player one side
                 m.d.sync += [
-                    col.eq(6),
+                    col.eq(width - 2),
                     move_col.eq(0),
                 ]
             with m.Else():  # player two side
@@ -243,27 +549,387 @@ class Ball(Elaboratable):
         return m
 
 
+class RacketAI(Elaboratable):
+    """Press the buttons of a racket to play against a human, e.g. `Racket(player=2, driver=RacketAI(ball))`.
+
+    The AI predicts the row of `ball` when it reaches the racket column, and moves the racket there. The prediction
+    is computed in closed form: the bounces off the floor and the ceiling make the row periodic, with a period of
+    `2 * (height - 1)` moves (14 on the 8x8 display). Every `reaction` seconds (rounded to ball moves), the AI aims at
+    the prediction, or `error` rows away from it half of the time, but holds the racket still while the ball is
+    about to rebound on it (`Ball.will_rebound`). It also serves the ball when it is on its side.
+    """
+    def __init__(self, ball, player=2, *, reaction=0.3, error=0):
+        if player not in [1, 2]:
+            raise ValueError("player must be 1 or 2")
+        self._ball = ball
+        self._player = player
+        self._reaction = reaction
+        self._error = error
+        self.left = Signal()  # output: left button
+        self.right = Signal()  # output: right button
+
+    def set_racket_pixels(self, racket_pixels):
+        self._racket_pixels = racket_pixels
+
+    def elaborate(self, platform):
+        m = Module()
+
+        ball = self._ball
+        width, height = ball.width, ball.height
+        racket = Cat(*self._racket_pixels)
+        if self._player == 2:
+            col = ball.col  # distance to the goal
+            towards = ~ball.move_col
+            on_side = ball.col < width // 2
+        else:
+            col = width - 1 - ball.col
+            towards = ball.move_col
+            on_side = ball.col >= width // 2
+
+        # moves until the ball reaches the racket column (1), rebounding on the other racket (6 on the 8x8 display)
+        # when moving away
+        moves = Signal(range(2 * width))
+        m.d.comb += moves.eq(Mux(towards, col - 1, 2 * (width - 2) - col))
+        # position in the period of the vertical movement: on the 8x8 display, 0 to 7 moving up, then 8 to 13 moving
+        # down
+        period = 2 * (height - 1)
+        longest = period + 2 * (width - 2)  # moving down from the top row, away from the racket
+        unwrapped = Signal(range(longest + 1))
+        m.d.comb += unwrapped.eq(Mux(ball.move_row, ball.row, period - ball.row) + moves)
+        # reduced modulo the period by conditional subtractions: one on the 8x8 display, more on wider ones
+        phase = Signal(range(period))
+        remainder = unwrapped
+        for _ in range(longest // period):
+            remainder = Mux(remainder >= period, remainder - period, remainder)
+        m.d.comb += phase.eq(remainder)
+        intercept = Signal(range(height))
+        m.d.comb += intercept.eq(Mux(phase > height - 1, period - phase, phase))
+
+        # the prediction is sampled with a reaction time, and sometimes missed by `error` rows
+        # the reaction time is counted in ball moves, to keep the counter small
+        reaction_moves = max(round(self._reaction * ball.move_speed), 1)
+        reaction = Signal(range(reaction_moves), reset=reaction_moves - 1)
+        random = Signal(8, reset=1)  # LFSR
+        target = Signal(range(height), reset=height // 2 - 1)
+        aim = Signal(range(-height - abs(self._error), height + abs(self._error)))
+        m.d.comb += aim.eq(intercept + Mux(random[0], 0, Mux(random[1], self._error, -self._error)))
+        react = Signal()
+        m.d.comb += react.eq(ball.tick & (reaction == 0))
+        with m.If(react):
+            m.d.sync += [
+                reaction.eq(reaction.reset),
+                random.eq(Cat(random[1:], random[0] ^ random[2] ^ random[3] ^ random[4])),
+                target.eq(Mux(aim < 0, 0, Mux(aim > height - 1, height - 1, aim))),
+            ]
+        with m.Elif(ball.tick):
+            m.d.sync += reaction.eq(reaction - 1)
+
+        # the racket is 2 pixels wide: move until it covers the target
+        below = Signal(height)  # rows below the target
+        m.d.comb += below.eq((1 << target) - 1)
+        with m.If(~ball.moving & on_side):
+            with m.If(react):  # serve
+                m.d.comb += [
+                    self.left.eq(1),
+                    self.right.eq(1),
+                ]
+        with m.Elif(ball.will_rebound & towards):
+            pass  # the racket stays under the ball until it rebounds, whatever the target
+        with m.Elif((racket & (1 << target)) == 0):
+            with m.If((racket & below) == 0):
+                m.d.comb += self.right.eq(1)
+            with m.Else():
+                m.d.comb += self.left.eq(1)
+
+        return m
+
+
+class Balls(Elaboratable):
+    """Several balls, moving like `Ball`.
+
+    The state of the balls is stored in a block RAM, and a single copy of the ball logic updates the balls one
+    after the other, in 2 clock cycles each: reading a ball, then writing it back. The balls only move once every
+    `clk_frequency / move_speed` cycles, so all of them are updated long before the next move, and adding balls
+    costs RAM words instead of logic.
+
+    The rackets steer the balls on their side of the field. A ball reaching a side is served again by the player
+    who lost it, and `reset` serves all the balls again. The balls are drawn on `line` (output), the pixels of the
+    display row `row` (input), to be drawn by a `Compositor` layer. `line` changes along with `row`, on the clock
+    edge following `advance` (input, e.g. `LEDMatrix.advance`). The display is `width` x `height` pixels.
+    """
+    move_speed = Ball.move_speed
+
+    def __init__(self, count=2, width=8, height=8):
+        self.count = count
+        self.width = width
+        self.height = height
+        self.one_up = Signal()  # input: player 1 sets the vertical movement direction to up
+        self.one_down = Signal()  # input: player 1 sets the vertical movement direction to down
+        self.two_up = Signal()  # input: player 2 sets the vertical movement direction to up
+        self.two_down = Signal()  # input: player 2 sets the vertical movement direction to down
+        self.reset = Signal()  # input: set to 1 to serve all the balls again
+        self.two_scored = Signal()  # player 2 scored
+        self.one_scored = Signal()  # player 1 scored
+        self.moved = Signal()  # output: set for a cycle when a ball moves
+        self.rebounded = Signal()  # output: set for a cycle when a ball rebounds off a racket
+        self.row = Signal(range(height))  # input: display row to draw
+        self.advance = Signal()  # input: set for a cycle when `row` changes at the next clock edge
+        self.line = Signal(width)  # output: balls on the display row
+
+    def set_two_racket_pixels(self, racket_pixels):
+        self._racket_two_pixels = racket_pixels
+
+    def set_one_racket_pixels(self, racket_pixels):
+        self._racket_one_pixels = racket_pixels
+
+    def elaborate(self, platform):
+        m = Module()
+
+        clk_divisor = int(platform.default_clk_frequency // self.move_speed)
+        if 2 * self.count > clk_divisor:
+            raise ValueError(f"{self.count} balls cannot be updated every {clk_divisor} cycles")
+        # every ball is drawn while a row is displayed
+        if 2 * self.count > LEDMatrix.SCAN_CYCLES:
+            raise ValueError(f"{self.count} balls cannot be drawn in the {LEDMatrix.SCAN_CYCLES} cycles of a row")
+
+        # ball state: row, col, move_row, move_col, moving. The balls are served in turn by each player.
+        width, height = self.width, self.height
+        row = Signal(range(height))
+        col = Signal(range(width))
+        balls = [(height // 2 - 1 + i // 2) % height | (1 if i % 2 == 0 else width - 2) << len(row)
+                 | (i % 2) << (len(row) + len(col) + 1) for i in range(self.count)]
+        states = Memory(width=len(row) + len(col) + 3, depth=self.count, init=balls, attrs={"ram_style": "block"})
+        m.submodules.read = read = states.read_port(transparent=False)
+        m.submodules.write = write = states.write_port()
+
+        timer = Signal(range(clk_divisor), reset=clk_divisor)
+        with m.If(timer == 0):
+            m.d.sync += timer.eq(timer.reset),
+        with m.Else():
+            m.d.sync += timer.eq(timer - 1)
+
+        # The moves and the resets are applied to all the balls of the next round
+        index = Signal(range(self.count))
+        move = Signal()
+        reset = Signal()
+        round_move = Signal()
+        round_reset = Signal()
+        with m.If(timer == 0):
+            m.d.sync += move.eq(1)
+        with m.If(self.reset):
+            m.d.sync += reset.eq(1)
+
+        # the ball being updated, and its new state
+        move_row = Signal()
+        move_col = Signal()
+        moving = Signal()
+        next_row = Signal(range(height))
+        next_col = Signal(range(width))
+        next_move_row = Signal()
+        next_move_col = Signal()
+        next_moving = Signal()
+        state = Cat(row, col, move_row, move_col, moving)
+        next_state = Cat(next_row, next_col, next_move_row, next_move_col, next_moving)
+        m.d.comb += [
+            state.eq(read.data),
+            next_state.eq(state),
+            read.addr.eq(index),
+            write.addr.eq(index),
+            write.data.eq(next_state),
+        ]
+
+        # the rackets steer the balls on their side
+        one_side = col >= width // 2
+        move_up = Mux(one_side, self.one_up, self.two_up)
+        move_down = Mux(one_side, self.one_down, self.two_down)
+
+        # rebound detection: the racket pixels are AND-ed with the one-hot row, like in `Ball`, decoded once for all
+        # the balls
+        row_mask = Signal(height)
+        m.d.comb += row_mask.eq(1 << row)
+        racket_two = Cat(*self._racket_two_pixels)
+        racket_one = Cat(*self._racket_one_pixels)
+        rebound = Signal()
+        with m.If((col == 1) & (racket_two & row_mask).any() & ~move_col):
+            m.d.comb += rebound.eq(1)
+        with m.If((col == width - 2) & (racket_one & row_mask).any() & move_col):
+            m.d.comb += rebound.eq(1)
+
+        with m.FSM(name="balls"):
+            with m.State("READ"):
+                m.next = "WRITE"
+            with m.State("WRITE"):
+                m.d.comb += write.en.eq(1)
+                m.next = "READ"
+                with m.If(index == self.count - 1):
+                    m.d.sync += [
+                        index.eq(0),
+                        round_move.eq(move | (timer == 0)),
+                        move.eq(0),
+                        round_reset.eq(reset | self.reset),
+                        reset.eq(0),
+                    ]
+                with m.Else():
+                    m.d.sync += index.eq(index + 1)
+
+                with m.If(moving):
+                    with m.If(round_move):
+                        # Horizontal movement
+                        with m.If(rebound):
+                            m.d.comb += [
+                                next_move_col.eq(~move_col),
+                                self.rebounded.eq(1),
+                            ]
+                        with m.Elif(col == 0):
+                            m.d.comb += self.two_scored.eq(1)
+                        with m.Elif(col == width - 1):
+                            m.d.comb += self.one_scored.eq(1)
+                        with m.Elif(move_col):  # ball moving towards player 1
+                            m.d.comb += next_col.eq(col + 1)
+                        with m.Else():  # ball moving towards player 2
+                            m.d.comb += next_col.eq(col - 1)
+
+                        # Vertical movement
+                        m.d.comb += self.moved.eq(1)
+                        with m.If(move_row):  # ball moving up
+                            with m.If(row == height - 1):  # ball is on the ceiling: reverse vertical direction
+                                m.d.comb += [
+                                    next_move_row.eq(0),
+                                    next_row.eq(row - 1),
+                                ]
+                            with m.Else():
+                                m.d.comb += next_row.eq(row + 1)
+                        with m.Else():  # ball moving down
+                            with m.If(row == 0):  # ball is on the floor: reverse vertical movement direction
+                                m.d.comb += [
+                                    next_move_row.eq(1),
+                                    next_row.eq(row + 1),
+                                ]
+                            with m.Else():
+                                m.d.comb += next_row.eq(row - 1)
+
+                    # To change the ball vertical direction using the racket
+                    with m.If((col == 0) | (col == width - 1)):
+                        with m.If(move_down & ~move_up):
+                            m.d.comb += next_move_row.eq(0)
+                        with m.If(move_up & ~move_down):
+                            m.d.comb += next_move_row.eq(1)
+                with m.Else():
+                    with m.If(move_up & move_down):
+                        m.d.comb += next_moving.eq(1)
+                    with m.Elif(~round_move):
+                        pass
+                    with m.Elif(move_up):
+                        m.d.comb += [
+                            next_move_col.eq(~move_col),
+                            next_row.eq(row + 1),
+                        ]
+                    with m.Elif(move_down):
+                        m.d.comb += [
+                            next_move_col.eq(~move_col),
+                            next_row.eq(row - 1),
+                        ]
+
+                with m.If(round_reset | self.one_scored | self.two_scored):
+                    with m.If(one_side):  # player one side
+                        m.d.comb += [
+                            next_col.eq(width - 2),
+                            next_move_col.eq(0),
+                        ]
+                    with m.Else():  # player two side
+                        m.d.comb += [
+                            next_col.eq(1),
+                            next_move_col.eq(1),
+                        ]
+                    m.d.comb += next_moving.eq(0)
+
+        # Draw the balls of the next display row while the current one is displayed, and show them when the row
+        # changes. Every ball is written back once between two row changes.
+        next_line = Signal(width)
+        next_displayed_row = Mux(self.row == height - 1, 0, self.row + 1)
+        ball_pixel = Mux(write.en & (next_row == next_displayed_row), C(1, width) << next_col, 0)[:width]
+        with m.If(self.advance):
+            m.d.sync += [
+                self.line.eq(next_line | ball_pixel),
+                next_line.eq(0),
+            ]
+        with m.Else():
+            m.d.sync += next_line.eq(next_line | ball_pixel)
+
+        return m
+
+
 class ScoreUart(Elaboratable):
-    def __init__(self):
+    """Send the score on the UART each time `update` is set.
+
+    `reports` are additional messages sent on demand: each one is sent when its `command` character is received
+    on the UART (see `instrumentation.ReportFormatter` for their interface).
+    The UART runs at `baudrate`, within 2% of it: a faster clock (see `PLLPlatform`) allows faster baudrates.
+    """
+    def __init__(self, reports=(), baudrate=115200):
         self.score_two = Signal(range(10))
         self.score_one = Signal(range(10))
         self.update = Signal()
+        self.sent = Signal()  # output: set for a cycle when a byte is sent
+        self.busy = Signal()  # output: set while the UART is sending a byte
+        self.starved = Signal()  # output: set while the UART waits for the next byte of a message
+        self._reports = list(reports)
+        self._baudrate = baudrate
 
     def elaborate(self, platform):
         m = Module()
 
-        from amlib.io.serial import AsyncSerialTX
         uart_pins = platform.request("uart")
-        uart = m.submodules.uart = AsyncSerialTX(divisor=int(platform.default_clk_frequency // 115200),
-                                                 pins=uart_pins)
+        divisor = int(platform.default_clk_frequency // self._baudrate)
+        if hasattr(platform, "uart_tx_model"):
+            # simulation platforms can replace the UART with a faster model having the same interface
+            uart = m.submodules.uart = platform.uart_tx_model(divisor=divisor, pins=uart_pins)
+        else:
+            if divisor == 0 or abs(platform.default_clk_frequency / divisor / self._baudrate - 1) > 0.02:
+                raise ValueError(f"{self._baudrate} baud cannot be generated within 2% from "
+                                 f"{platform.default_clk_frequency / 1e6:g} MHz")
+            from amlib.io.serial import AsyncSerialTX
+            uart = m.submodules.uart = AsyncSerialTX(divisor=divisor, pins=uart_pins)
         score_two = self.score_two
         score_one = self.score_one
-        update = self.update
 
-        with m.FSM(name="score_uart"):
+        if self._reports:
+            # remember the updates received while a report is being sent
+            update = Signal()
+            with m.If(self.update):
+                m.d.sync += update.eq(1)
+        else:
+            update = self.update
+
+        if self._reports:
+            # receive the report commands
+            if hasattr(platform, "uart_rx_model"):
+                rx = m.submodules.rx = platform.uart_rx_model(divisor=divisor, pins=uart_pins)
+            else:
+                from amlib.io.serial import AsyncSerialRX
+                rx = m.submodules.rx = AsyncSerialRX(divisor=divisor, pins=uart_pins)
+            m.d.comb += rx.ack.eq(1)
+            for report in self._reports:
+                m.d.comb += report.start.eq(rx.rdy & (rx.data == report.command))
+
+        with m.FSM(name="score_uart") as fsm:
             with m.State("IDLE"):
                 with m.If(update):
+                    if self._reports:
+                        m.d.sync += update.eq(0)
                     m.next = "LEFT"
+                for i, report in enumerate(self._reports):
+                    with m.Elif(report.ack):
+                        m.next = f"REPORT{i}"
+            for i, report in enumerate(self._reports):
+                with m.State(f"REPORT{i}"):
+                    m.d.comb += [
+                        uart.data.eq(report.data),
+                        uart.ack.eq(report.ack),
+                        report.rdy.eq(uart.rdy),
+                    ]
+                    with m.If(uart.rdy & report.last):
+                        m.next = "IDLE"
             with m.State("LEFT"):
                 m.d.comb += [
                     uart.data.eq(ord('0') + score_two),
@@ -300,45 +966,192 @@ class ScoreUart(Elaboratable):
                 with m.If(uart.rdy):
                     m.next = "IDLE"
 
+        m.d.comb += [
+            self.sent.eq(uart.ack & uart.rdy),
+            self.busy.eq(~uart.rdy),
+            self.starved.eq(uart.rdy & ~uart.ack & ~fsm.ongoing("IDLE")),
+        ]
+
         return m
 
 
 class Pong(Elaboratable):
+    """The game.
+
+    With `latency_meter=True`, the latency between the racket buttons and the display is measured, and reported on
+    the UART when `L` is received (see `instrumentation.LatencyMeter`).
+    With `perf_counters=True`, the game events are counted, and reported on the UART when `P` is received and every
+    `perf_period` seconds if set (see `instrumentation.PerfCounters`).
+    With `balls` greater than 1, several balls are played at the same time (see `Balls`).
+    With `ai=True`, player 2 is played by the FPGA (see `RacketAI`, `ai_reaction` and `ai_error`).
+    With `input_recorder=True`, the button presses are recorded, and sent on the UART when `R` is received (see
+    `instrumentation.InputRecorder`), to be replayed in simulation.
+    With `registered_io=True`, the LED pins and the buttons are registered in the IO tiles (SB_IO): the display and
+    the buttons are delayed by a cycle, and the paths between the logic and the pads are out of the timing analysis.
+    With `idle_after` set, the game goes idle when no button has been pressed for `idle_after` seconds while the
+    ball waits to be served: the clock of the ball is disabled, and the display is scanned `IDLE_SCAN_DIVISOR` times
+    slower. Pressing any button wakes it up at once.
+    With `accelerate_rackets=True`, the rackets move at once when a button is pressed, then faster and faster while
+    it is held (see `Racket`), timed by a millisecond timebase shared by both rackets.
+    The game is played on a display of `width` x `height` pixels, made of cascaded 8x8 boards when it is larger
+    (see `LEDMatrix`).
+    The UART runs at `baudrate` (see `ScoreUart`).
+    """
+    IDLE_SCAN_DIVISOR = 8
+
+    def __init__(self, latency_meter=False, perf_counters=False, perf_period=None, balls=1, ai=False,
+                 ai_reaction=0.3, ai_error=0, input_recorder=False, registered_io=False, idle_after=None,
+                 accelerate_rackets=False, width=8, height=8, baudrate=115200):
+        if ai and balls != 1:
+            raise ValueError("the AI can only play with a single ball")
+        if idle_after is not None and balls != 1:
+            raise ValueError("the idle mode is only available with a single ball")
+        self._latency_meter = latency_meter
+        self._perf_counters = perf_counters
+        self._perf_period = perf_period
+        self._balls = balls
+        self._ai = ai
+        self._ai_reaction = ai_reaction
+        self._ai_error = ai_error
+        self._input_recorder = input_recorder
+        self._registered_io = registered_io
+        self._idle_after = idle_after
+        self._accelerate_rackets = accelerate_rackets
+        self._width = width
+        self._height = height
+        self._baudrate = baudrate
+
     def elaborate(self, platform):
         m = Module()
 
         # We add the Matrix module as a submodule. This creates a Module() tree
-        ledm = m.submodules.ledm = LEDMatrix()
+        width, height = self._width, self._height
+        ledm = LEDMatrix(line=True, registered=self._registered_io, width=width, height=height)
+
+        # the idle mode disables the clock of the ball, and of the display scanning most of the time
+        idle = Signal()
+        scan = Signal()  # set when the display scanning is enabled
+        if self._idle_after is not None:
+            # a Johnson counter toggles a single flip-flop per cycle, where a binary counter toggles almost two
+            prescaler = Signal(self.IDLE_SCAN_DIVISOR // 2)
+            with m.If(idle):
+                m.d.sync += prescaler.eq(Cat(~prescaler[-1], prescaler[:-1]))
+            m.d.comb += scan.eq(~idle | (prescaler == 0))
+            m.submodules.ledm = EnableInserter(scan)(ledm)
+        else:
+            m.d.comb += scan.eq(1)
+            m.submodules.ledm = ledm
+
+        # the display is composed while the matrix is scanned
+        display = m.submodules.display = Compositor(width=width, height=height)
+        m.d.comb += [
+            display.row.eq(ledm.row),
+            ledm.line.eq(display.line),
+        ]
+
+        # instrumentation, reported on the UART
+        reports = []
+        if self._latency_meter:
+            from instrumentation import LatencyMeter
+            latency = m.submodules.latency = LatencyMeter(channels=2, rows=height)
+            reports.append(latency.report)
+        if self._perf_counters:
+            from instrumentation import PerfCounters
+            perf = m.submodules.perf = PerfCounters(period=self._perf_period)
+            reports.append(perf.report)
+        if self._input_recorder:
+            from instrumentation import InputRecorder
+            recorder = m.submodules.recorder = InputRecorder()
+            reports.append(recorder)
 
         # broadcast the score on the UART
-        uart = m.submodules.uart = ScoreUart()
+        uart = m.submodules.uart = ScoreUart(reports, self._baudrate)
 
         # our ball
-        ball = m.submodules.ball = Ball()
+        if self._balls == 1:
+            ball = Ball(width, height)
+            if self._idle_after is not None:
+                # the timer of the ball is frozen, at 0 when the ball would have moved
+                m.submodules.ball = EnableInserter(~idle)(ball)
+                m.d.comb += ball.enable.eq(~idle)
+            else:
+                m.submodules.ball = ball
+        else:
+            ball = m.submodules.ball = Balls(self._balls, width, height)
 
         # build Rackets and display them
-        racket_one = m.submodules.racket_one = Racket()
-        racket_two = m.submodules.racket_two = Racket(player=2)
-        for i in range(8):
+        accelerate = self._accelerate_rackets
+        racket_one = m.submodules.racket_one = Racket(registered_buttons=self._registered_io, accelerate=accelerate,
+                                                      height=height)
+        if self._ai:
+            ai = m.submodules.ai = RacketAI(ball, reaction=self._ai_reaction, error=self._ai_error)
+            racket_two = m.submodules.racket_two = Racket(player=2, driver=ai, accelerate=accelerate, height=height)
+            ai.set_racket_pixels(racket_two.pixels)
+        else:
+            racket_two = m.submodules.racket_two = Racket(player=2, registered_buttons=self._registered_io,
+                                                          accelerate=accelerate, height=height)
+        display.add_sprite(list(racket_two.pixels), x=0)
+        display.add_sprite(list(racket_one.pixels), x=width - 1)
+
+        if accelerate:
+            # millisecond timebase of the racket repeat intervals
+            tick_divisor = int(platform.default_clk_frequency // 1000)
+            tick_timer = Signal(range(tick_divisor), reset=tick_divisor - 1)
+            tick = Signal()
+            m.d.comb += tick.eq(tick_timer == 0)
+            with m.If(~idle):
+                m.d.sync += tick_timer.eq(Mux(tick, tick_timer.reset, tick_timer - 1))
+            m.d.comb += [racket_one.tick.eq(tick), racket_two.tick.eq(tick)]
+
+        if self._latency_meter:
+            m.d.comb += latency.row.eq(ledm.row)
+            for i, racket in enumerate([racket_one, racket_two]):
+                m.d.comb += [
+                    latency.presses[i].eq(racket.left | racket.right),
+                    latency.pixels[i].eq(Cat(*racket.pixels)),
+                ]
+
+        if self._perf_counters:
             m.d.comb += [
-                ledm.pixels[0][i].eq(racket_two.pixels[i]),
-                ledm.pixels[7][i].eq(racket_one.pixels[i]),
+                perf.events["frames"].eq(ledm.frame & scan),
+                perf.events["moves"].eq(ball.moved),
+                perf.events["rebounds"].eq(ball.rebounded),
+                perf.events["scores"].eq(ball.one_scored | ball.two_scored),
+                perf.events["bytes"].eq(uart.sent),
+                perf.events["busy"].eq(uart.busy),
+                perf.events["starved"].eq(uart.starved),
             ]
 
+        if self._input_recorder:
+            # buttons 1 to 4, as seen by the rackets, the reset button is added below
+            m.d.comb += recorder.buttons[:4].eq(Cat(racket_one.right, racket_one.left,
+                                                    racket_two.right, racket_two.left))
+
         # pass the racket pixels so that the ball can rebound off it
         ball.set_one_racket_pixels(racket_one.pixels)
         ball.set_two_racket_pixels(racket_two.pixels)
 
-        # allow the racket to change the ball direction only when it's touching the ball
-        with m.If(~ball.col[-1]):
-            m.d.comb += ball.move_up.eq(racket_two.left),
-            m.d.comb += ball.move_down.eq(racket_two.right),
-        with m.If(ball.col[-1]):
-            m.d.comb += ball.move_up.eq(racket_one.left),
-            m.d.comb += ball.move_down.eq(racket_one.right),
+        if self._balls == 1:
+            # allow the racket to change the ball direction only when it's touching the ball
+            with m.If(ball.col < width // 2):
+                m.d.comb += ball.move_up.eq(racket_two.left),
+                m.d.comb += ball.move_down.eq(racket_two.right),
+            with m.If(ball.col >= width // 2):
+                m.d.comb += ball.move_up.eq(racket_one.left),
+                m.d.comb += ball.move_down.eq(racket_one.right),
 
-        # Draw the ball
-        m.d.comb += ledm.pixels[ball.col][ball.row].eq(1)
+            # Draw the ball
+            display.add_sprite([C(1, 1)], x=ball.col, y=ball.row)
+        else:
+            m.d.comb += [
+                ball.one_up.eq(racket_one.left),
+                ball.one_down.eq(racket_one.right),
+                ball.two_up.eq(racket_two.left),
+                ball.two_down.eq(racket_two.right),
+                ball.row.eq(ledm.row),
+                ball.advance.eq(ledm.advance),
+            ]
+            display.add_layer(ball.line)
 
         # Score
         score_one = Signal(4)
@@ -349,13 +1162,15 @@ class Pong(Elaboratable):
         ]
         m.d.sync += uart.update.eq(0)
         with m.If(ball.one_scored):
-            m.d.comb += ball.reset.eq(1),
+            if self._balls == 1:  # the other balls keep moving
+                m.d.comb += ball.reset.eq(1),
             m.d.sync += [
                 uart.update.eq(1),
                 score_one.eq(score_one + 1),
             ]
         with m.If(ball.two_scored):
-            m.d.comb += ball.reset.eq(1),
+            if self._balls == 1:
+                m.d.comb += ball.reset.eq(1),
             m.d.sync += [
                 uart.update.eq(1),
                 score_two.eq(score_two + 1),
@@ -363,7 +1178,9 @@ class Pong(Elaboratable):
 
         # reset button
         reset = Signal()
-        m.submodules += FFSynchronizer(~platform.request("button", 5), reset)
+        m.submodules += FFSynchronizer(~request_button(m, platform, 5, self._registered_io), reset)
+        if self._input_recorder:
+            m.d.comb += recorder.buttons[4].eq(reset)
         with m.If(reset):
             m.d.comb += ball.reset.eq(1),
             m.d.sync += [
@@ -372,9 +1189,28 @@ class Pong(Elaboratable):
                 uart.update.eq(1)
             ]
 
+        if self._idle_after is not None:
+            # go idle once the buttons have been released and the ball parked for `idle_after` seconds
+            pressed = Signal()
+            m.d.comb += pressed.eq(racket_one.left | racket_one.right | racket_two.left | racket_two.right | reset)
+            idle_cycles = int(platform.default_clk_frequency * self._idle_after)
+            idle_timer = Signal(range(idle_cycles + 1), reset=idle_cycles)
+            with m.If(pressed | ball.moving):
+                m.d.sync += idle_timer.eq(idle_timer.reset)
+            with m.Elif(idle_timer != 0):
+                m.d.sync += idle_timer.eq(idle_timer - 1)
+            m.d.comb += idle.eq((idle_timer == 0) & ~pressed)
+
         return m
 
 if __name__ == "__main__":
-    plat = ICEStickPlatform()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pll", type=float, metavar="HZ", help="clock the design from the PLL, e.g. at 48e6 Hz")
+    parser.add_argument("--width", type=int, default=8, help="display width, in pixels (8 per board)")
+    parser.add_argument("--height", type=int, default=8, help="display height, in pixels (8 per board)")
+    parser.add_argument("--baudrate", type=int, default=115200, help="UART baudrate, e.g. 3000000 with --pll 48e6")
+    args = parser.parse_args()
+
+    plat = ICEStickPlatform() if args.pll is None else PLLPlatform(args.pll)
     plat.add_resources(workshop_pcba)
-    plat.build(Pong(), do_program=True, debug_verilog=True)
+    plat.build(Pong(width=args.width, height=args.height, baudrate=args.baudrate), do_program=True, debug_verilog=True)
@@ -0,0 +1,4 @@
+"""Developer tools for the FPGA Pong workshop designs.
+
+Each tool is a module which can be run from the repository root, e.g. `python -m tools.build step_4/solution.py`.
+"""
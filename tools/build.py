@@ -0,0 +1,187 @@
+"""Build a workshop design and record the time and memory spent in each build stage.
+
+    python -m tools.build step_4/solution.py [--program] [--memory] [--build-dir build]
+
+The stages are run one after the other, like `platform.build()` does:
+  * elaborate: Python elaboration of the design (`Fragment.get()`)
+  * generate: RTLIL and Verilog generation, and extraction of the build files
+  * synthesis, place_and_route, pack: each toolchain command of the build script (yosys, nextpnr, icepack)
+  * program: loading the bitstream with iceprog
+
+The results are written to `{build_dir}/{name}.timing.json`, next to the artifacts. The peak memory of the toolchain
+commands is their resident set size. tracemalloc slows down every allocation, so the Python stages are timed without it:
+their peak memory is only measured with `--memory`, by running them a second time under tracemalloc.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from amaranth import Fragment
+from amaranth.build.run import LocalBuildProducts
+
+from .steps import load_design, make_platform
+
+
+# build script variable of each toolchain command, and the name of the corresponding stage
+TOOL_STAGES = {
+    "YOSYS": "synthesis",
+    "NEXTPNR_ICE40": "place_and_route",
+    "ICEPACK": "pack",
+}
+
+
+class BuildTimer:
+    """Collect wall time and peak memory of each build stage
+
+    With `trace_memory`, the Python stages run under tracemalloc: their peak memory is known, but their wall time is
+    inflated by the tracing.
+    """
+
+    def __init__(self, design, trace_memory=False):
+        self.design = design
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def python_stage(self, name):
+        """Time a stage running in this process. Memory is the peak Python allocation during the stage, if traced"""
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+            self._add(name, elapsed, peak)
+
+    def run_command(self, name, command, cwd, preamble=""):
+        """Run a shell command and time it. Memory is the peak resident set size of the command"""
+        start = time.perf_counter()
+        process = subprocess.Popen(["sh", "-c", f"{preamble}\n{command}"], cwd=cwd)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        self._add(name, elapsed, usage.ru_maxrss, command=command)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+    @contextmanager
+    def children_stage(self, name):
+        """Time a stage which spawns commands we do not control (e.g. programming the board)
+
+        The kernel only tracks the largest child process so far, so the peak memory is known only when it exceeds
+        the one of all previous stages.
+        """
+        before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            after = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self._add(name, elapsed, after if after > before else None)
+
+    def add_memory(self, tracer):
+        """Take the peak memory of the Python stages from `tracer`, a `BuildTimer` of a pass tracing the memory"""
+        peaks = {stage["stage"]: stage["peak_memory_kb"] for stage in tracer.stages}
+        for stage in self.stages:
+            if stage["peak_memory_kb"] is None and stage["stage"] in peaks:
+                stage["peak_memory_kb"] = peaks[stage["stage"]]
+
+    def _add(self, name, elapsed, peak_kb, **extra):
+        self.stages.append({"stage": name, "wall_time_s": round(elapsed, 3), "peak_memory_kb": peak_kb, **extra})
+
+    def report(self):
+        return {
+            "design": self.design,
+            "total_wall_time_s": round(sum(stage["wall_time_s"] for stage in self.stages), 3),
+            "stages": self.stages,
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def script_commands(script_path):
+    """Split the generated `build_{name}.sh` script into its environment preamble and its toolchain commands
+
+    Each command is returned as `(tool variable, command line)`, e.g. `("YOSYS", '"$YOSYS" -q -l top.rpt top.ys')`.
+    """
+    preamble, commands = [], []
+    with open(script_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('"$'):
+                commands.append((line[2:line.index('"', 2)], line))
+            elif line:
+                preamble.append(line)
+    return "\n".join(preamble), commands
+
+
+def python_stages(module, top, timer, name, build_dir, **kwargs):
+    """Elaborate `top` for a new platform and generate its build files, returning the platform and the build plan"""
+    platform = make_platform(module)
+    with timer.python_stage("elaborate"):
+        fragment = Fragment.get(top(), platform)
+    with timer.python_stage("generate"):
+        plan = platform.prepare(fragment, name, **kwargs)
+        plan.execute_local(build_dir, run_script=False)
+    return platform, plan
+
+
+def build(design, name="top", build_dir="build", do_program=False, program_opts=None, memory=False, **kwargs):
+    """Build (and optionally program) `design`, returning the `BuildTimer` holding the measurements
+
+    With `memory`, the Python stages are run again under tracemalloc to measure their peak memory.
+    """
+    module, top = load_design(design)
+    timer = BuildTimer(design)
+    os.makedirs(build_dir, exist_ok=True)
+
+    platform, plan = python_stages(module, top, timer, name, build_dir, **kwargs)
+    if memory:
+        # a new platform, as the resources can only be requested once; the build files written are the same
+        tracer = BuildTimer(design, trace_memory=True)
+        python_stages(module, top, tracer, name, build_dir, **kwargs)
+        timer.add_memory(tracer)
+
+    try:
+        preamble, commands = script_commands(os.path.join(build_dir, f"{plan.script}.sh"))
+        for variable, command in commands:
+            stage = TOOL_STAGES.get(variable, variable.lower())
+            timer.run_command(stage, command, cwd=build_dir, preamble=preamble)
+
+        if do_program:
+            with timer.children_stage("program"):
+                platform.toolchain_program(LocalBuildProducts(build_dir), name, **(program_opts or {}))
+    finally:
+        timer.write(os.path.join(build_dir, f"{name}.timing.json"))
+    return timer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("design", help="step name or path/to/file.py[:ClassName]")
+    parser.add_argument("--name", default="top", help="name of the build artifacts")
+    parser.add_argument("--build-dir", default="build")
+    parser.add_argument("--program", action="store_true", help="program the board once built")
+    parser.add_argument("--memory", action="store_true",
+                        help="run the Python stages a second time under tracemalloc to measure their peak memory")
+    args = parser.parse_args()
+
+    timer = build(args.design, name=args.name, build_dir=args.build_dir, do_program=args.program,
+                  memory=args.memory, debug_verilog=True)
+    for stage in timer.stages:
+        memory = "?" if stage["peak_memory_kb"] is None else f'{stage["peak_memory_kb"] / 1024:.1f} MiB'
+        print(f'{stage["stage"]:>16}: {stage["wall_time_s"]:8.2f} s  {memory}')
+    print(f'{"total":>16}: {timer.report()["total_wall_time_s"]:8.2f} s')
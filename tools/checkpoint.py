@@ -0,0 +1,92 @@
+"""Save the state of a simulated design to a file, and restore it into a fresh simulation.
+
+    python -m tools.checkpoint step_4 --uart-model --cycles 50000 -o warm.ckpt
+    python -m tools.sim step_4 --uart-model --restore warm.ckpt --cycles 20000
+
+A checkpoint holds the value of every register of the design (see `Harness.registers()`), memories included, and
+the level of the buttons, in a gzipped JSON file along with the design, its options and the clock frequency. A
+regression suite can warm a game up once, then branch many scenarios from the checkpoint instead of simulating each
+one from the reset. `tools.golden` models the Pong game in Python and reads and writes the same checkpoints, so that
+a run can move between the model and the simulator.
+
+The simulation processes are not part of a checkpoint: it should be taken while the UART receiver model has no
+byte to deliver, and the bytes sent on the UART before it are not kept.
+"""
+import gzip
+import json
+
+from . import pysim
+from .sim import Harness, argument_parser
+
+
+FORMAT = 1
+
+
+def _settings(harness):
+    """Settings of the simulation, which must be the same to restore a checkpoint"""
+    return {
+        "design": harness.design,
+        "options": harness.kwargs,
+        "frequency": harness.clk_frequency,
+        "uart_model": harness.uart_model,
+        "uart_latency": harness.uart_latency,
+    }
+
+
+def snapshot(harness):
+    """Checkpoint of the current state of a harness, as a dict"""
+    return {
+        "format": FORMAT,
+        **_settings(harness),
+        "cycles": harness.cycles,
+        "registers": {path: harness.value(signal) for path, signal in harness.registers()},
+        "buttons": {str(number): harness.value(harness.button(number))
+                    for name, number in harness.pins if name == "button"},
+    }
+
+
+def restore(harness, checkpoint):
+    """Load a checkpoint into a harness which has not run yet. The simulation goes on from the cycle of the
+    checkpoint"""
+    if harness.cycles:
+        raise ValueError("a checkpoint can only be restored before the simulation runs")
+    if checkpoint.get("format") != FORMAT:
+        raise ValueError(f"unknown checkpoint format {checkpoint.get('format')!r}")
+    for key, value in _settings(harness).items():
+        if json.loads(json.dumps(value)) != checkpoint[key]:
+            raise ValueError(f"the checkpoint was taken with {key} {checkpoint[key]!r}, not {value!r}")
+    registers = dict(harness.registers())
+    if registers.keys() != checkpoint["registers"].keys():
+        different = sorted(registers.keys() ^ checkpoint["registers"].keys())
+        raise ValueError(f"the registers of the design differ from the checkpoint: {', '.join(different)}")
+
+    values = [(registers[path], value) for path, value in checkpoint["registers"].items()]
+    values += [(harness.button(int(number)), value) for number, value in checkpoint["buttons"].items()]
+    for signal, value in values:
+        pysim.set_value(harness.sim, signal, value)
+    harness.cycles = checkpoint["cycles"]
+    pysim.set_now(harness.sim, harness.cycles * harness._clock_period)
+
+
+def save(checkpoint, path):
+    with gzip.open(path, "wt") as f:
+        json.dump(checkpoint, f, separators=(",", ":"))
+
+
+def load(path):
+    with gzip.open(path, "rt") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argument_parser(__doc__)
+    parser.add_argument("-o", "--output", default="pong.ckpt", help="checkpoint file")
+    args = parser.parse_args()
+
+    harness = Harness(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                      fast_forward=args.fast_forward, **dict(args.option))
+    harness.add_process(harness.random_buttons(args.seed))
+    harness.run(args.cycles)
+    checkpoint = snapshot(harness)
+    save(checkpoint, args.output)
+    print(f"{len(checkpoint['registers'])} registers saved to {args.output} at cycle {harness.cycles}")
@@ -0,0 +1,155 @@
+"""Profile the elaboration of a workshop design, to find where the netlist starts to blow up before synthesis does.
+
+    python -m tools.elabprof step_3 [--json profile.json]
+
+For each Elaboratable of the hierarchy, the report shows:
+  * assigns: number of assignment statements (including the ones nested in If/Elif/Else, Switch and FSM), and the
+    total number of bits they assign
+  * switches: number of Switch statements (each If/Elif/Else chain, Switch or FSM creates one)
+  * signals: number of signals referenced by the statements, and the number of signals driven
+  * arrays: number of `Array` accesses using a Signal as index (`ArrayProxy`) and the total number of elements they
+    select from. Each of them is expanded into a multiplexer (or a decoder when assigned) over all the elements.
+  * time: elaboration time of the Elaboratable itself, and including its submodules
+"""
+import argparse
+import json
+import time
+from contextlib import contextmanager
+
+from amaranth import Fragment
+from amaranth.hdl.ast import ArrayProxy, Assign, Cat, Operator, Part, Property, SignalSet, Slice, Switch
+
+from .steps import load_design, make_platform
+
+
+class ElaborationStats:
+    def __init__(self, path, elaboratable):
+        self.path = path
+        self.elaboratable = elaboratable
+        self.assigns = 0
+        self.assigned_bits = 0
+        self.switches = 0
+        self.signals = 0
+        self.driven_signals = 0
+        self.array_proxies = 0
+        self.array_elements = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _StatementCounter:
+    """Count statements, referenced signals and Array accesses of a fragment"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def on_statements(self, statements):
+        for stmt in statements:
+            if isinstance(stmt, Assign):
+                self.stats.assigns += 1
+                self.stats.assigned_bits += len(stmt.lhs)
+                self.on_value(stmt.lhs)
+                self.on_value(stmt.rhs)
+            elif isinstance(stmt, Switch):
+                self.stats.switches += 1
+                self.on_value(stmt.test)
+                for case_stmts in stmt.cases.values():
+                    self.on_statements(case_stmts)
+            elif isinstance(stmt, Property):
+                self.on_value(stmt.test)
+
+    def on_value(self, value):
+        if isinstance(value, ArrayProxy):
+            self.stats.array_proxies += 1
+            self.stats.array_elements += len(value.elems)
+            self.on_value(value.index)
+            for elem in value._iter_as_values():
+                self.on_value(elem)
+        elif isinstance(value, Operator):
+            for operand in value.operands:
+                self.on_value(operand)
+        elif isinstance(value, Cat):
+            for part in value.parts:
+                self.on_value(part)
+        elif isinstance(value, Part):
+            self.on_value(value.value)
+            self.on_value(value.offset)
+        elif isinstance(value, Slice):
+            self.on_value(value.value)
+
+
+@contextmanager
+def _timed_elaboration(timings):
+    """Record the elaboratable and the inclusive elaboration time of each fragment returned by `Fragment.get()`"""
+    original_get = Fragment.get
+
+    def timed_get(obj, platform):
+        start = time.perf_counter()
+        fragment = original_get(obj, platform)
+        if fragment is not obj:
+            timings[id(fragment)] = (obj, time.perf_counter() - start)
+        return fragment
+
+    Fragment.get = staticmethod(timed_get)
+    try:
+        yield
+    finally:
+        Fragment.get = staticmethod(original_get)
+
+
+def profile(elaboratable, platform):
+    """Elaborate `elaboratable` and return the `ElaborationStats` of each node of its hierarchy, parents first"""
+    timings = {}
+    with _timed_elaboration(timings):
+        fragment = Fragment.get(elaboratable, platform)
+
+    results = []
+
+    def visit(fragment, path):
+        obj, total_time = timings.get(id(fragment), (fragment, 0.0))
+        stats = ElaborationStats(path, type(obj).__name__)
+        stats.total_time = total_time
+        stats.self_time = total_time - sum(timings.get(id(subfragment), (None, 0.0))[1]
+                                           for subfragment, _ in fragment.subfragments)
+        _StatementCounter(stats).on_statements(fragment.statements)
+        referenced = SignalSet()
+        for stmt in fragment.statements:
+            referenced |= stmt._lhs_signals() | stmt._rhs_signals()
+        stats.signals = len(referenced)
+        stats.driven_signals = sum(len(signals) for signals in fragment.drivers.values())
+        results.append(stats)
+        for index, (subfragment, name) in enumerate(fragment.subfragments):
+            visit(subfragment, f"{path}.{name if name is not None else f'U${index}'}")
+
+    visit(fragment, "top")
+    return results
+
+
+def print_report(results):
+    print(f'{"module":<36} {"class":<16} {"assigns":>12} {"switches":>8} {"signals":>9} {"arrays":>10} '
+          f'{"self ms":>8} {"total ms":>9}')
+    for stats in results:
+        depth = stats.path.count(".")
+        name = "  " * depth + stats.path.rsplit(".", 1)[-1]
+        signals = f"{stats.signals}/{stats.driven_signals}"
+        assigns = f"{stats.assigns}/{stats.assigned_bits}"
+        arrays = f"{stats.array_proxies}/{stats.array_elements}"
+        print(f"{name:<36} {stats.elaboratable:<16} {assigns:>12} {stats.switches:>8} {signals:>9} "
+              f"{arrays:>10} {stats.self_time * 1e3:>8.2f} {stats.total_time * 1e3:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("design", help="step name or path/to/file.py[:ClassName]")
+    parser.add_argument("--json", metavar="FILE", help="also write the report to a JSON file")
+    args = parser.parse_args()
+
+    module, top = load_design(args.design)
+    results = profile(top(), make_platform(module))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([stats.as_dict() for stats in results], f, indent=2)
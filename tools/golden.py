@@ -0,0 +1,330 @@
+"""Python model of the step 4 Pong game, computing its registers cycle by cycle.
+
+    python -m tools.golden warm.ckpt --cycles 20000 [--seed 0] [-o after.ckpt]
+
+The model is the reference the simulations can be checked against: from the level of the buttons, it computes the
+next value of every register of `Pong()` (one ball, no instrumentation) simulated with `uart_model=True`, under
+the same paths as `Harness.registers()`. It starts from the reset, or from a `tools.checkpoint` file, and saves its
+state as a checkpoint: a run can go on in the simulator, or come back to the model. The bytes sent on the UART are
+collected in `sent`.
+"""
+import argparse
+import functools
+import random
+
+from amaranth.hdl.ast import Assign, Signal, SignalDict
+
+from . import checkpoint as checkpoints
+from .sim import SIM_CLK_FREQUENCY, Harness
+
+
+# encoding of the `ScoreUart` FSM states
+IDLE, LEFT, DASH, RIGHT, NEWLINE, NEWLINE2 = range(6)
+
+# module and signal synchronized by the FFSynchronizer of each button ("" is the top module)
+BUTTON_SIGNALS = {
+    1: ("racket_one", "right"),
+    2: ("racket_one", "left"),
+    3: ("racket_two", "right"),
+    4: ("racket_two", "left"),
+    5: ("", "reset"),
+}
+
+
+def find_synchronizers(harness):
+    """Path of the FFSynchronizer of each button in a harness of `Pong()`, found by the signal driven by its last
+    stage and the module it is in. The unnamed synchronizers are numbered by their position in the hierarchy"""
+    outputs = SignalDict()  # signal driven by each signal of the design
+    fragments = [harness.fragment]
+    while fragments:
+        fragment = fragments.pop()
+        fragments += [subfragment for subfragment, _ in fragment.subfragments]
+        for statement in fragment.statements:
+            if isinstance(statement, Assign) and isinstance(statement.rhs, Signal):
+                outputs[statement.rhs] = statement.lhs
+    buttons = {signal: number for number, signal in BUTTON_SIGNALS.items()}
+    synchronizers = {}
+    for path, signal in harness.registers():
+        if signal.name == "stage1" and signal in outputs:
+            prefix = path.rpartition(".")[0]
+            number = buttons.get((prefix.rpartition(".")[0], outputs[signal].name))
+            if number is not None:
+                synchronizers[number] = prefix
+    if synchronizers.keys() != BUTTON_SIGNALS.keys():
+        missing = sorted(BUTTON_SIGNALS.keys() - synchronizers.keys())
+        raise ValueError(f"no synchronizer found for the buttons {missing}")
+    return synchronizers
+
+
+@functools.cache
+def _synchronizers():
+    return find_synchronizers(Harness(PongModel.design, uart_model=True))
+
+
+def _rotate_left(mask):
+    return (mask << 1 | mask >> 7) & 0xff
+
+
+def _rotate_right(mask):
+    return (mask >> 1 | mask << 7) & 0xff
+
+
+class PongModel:
+    """Cycle by cycle model of `Pong()`, simulated at `frequency`"""
+    design = "step_4"
+
+    def __init__(self, frequency=SIM_CLK_FREQUENCY, *, uart_latency=1):
+        self.frequency = frequency
+        self.uart_latency = uart_latency
+        self.cycles = 0
+        self.sent = bytearray()
+        self.synchronizers = _synchronizers()  # path of the FFSynchronizer of each button
+        self.buttons = {number: 1 for number in self.synchronizers}  # active low
+        self._racket_reload = int(frequency // 10)
+        self._ball_reload = int(frequency // 7)
+        self.registers = {
+            "update": 0,
+            "score_one": 0,
+            "score_two": 0,
+            "ledm.timer": 0,
+            "ledm.row": 0,
+            "ledm.row_select": 0b1,
+            "uart.score_uart_state": IDLE,
+            "uart.uart._sent": 0,
+            "uart.uart.busy": 0,
+            "uart.uart._byte": 0,
+            "ball.timer": self._ball_reload,
+            "ball.move_col": 0,
+            "ball.col": 1,
+            "ball.move_row": 0,
+            "ball.row": 3,
+            "ball.row_mask": 1 << 3,
+            "ball.moving": 0,
+        }
+        for racket in ["racket_one", "racket_two"]:
+            self.registers[f"{racket}.timer"] = self._racket_reload
+            self.registers[f"{racket}.leds"] = 0b00011000
+        for prefix in self.synchronizers.values():
+            self.registers[f"{prefix}.stage0"] = 0
+            self.registers[f"{prefix}.stage1"] = 0
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint):
+        settings = {"design": cls.design, "options": {}, "uart_model": True}
+        for key, value in settings.items():
+            if checkpoint[key] != value:
+                raise ValueError(f"the model needs a checkpoint taken with {key} {value!r}, not {checkpoint[key]!r}")
+        model = cls(checkpoint["frequency"], uart_latency=checkpoint["uart_latency"])
+        if checkpoint["registers"].keys() != model.registers.keys():
+            raise ValueError("the registers of the checkpoint are not the ones of the model")
+        model.registers.update(checkpoint["registers"])
+        model.buttons.update({int(number): value for number, value in checkpoint["buttons"].items()})
+        model.cycles = checkpoint["cycles"]
+        return model
+
+    def checkpoint(self):
+        return {
+            "format": checkpoints.FORMAT,
+            "design": self.design,
+            "options": {},
+            "frequency": self.frequency,
+            "uart_model": True,
+            "uart_latency": self.uart_latency,
+            "cycles": self.cycles,
+            "registers": dict(self.registers),
+            "buttons": {str(number): value for number, value in self.buttons.items()},
+        }
+
+    def press(self, number):
+        self.buttons[number] = 0
+
+    def release(self, number):
+        self.buttons[number] = 1
+
+    def run(self, cycles):
+        for _ in range(cycles):
+            self.step()
+
+    def step(self):
+        """Compute the registers after the next clock edge"""
+        r = self.registers
+        n = dict(r)
+
+        for number, prefix in self.synchronizers.items():
+            n[f"{prefix}.stage0"] = 1 - self.buttons[number]
+            n[f"{prefix}.stage1"] = r[f"{prefix}.stage0"]
+        right_one, left_one, right_two, left_two, reset = (r[f"{self.synchronizers[number]}.stage1"]
+                                                          for number in range(1, 6))
+
+        # LED matrix scanning
+        n["ledm.timer"] = (r["ledm.timer"] + 1) % 1024
+        if r["ledm.timer"] == 0:
+            n["ledm.row"] = (r["ledm.row"] + 1) % 8
+            n["ledm.row_select"] = _rotate_left(r["ledm.row_select"])
+
+        self._racket(r, n, "racket_one", left_one, right_one)
+        self._racket(r, n, "racket_two", left_two, right_two)
+        if r["ball.col"] & 4:
+            move_up, move_down = left_one, right_one
+        else:
+            move_up, move_down = left_two, right_two
+        one_scored, two_scored = self._ball(r, n, move_up, move_down, reset)
+
+        # score
+        n["update"] = 0
+        if one_scored:
+            n["update"] = 1
+            n["score_one"] = (r["score_one"] + 1) % 16
+        if two_scored:
+            n["update"] = 1
+            n["score_two"] = (r["score_two"] + 1) % 16
+        if reset:
+            n["score_one"] = n["score_two"] = 0
+            n["update"] = 1
+
+        self._uart(r, n)
+
+        self.registers = n
+        self.cycles += 1
+
+    def _racket(self, r, n, racket, left, right):
+        timer = r[f"{racket}.timer"]
+        leds = r[f"{racket}.leds"]
+        move_left = move_right = 0
+        if timer == 0:
+            if left or right:
+                n[f"{racket}.timer"] = self._racket_reload
+            move_left, move_right = left, right
+        else:
+            n[f"{racket}.timer"] = timer - 1
+        if move_left and not move_right:
+            if not leds & 0x80:
+                n[f"{racket}.leds"] = leds << 1
+        elif move_right and not move_left:
+            if not leds & 0x01:
+                n[f"{racket}.leds"] = leds >> 1
+
+    def _ball(self, r, n, move_up, move_down, reset):
+        """Update the ball, and return `(one_scored, two_scored)`"""
+        timer, col, row, row_mask = r["ball.timer"], r["ball.col"], r["ball.row"], r["ball.row_mask"]
+        move_col, move_row = r["ball.move_col"], r["ball.move_row"]
+        one_scored = two_scored = 0
+
+        rebound = (col == 1 and r["racket_two.leds"] & row_mask and not move_col
+                   or col == 6 and r["racket_one.leds"] & row_mask and move_col)
+        n["ball.timer"] = self._ball_reload if timer == 0 else timer - 1
+
+        if r["ball.moving"]:
+            if timer == 0:
+                if rebound:
+                    n["ball.move_col"] = 1 - move_col
+                elif col == 0:
+                    two_scored = 1
+                elif col == 7:
+                    one_scored = 1
+                else:
+                    n["ball.col"] = col + 1 if move_col else col - 1
+
+                if move_row:
+                    if row == 7:  # ceiling
+                        n["ball.move_row"] = 0
+                        n["ball.row"], n["ball.row_mask"] = row - 1, _rotate_right(row_mask)
+                    else:
+                        n["ball.row"], n["ball.row_mask"] = row + 1, _rotate_left(row_mask)
+                else:
+                    if row == 0:  # floor
+                        n["ball.move_row"] = 1
+                        n["ball.row"], n["ball.row_mask"] = row + 1, _rotate_left(row_mask)
+                    else:
+                        n["ball.row"], n["ball.row_mask"] = row - 1, _rotate_right(row_mask)
+
+            if col in (0, 7):  # the racket changes the vertical direction
+                if move_down and not move_up:
+                    n["ball.move_row"] = 0
+                if move_up and not move_down:
+                    n["ball.move_row"] = 1
+        elif move_up and move_down:
+            n["ball.moving"] = 1
+        elif timer == 0 and move_up:  # serve: the ball follows the racket
+            n["ball.move_col"] = 1 - move_col
+            n["ball.row"], n["ball.row_mask"] = (row + 1) % 8, _rotate_left(row_mask)
+        elif timer == 0 and move_down:
+            n["ball.move_col"] = 1 - move_col
+            n["ball.row"], n["ball.row_mask"] = (row - 1) % 8, _rotate_right(row_mask)
+
+        if one_scored or two_scored or reset:
+            if col & 4:  # player one side
+                n["ball.col"], n["ball.move_col"] = 6, 0
+            else:
+                n["ball.col"], n["ball.move_col"] = 1, 1
+            n["ball.moving"] = 0
+
+        return one_scored, two_scored
+
+    def _uart(self, r, n):
+        """`ScoreUart` and the UART transmitter model"""
+        state = r["uart.score_uart_state"]
+        rdy = r["uart.uart.busy"] == 0
+        data = None
+        if state == IDLE:
+            if r["update"]:
+                n["uart.score_uart_state"] = LEFT
+        else:
+            data, following = {
+                LEFT: (ord('0') + r["score_two"], DASH),
+                DASH: (ord('-'), RIGHT),
+                RIGHT: (ord('0') + r["score_one"], NEWLINE),
+                NEWLINE: (ord('\r'), NEWLINE2),
+                NEWLINE2: (ord('\n'), IDLE),
+            }[state]
+            if rdy:
+                n["uart.score_uart_state"] = following
+
+        n["uart.uart._sent"] = 0
+        if not rdy:
+            n["uart.uart.busy"] = r["uart.uart.busy"] - 1
+        elif data is not None:
+            n["uart.uart.busy"] = self.uart_latency
+            n["uart.uart._byte"] = data % 256
+            n["uart.uart._sent"] = 1
+            self.sent.append(data % 256)
+
+
+def random_buttons(model, cycles, seed=0, *, mean_interval=200):
+    """Run the model for `cycles` cycles, pressing and releasing the racket buttons like `Harness.random_buttons()`"""
+    rng = random.Random(seed)
+    pressed = set()
+    while True:
+        wait = rng.randrange(1, 2 * mean_interval)
+        if wait > cycles:
+            model.run(cycles)
+            return
+        model.run(wait)
+        cycles -= wait
+        number = rng.choice([1, 2, 3, 4])
+        if number in pressed:
+            pressed.remove(number)
+            model.release(number)
+        else:
+            pressed.add(number)
+            model.press(number)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checkpoint", nargs="?", help="start from this checkpoint instead of the reset")
+    parser.add_argument("--cycles", type=int, default=20000, help="number of clock cycles to run")
+    parser.add_argument("--frequency", type=float, default=SIM_CLK_FREQUENCY,
+                        help="simulated clock frequency, without checkpoint")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random button presses")
+    parser.add_argument("-o", "--output", metavar="FILE", help="save the state to a checkpoint")
+    args = parser.parse_args()
+
+    if args.checkpoint:
+        model = PongModel.from_checkpoint(checkpoints.load(args.checkpoint))
+    else:
+        model = PongModel(args.frequency)
+    random_buttons(model, args.cycles, args.seed)
+    print(model.sent.decode(errors="replace"), end="")
+    if args.output:
+        checkpoints.save(model.checkpoint(), args.output)
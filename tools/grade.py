@@ -0,0 +1,254 @@
+"""Grade the exercise files of the workshop attendees against the step solutions.
+
+    python -m tools.grade seats/ [-j 8] [--cycles 20000] [--seed 0] [--fast-forward] [--json grades.json]
+
+`seats/` holds a directory per attendee, with the exercise files they edited at the same paths as in the repository:
+`seats/alice/step_2/workshop.py`, `seats/alice/step_3/exercise.py`, `seats/alice/step_4/exercice.py`. Each exercise
+is simulated with the same random button presses as the solution of its step (the racket buttons, and for steps 3
+and 4 short presses on the reset button), and its outputs are compared: the LED matrix pins at every cycle, and the
+bytes sent on the UART (modeled, see `tools.uart_model`), whose timing may differ. The first divergence is reported
+for each exercise, with the cycle it happens at.
+
+The traces of the solutions are computed once and cached in `--cache`, keyed by the source files of the step, the
+stimulus and the number of cycles. The exercises are simulated by a process pool. The attendee code is run as is.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import time
+from functools import lru_cache
+
+from amaranth.hdl.ast import SignalDict
+
+from . import pysim
+from .sim import SIM_CLK_FREQUENCY, Harness
+from .steps import DESIGNS, ROOT
+
+
+FORMAT = 1
+
+# Exercise file of each step
+EXERCISES = {
+    "step_2": "step_2/workshop.py",
+    "step_3": "step_3/exercise.py",
+    "step_4": "step_4/exercice.py",
+}
+
+# The bytes sent by the solution in the last cycles of the simulation may not have been sent yet by a correct exercise
+UART_SLACK = 100
+
+
+class _OutputRecorder:
+    """Record the changes of the output pins of a harness, and the bytes sent by its UART models.
+    Registered with the simulator as if it was a VCD writer"""
+
+    def __init__(self, harness):
+        self._period = harness._clock_period
+        self._names = SignalDict()
+        for (name, number), pins in harness.pins.items():
+            if hasattr(pins, "o"):
+                self._names[pins.o] = f"{name}{number}"
+        self._models = SignalDict((model._sent, model._byte) for model in harness.uart_models)
+        self.harness = harness
+        self.pins = []  # [cycle, name, value] of each change
+        self.uart = []  # [cycle, byte] of each byte sent
+        pysim.observers(harness.sim).append(self)
+
+    def update(self, timestamp, signal, value):
+        if signal in self._names:
+            self.pins.append([timestamp // self._period, self._names[signal], value])
+        elif value and signal in self._models:
+            self.uart.append([timestamp // self._period, self.harness.value(self._models[signal])])
+
+    def close(self, timestamp):
+        pass
+
+    def trace(self):
+        return {
+            "widths": {name: len(signal) for signal, name in self._names.items()},
+            "pins": self.pins,
+            "uart": self.uart,
+        }
+
+
+def _reset_presses(harness, seed, *, mean_interval=5000):
+    """Process pressing the reset button for a few cycles, at random"""
+    rng = random.Random(f"reset {seed}")
+
+    def process():
+        while True:
+            yield harness.wait(rng.randrange(1, 2 * mean_interval))
+            yield harness.press(5)
+            yield harness.wait(10)
+            yield harness.release(5)
+    return process
+
+
+def simulate(design, *, cycles, seed=0, frequency=SIM_CLK_FREQUENCY, fast_forward=False):
+    """Trace the outputs of `design` under the random button presses of `seed`"""
+    harness = Harness(design, clk_frequency=frequency, uart_model=True, fast_forward=fast_forward)
+    return record(harness, cycles=cycles, seed=seed)
+
+
+def record(harness, *, cycles, seed=0):
+    """Trace the outputs of a harness which has not run yet (with `uart_model=True`) for `cycles` cycles, under the
+    random button presses of `seed`"""
+    recorder = _OutputRecorder(harness)
+    harness.add_process(harness.random_buttons(seed))
+    if ("button", 5) in harness.pins:
+        harness.add_process(_reset_presses(harness, seed))
+    harness.run(cycles)
+    return recorder.trace()
+
+
+def _pin_states(trace):
+    """Cycles at which the pins change, with the value of every pin after the changes of that cycle"""
+    values = {name: 0 for name in trace["widths"]}
+    for cycle, name, value in trace["pins"]:
+        values[name] = value
+        yield cycle, dict(values)
+
+
+def first_divergence(expected, actual, cycles):
+    """`(cycle, description)` of the first difference between the traces of a solution and an exercise, or None"""
+    if expected["widths"] != actual["widths"]:
+        return 0, f"the pins {sorted(actual['widths'])} are used instead of {sorted(expected['widths'])}"
+    divergences = []
+
+    # merge the pin changes of both traces, and compare the pins at the end of each cycle where one of them changes
+    changes = sorted([(cycle, 0, state) for cycle, state in _pin_states(expected)]
+                     + [(cycle, 1, state) for cycle, state in _pin_states(actual)], key=lambda change: change[:2])
+    states = [{name: 0 for name in expected["widths"]}] * 2  # of the solution and the exercise
+    for index, (cycle, trace, state) in enumerate(changes):
+        states[trace] = state
+        if index + 1 < len(changes) and changes[index + 1][0] == cycle:
+            continue
+        solution, exercise = states
+        if solution != exercise:
+            divergences.append((cycle, ", ".join(f"{name} {exercise[name]:0{width}b} instead of "
+                                                 f"{solution[name]:0{width}b}"
+                                                 for name, width in expected["widths"].items()
+                                                 if exercise[name] != solution[name])))
+            break
+
+    # the bytes sent on the UART, whatever their timing
+    sent, expected_sent = (bytes(byte for _, byte in trace["uart"]) for trace in (actual, expected))
+    length = min(len(sent), len(expected_sent))
+    index = next((index for index in range(length) if sent[index] != expected_sent[index]), length)
+    if index < length:
+        cycle = min(actual["uart"][index][0], expected["uart"][index][0])
+    elif len(sent) != len(expected_sent):  # one of them sent more bytes
+        cycle = (expected if len(expected_sent) > length else actual)["uart"][index][0]
+        if cycle >= cycles - UART_SLACK:
+            cycle = None
+    else:
+        cycle = None
+    if cycle is not None:
+        start = expected_sent.rfind(b"\n", 0, index) + 1
+        divergences.append((cycle, f"UART sent {sent[start:index + 1]!r} "
+                                   f"instead of {expected_sent[start:index + 1]!r}"))
+
+    return min(divergences, default=None)
+
+
+def _sources_hash(step, **settings):
+    """Key of the trace of a step solution: its sources (the modules of its directory), and the simulation settings"""
+    digest = hashlib.sha256(json.dumps([FORMAT, step, settings], sort_keys=True).encode())
+    directory = os.path.join(ROOT, os.path.dirname(DESIGNS[step]))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py"):
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read())
+    return digest.hexdigest()[:16]
+
+
+def solution_trace_path(cache, step, **settings):
+    return os.path.join(cache, f"{step}-{_sources_hash(step, **settings)}.json.gz")
+
+
+def _trace_solution(arguments):
+    """Trace a step solution and save the trace to the cache"""
+    path, step, settings, fast_forward = arguments
+    trace = simulate(DESIGNS[step], fast_forward=fast_forward, **settings)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path + ".tmp", "wt") as f:
+        json.dump(trace, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    return step
+
+
+@lru_cache(maxsize=None)
+def _load_trace(path):
+    with gzip.open(path, "rt") as f:
+        return json.load(f)
+
+
+def grade(arguments):
+    """Simulate an exercise file, and return `(seat, step, status, cycle, message, seconds)`"""
+    seat, step, path, solution_path, settings, fast_forward = arguments
+    start = time.perf_counter()
+    try:
+        trace = simulate(f"{path}:Pong", fast_forward=fast_forward, **settings)
+    except Exception as error:
+        return seat, step, "error", None, f"{type(error).__name__}: {error}", time.perf_counter() - start
+    divergence = first_divergence(_load_trace(solution_path), trace, settings["cycles"])
+    if divergence is None:
+        return seat, step, "ok", None, "", time.perf_counter() - start
+    cycle, message = divergence
+    return seat, step, "diverges", cycle, message, time.perf_counter() - start
+
+
+def submissions(directory):
+    """`(seat, step, path)` of each exercise file found in the seat directories"""
+    for seat in sorted(os.listdir(directory)):
+        for step, exercise in EXERCISES.items():
+            path = os.path.join(directory, seat, exercise)
+            if os.path.isfile(path):
+                yield seat, step, os.path.abspath(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("seats", help="directory holding a directory per attendee")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="number of processes")
+    parser.add_argument("--cycles", type=int, default=20000, help="number of clock cycles to simulate")
+    parser.add_argument("--frequency", type=float, default=SIM_CLK_FREQUENCY, help="simulated clock frequency")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random button presses")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="skip the cycles where only the timers count")
+    parser.add_argument("--cache", default="build/grade", help="directory of the solution traces")
+    parser.add_argument("--json", metavar="FILE", help="write the grades to a JSON file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    settings = {"cycles": args.cycles, "seed": args.seed, "frequency": args.frequency}
+    tasks = list(submissions(args.seats))
+    if not tasks:
+        parser.error(f"no exercise file in {args.seats}/*/ ({', '.join(EXERCISES.values())})")
+    steps = sorted({step for _, step, _ in tasks})
+    solution_paths = {step: solution_trace_path(args.cache, step, **settings) for step in steps}
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        missing = [(solution_paths[step], step, settings, args.fast_forward)
+                   for step in steps if not os.path.exists(solution_paths[step])]
+        for step in pool.imap_unordered(_trace_solution, missing):
+            print(f"{step} solution traced to {solution_paths[step]}")
+        grades = sorted(pool.imap_unordered(grade, [(seat, step, path, solution_paths[step], settings,
+                                                     args.fast_forward) for seat, step, path in tasks]))
+
+    width = max(len(seat) for seat, *_ in grades)
+    print(f'{"seat":<{width}} {"step":<7} {"result":<9} {"cycle":>7} {"time s":>7}')
+    for seat, step, status, cycle, message, seconds in grades:
+        print(f"{seat:<{width}} {step:<7} {status:<9} {'' if cycle is None else cycle:>7} {seconds:>7.2f}"
+              f"{'  ' + message if message else ''}")
+    passed = sum(status == "ok" for _, _, status, *_ in grades)
+    print(f"\n{passed} of {len(grades)} exercises behave like the solutions, graded in "
+          f"{time.perf_counter() - start:.1f} s with {args.jobs} processes")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([dict(zip(["seat", "step", "status", "cycle", "message", "seconds"], result))
+                       for result in grades], f, indent=2)
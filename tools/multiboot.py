@@ -0,0 +1,189 @@
+"""Build a multi-boot flash image holding several workshop designs, which jump to each other without reflashing.
+
+    python -m tools.multiboot [step_1 step_2 step_3 step_4] [--hold 0.05] [--build-dir build/multiboot] [--program]
+    python -m tools.multiboot --verify build/multiboot/multiboot.bin [--build-dir build/multiboot]
+
+Each design is built with a `WarmBoot` module added next to it: holding the reset button (5) with a racket button N
+(1 to 4) for `--hold` seconds reconfigures the FPGA from image N - 1, through the `SB_WARMBOOT` primitive of the
+iCE40, in a few milliseconds. The bitstreams are packed by `icemulti` into `{build_dir}/multiboot.bin`, the first
+design being loaded at power on. `SB_WARMBOOT` selects one of 4 images, so up to 4 designs are packed, e.g.
+`step_1 step_2 step_4 uart_demo`. The extension board resources are added to every design, so that `uart_demo` can
+jump too.
+
+The layout of the image is checked offline once packed, and by `--verify`: the header of the flash image has an
+entry for the power-on image then one for each warm-boot image, and each entry must point at the bitstream of the
+design built in `{build_dir}/{index}_{design}/top.bin`. The tools are found like the other toolchain tools of
+Amaranth, e.g. with `ICEMULTI=yowasp-icemulti`.
+"""
+import argparse
+import os
+import subprocess
+
+from amaranth import *
+from amaranth._toolchain import require_tool
+from amaranth.lib.cdc import FFSynchronizer
+from amaranth_boards.icestick import ICEStickPlatform
+
+from .build import script_commands
+from .steps import DESIGNS, load_design, load_module, make_platform
+
+
+IMAGES = 4  # selected by the S1 and S0 inputs of SB_WARMBOOT
+
+# iCE40 configuration commands of a multi-boot header entry: preamble, then the address of the image
+PREAMBLE = bytes([0x7e, 0xaa, 0x99, 0x7e])
+BOOT_ADDRESS = bytes([0x44, 0x03])
+ENTRY_SIZE = 32
+
+
+class MultibootPlatform(ICEStickPlatform):
+    """ICEStick platform on which a resource may be requested again with the same arguments, to get the same pins:
+    the buttons are shared by the design and its `WarmBoot` module"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._requested_pins = {}
+
+    def request(self, name, number=0, *args, **kwargs):
+        key = name, number, args, tuple(sorted(kwargs.items()))
+        if key not in self._requested_pins:
+            self._requested_pins[key] = super().request(name, number, *args, **kwargs)
+        return self._requested_pins[key]
+
+
+class WarmBoot(Elaboratable):
+    """Boot image N - 1 of the flash when the reset button (5) and button N (1 to 4) are held for `hold` seconds"""
+
+    def __init__(self, hold=0.05):
+        self._hold = hold
+        self.image = Signal(2)  # output: image selected by the buttons
+        self.boot = Signal()  # output: set once the image is booted
+
+    def elaborate(self, platform):
+        m = Module()
+
+        pressed = Signal(5)
+        for number in range(1, 6):
+            m.submodules += FFSynchronizer(~platform.request("button", number).i, pressed[number - 1])
+
+        # the reset button with a single racket button
+        chord = Signal(2)
+        valid = Signal()
+        with m.Switch(pressed):
+            for image in range(IMAGES):
+                with m.Case(0b10000 | 1 << image):
+                    m.d.comb += [valid.eq(1), chord.eq(image)]
+
+        # the image is selected before BOOT rises, and the chord must be held for `hold` seconds
+        hold_cycles = int(platform.default_clk_frequency * self._hold)
+        timer = Signal(range(hold_cycles + 1))
+        with m.If(~valid | (chord != self.image)):
+            m.d.sync += [timer.eq(0), self.image.eq(chord)]
+        with m.Elif(timer == hold_cycles):
+            m.d.sync += self.boot.eq(1)
+        with m.Else():
+            m.d.sync += timer.eq(timer + 1)
+
+        m.submodules.warmboot = Instance("SB_WARMBOOT",
+                                         i_BOOT=self.boot,
+                                         i_S1=self.image[1],
+                                         i_S0=self.image[0])
+        return m
+
+
+class MultibootTop(Elaboratable):
+    """A design with a `WarmBoot` module next to it"""
+
+    def __init__(self, design, hold=0.05):
+        self.design = design
+        self.warmboot = WarmBoot(hold)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.design = self.design
+        m.submodules.warmboot = self.warmboot
+        return m
+
+
+def build_image(design, build_dir, *, hold=0.05, name="top"):
+    """Build `design` with a `WarmBoot` module in `build_dir`, and return the path of its bitstream"""
+    module, top = load_design(design)
+    platform = make_platform(module, MultibootPlatform)
+    if not hasattr(module, "workshop_pcba"):
+        platform.add_resources(load_module(DESIGNS["step_4"].partition(":")[0]).workshop_pcba)
+    os.makedirs(build_dir, exist_ok=True)
+    plan = platform.prepare(MultibootTop(top(), hold), name)
+    plan.execute_local(build_dir, run_script=False)
+    preamble, commands = script_commands(os.path.join(build_dir, f"{plan.script}.sh"))
+    for _, command in commands:
+        subprocess.run(["sh", "-c", f"{preamble}\n{command}"], cwd=build_dir, check=True)
+    return os.path.join(build_dir, f"{name}.bin")
+
+
+def layout(image):
+    """Addresses of the power-on image, then of each warm-boot image, read from the header of a flash image"""
+    addresses = []
+    for index in range(IMAGES + 1):
+        entry = image[index * ENTRY_SIZE:(index + 1) * ENTRY_SIZE]
+        if not entry.startswith(PREAMBLE):
+            raise ValueError(f"entry {index} of the multi-boot header has no preamble")
+        position = entry.find(BOOT_ADDRESS)
+        if position < 0:
+            raise ValueError(f"entry {index} of the multi-boot header has no boot address")
+        addresses.append(int.from_bytes(entry[position + 2:position + 5], "big"))
+    return addresses
+
+
+def verify(image_path, bitstream_paths, power_on=0):
+    """Check that the header of the flash image points at each bitstream, and return the addresses of the images"""
+    with open(image_path, "rb") as f:
+        image = f.read()
+    power_on_address, *addresses = layout(image)
+    for index, path in enumerate(bitstream_paths):
+        with open(path, "rb") as f:
+            bitstream = f.read()
+        if image[addresses[index]:addresses[index] + len(bitstream)] != bitstream:
+            raise ValueError(f"warm-boot image {index} at {addresses[index]:#x} is not {path}")
+    # the entries of the missing images boot the first one, like icemulti writes them
+    for index in range(len(bitstream_paths), IMAGES):
+        if addresses[index] != addresses[0]:
+            raise ValueError(f"warm-boot image {index} at {addresses[index]:#x} is not image 0")
+    if power_on_address != addresses[power_on]:
+        raise ValueError(f"the power-on image at {power_on_address:#x} is not image {power_on}")
+    return addresses[:len(bitstream_paths)]
+
+
+def pack(bitstream_paths, image_path, power_on=0):
+    """Pack the bitstreams into a multi-boot flash image with icemulti"""
+    directory = os.path.dirname(os.path.abspath(image_path))
+    subprocess.run([require_tool("icemulti"), f"-p{power_on}", "-o", os.path.basename(image_path),
+                    *(os.path.relpath(path, directory) for path in bitstream_paths)], cwd=directory, check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("designs", nargs="*", default=["step_1", "step_2", "step_3", "step_4"],
+                        help="step names or path/to/file.py[:ClassName], in the order of the images")
+    parser.add_argument("--hold", type=float, default=0.05, help="seconds the buttons are held to boot an image")
+    parser.add_argument("--build-dir", default="build/multiboot")
+    parser.add_argument("--verify", metavar="IMAGE", help="only check the layout of a flash image already built")
+    parser.add_argument("--program", action="store_true", help="program the flash once built")
+    args = parser.parse_args()
+    if not 1 <= len(args.designs) <= IMAGES:
+        parser.error(f"SB_WARMBOOT selects one of {IMAGES} images, {len(args.designs)} designs given")
+
+    image_path = args.verify or os.path.join(args.build_dir, "multiboot.bin")
+    bitstream_paths = [os.path.join(args.build_dir, f"{index}_{os.path.basename(design).partition(':')[0]}",
+                                    "top.bin") for index, design in enumerate(args.designs)]
+    if not args.verify:
+        for design, path in zip(args.designs, bitstream_paths):
+            build_image(design, os.path.dirname(path), hold=args.hold)
+        pack(bitstream_paths, image_path)
+
+    addresses = verify(image_path, bitstream_paths)
+    for index, (design, address) in enumerate(zip(args.designs, addresses)):
+        buttons = "power on, " if index == 0 else ""
+        print(f"image {index} at {address:#08x}: {design:<20} {buttons}buttons 5+{index + 1}")
+    print(f"{image_path}: {os.path.getsize(image_path)} bytes")
+    if args.program:
+        subprocess.run([require_tool("iceprog"), image_path], check=True)
@@ -0,0 +1,140 @@
+"""Expose the UART of a simulated design on a pseudo-terminal, as if the board was plugged in.
+
+    python -m tools.pty_bridge step_4 [--uart-model] [--link /tmp/ttyPong] [--cycles N] [--random-buttons]
+
+The name of the pseudo-terminal is printed, and host tools can attach to it like to `/dev/ttyUSB1`:
+
+    picocom /tmp/ttyPong -b 115200
+
+Bytes sent by the design are decoded from the `tx` pin, which requires a simulated clock frequency of at least
+twice the baudrate (`--frequency`). The decoder only wakes up on start bits, then samples the pin at the center of
+each bit. With `--uart-model`, the bytes are taken from the transaction-level model of the transmitter instead, and
+any clock frequency can be used. The models are also used at lower frequencies, such as the default 1 kHz.
+
+Bytes written by host tools to the pseudo-terminal are shifted in on the `rx` pin, or given to the receiver model.
+
+The buttons are left released, so the only activity is the one driven from the host. `--random-buttons` presses and
+releases them at random (`--seed`), like the other simulation tools do.
+"""
+import os
+import pty
+import tty
+
+from amaranth import ClockDomain
+from amaranth.sim import Delay, Passive, Tick
+
+from .sim import Harness, argument_parser
+
+
+class PtyBridge:
+    def __init__(self, harness, *, baudrate=115200, link=None):
+        self.harness = harness
+        self.master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self._slave)
+        self.link = link
+        if link is not None:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.name, link)
+
+        divisor = int(harness.clk_frequency // baudrate)
+        self.bit_time = max(divisor, 1) * harness.period
+        self._tx_bytes = bytearray()
+        self._rx_bytes = bytearray()
+        uart_pins = harness.pins.get(("uart", 0))
+        if uart_pins is None:
+            raise ValueError("the design does not use the UART")
+        if not harness.uart_models:
+            if divisor < 2:
+                raise ValueError(f"the clock frequency must be at least {2 * baudrate} Hz to decode the tx pin")
+            harness.add_process(self._tx_decoder(uart_pins.tx.o))
+        if not harness.uart_rx_models:
+            harness.add_process(self._rx_driver(uart_pins.rx.i))
+
+    def _tx_decoder(self, tx):
+        # Wake up on the falling edges of tx (start bits) instead of checking the pin at every clock cycle
+        start_bit = ClockDomain("pty_bridge_tx", clk_edge="neg", reset_less=True, local=True)
+        start_bit.clk = tx
+
+        def process():
+            yield Passive()
+            while True:
+                yield Tick(start_bit)
+                yield Delay(self.bit_time * 1.5)  # center of the first data bit
+                byte = 0
+                for bit in range(8):
+                    byte |= (yield tx) << bit
+                    yield Delay(self.bit_time)
+                if (yield tx):  # ignore framing errors, like a real UART would
+                    self._tx_bytes.append(byte)
+        return process
+
+    def _rx_driver(self, rx):
+        def process():
+            yield Passive()
+            while True:
+                if not self._rx_bytes:
+                    yield Delay(10 * self.bit_time)
+                    continue
+                byte = self._rx_bytes.pop(0)
+                for bit in [0, *((byte >> i) & 1 for i in range(8)), 1]:  # start bit, LSB first, stop bit
+                    yield rx.eq(bit)
+                    yield Delay(self.bit_time)
+        return process
+
+    def transfer(self):
+        """Exchange the bytes buffered since the last call with the host"""
+        data = bytes(self._tx_bytes) + self.harness.uart_bytes()
+        self._tx_bytes.clear()
+        if data:
+            os.write(self.master, data)
+        try:
+            received = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        if self.harness.uart_rx_models:
+            self.harness.uart_send(received)
+        else:
+            self._rx_bytes += received
+
+    def run(self, cycles=None, *, chunk=1000):
+        """Simulate `cycles` cycles (forever if None), exchanging bytes with the host every `chunk` cycles"""
+        while cycles is None or cycles > 0:
+            step = chunk if cycles is None else min(chunk, cycles)
+            self.harness.run(step)
+            self.transfer()
+            if cycles is not None:
+                cycles -= step
+
+    def close(self):
+        os.close(self.master)
+        os.close(self._slave)
+        if self.link is not None and os.path.islink(self.link):
+            os.remove(self.link)
+
+
+if __name__ == "__main__":
+    parser = argument_parser(__doc__)
+    parser.set_defaults(cycles=None)
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--link", metavar="PATH", help="create a symbolic link to the pseudo-terminal")
+    parser.add_argument("--random-buttons", action="store_true", help="press and release the buttons at random")
+    args = parser.parse_args()
+    if not args.uart_model and args.frequency < 2 * args.baudrate:
+        print(f"the clock frequency is below {2 * args.baudrate} Hz: the UART is modeled (--uart-model)")
+        args.uart_model = True
+
+    harness = Harness(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                      fast_forward=args.fast_forward, **dict(args.option))
+    if args.random_buttons:
+        harness.add_process(harness.random_buttons(args.seed))
+    bridge = PtyBridge(harness, baudrate=args.baudrate, link=args.link)
+    print(f"UART available on {args.link or bridge.name}")
+    try:
+        bridge.run(args.cycles)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.close()
@@ -0,0 +1,72 @@
+"""Internals of the Amaranth Python simulator (`pysim`) used by the tools.
+
+The harness restores checkpoints and fast-forwards the timers by writing the state of the signals and the simulated
+time, the recorders observe every value change like the VCD writers, and the profiler times the simulator processes.
+None of this is part of the Amaranth API: the tools only reach the internals of a `Simulator` through the functions
+of this module, written for Amaranth `PYSIM_VERSION`. The objects they return are the simulator's own (signal state
+slots with `curr`, `next` and `waiters`, processes with `runnable`...). Importing this module with another version of
+Amaranth raises `ImportError`.
+"""
+from importlib.metadata import version
+
+PYSIM_VERSION = "0.4.5"
+
+if version("amaranth") != PYSIM_VERSION:
+    raise ImportError(f"the simulation tools rely on the internals of the Amaranth {PYSIM_VERSION} simulator, "
+                      f"Amaranth {version('amaranth')} is installed")
+
+from amaranth.sim._pyclock import PyClockProcess
+from amaranth.sim._pycoro import PyCoroProcess
+from amaranth.sim._pyrtl import PyRTLProcess, _FragmentCompiler
+
+
+# compiles the statements of each fragment to `PyRTLProcess`es
+FragmentCompiler = _FragmentCompiler
+
+
+def fragment(sim):
+    """Fragment simulated, with the clock domains added by the simulator"""
+    return sim._fragment
+
+
+def processes(sim):
+    """Set of the processes of the simulator: the design, the clocks and the testbench processes"""
+    return sim._engine._processes
+
+
+def slots(sim):
+    """State slots of all the signals, in the order they have been added to the simulation"""
+    return sim._engine._state.slots
+
+
+def slot(sim, signal):
+    """State slot of a signal: `curr` is its current value, `next` its value after the current delta cycle"""
+    state = sim._engine._state
+    return state.slots[state.get_signal(signal)]
+
+
+def set_value(sim, signal, value):
+    """Set the value of a signal at once, outside of the simulation processes"""
+    state_slot = slot(sim, signal)
+    state_slot.curr = state_slot.next = value
+
+
+def now(sim):
+    """Simulated time, in picoseconds"""
+    return sim._engine.now
+
+
+def set_now(sim, timestamp):
+    """Move the simulated time, in picoseconds. The processes waiting for a deadline are not woken up"""
+    sim._engine._timeline.now = timestamp
+
+
+def deadlines(sim):
+    """Deadline of each process waiting for a time, in picoseconds (`None` when it waits for the next delta cycle)"""
+    return sim._engine._timeline.deadlines
+
+
+def observers(sim):
+    """List of the observers of the value changes, like the VCD writers: `update(timestamp, signal, value)` is called
+    at each change of a signal, and `close(timestamp)` when the simulation ends"""
+    return sim._engine._vcd_writers
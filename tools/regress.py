@@ -0,0 +1,796 @@
+"""Regression suite of the workshop steps, simulated with a scaled-down clock on all the CPU cores.
+
+    python -m tools.regress [-j 4] [-k step_3] [--fast-forward]
+
+Each check simulates a step solution at `SIM_CLK_FREQUENCY` (1 kHz) unless it needs a faster clock, presses its buttons
+and compares what it does with the behaviour described in the README: the debounced button counter of step 1, the
+rackets of step 2 stopping at the edges of the display, the ball of step 3 rebounding on the rackets, scoring and being
+reset, the score messages of step 4 sent on the UART, its reports and the values they hold, its composed display, its
+cascaded boards, the reaction time and the error of its AI, its rebounds predicted a move early, its registered IOs, its
+PLL settings and its accelerating rackets. The step 4 exercise, completed, is also graded against the solution by
+`tools.grade`, a recording of the buttons is replayed by `tools.replay`, and the random presses of `tools.toggles` are
+checked to end with their phase. The checks are independent, so a process pool runs them in parallel, and the cycles
+simulated per second are reported for each one. The exit status is 1 when a check fails.
+
+A check is a function taking a `Harness` of its step and raising `AssertionError` when the design misbehaves.
+"""
+import argparse
+import fnmatch
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import textwrap
+import time
+import traceback
+
+from amaranth import Fragment
+
+from .golden import PongModel
+from .grade import EXERCISES, first_divergence, record, simulate
+from .replay import decode, replay_buttons
+from .sim import Harness
+from .steps import ROOT, make_platform
+from .toggles import ToggleCounter, _presses
+from .uart_model import UARTModel
+
+
+CHECKS = {}  # check function of each test name
+
+
+def check(design, **options):
+    """Register a check of `design`, simulated by a `Harness` built with `options`"""
+    def register(function):
+        CHECKS[f"{design}.{function.__name__}"] = function, design, options
+        return function
+    return register
+
+
+def _set_button(harness, number, pressed):
+    """Press or release a button at the current cycle, between two `harness.run()`"""
+    def process():
+        yield harness.press(number) if pressed else harness.release(number)
+    harness.add_process(process)
+
+
+def _get(harness, path):
+    return harness.value(harness.signal(path))
+
+
+def _bounce(harness, number, edges):
+    """Toggle a button every cycle `edges` times, starting with a press, like a bouncing switch"""
+    for edge in range(edges):
+        _set_button(harness, number, edge % 2 == 0)
+        harness.run(1)
+
+
+# Step 1: the counter displayed on the first LED row, debounced for 50 ms (50 cycles)
+
+def _press_step_1(harness, number, hold=100):
+    _bounce(harness, number, 5)
+    harness.run(hold)
+    _set_button(harness, number, False)
+    harness.run(100)
+
+
+@check("step_1")
+def bouncing_press_counts_once(harness):
+    leds = harness.pins["led_col", 0].o
+    for count in range(1, 4):
+        _press_step_1(harness, 1)
+        assert harness.value(leds) == count, f"counter {harness.value(leds)} after {count} presses on button 1"
+    _press_step_1(harness, 2)
+    assert harness.value(leds) == 2, f"counter {harness.value(leds)} after a press on button 2"
+
+
+@check("step_1")
+def edges_ignored_while_debouncing(harness):
+    leds = harness.pins["led_col", 0].o
+    for _ in range(3):  # short presses within the 50 cycles of the first one
+        _set_button(harness, 1, True)
+        harness.run(5)
+        _set_button(harness, 1, False)
+        harness.run(10)
+    harness.run(100)
+    assert harness.value(leds) == 1, f"counter {harness.value(leds)} after presses during the debounce time"
+    _press_step_1(harness, 2)
+    _press_step_1(harness, 2)
+    assert harness.value(leds) == 0xff, f"counter {harness.value(leds)} instead of wrapping around to 255"
+
+
+# Step 2: rackets moving one LED every 100 ms (100 cycles), within the 8 LEDs of their row
+
+def _hold(harness, numbers, cycles):
+    for number in numbers:
+        _set_button(harness, number, True)
+    harness.run(cycles)
+    for number in numbers:
+        _set_button(harness, number, False)
+    harness.run(5)
+
+
+@check("step_2")
+def rackets_stop_at_the_edges(harness):
+    for racket, left, right in [("racket_right", 2, 1), ("racket_left", 4, 3)]:
+        _hold(harness, [left], 1000)
+        leds = _get(harness, f"{racket}.leds")
+        assert leds == 0b11000000, f"{racket} at {leds:08b} after moving left for 10 periods"
+        _hold(harness, [right], 1000)
+        leds = _get(harness, f"{racket}.leds")
+        assert leds == 0b00000011, f"{racket} at {leds:08b} after moving right for 10 periods"
+
+
+@check("step_2")
+def rackets_move_one_led_per_period(harness):
+    _hold(harness, [1], 250)  # the timer expires at cycles 100 and 201
+    leds = _get(harness, "racket_right.leds")
+    assert leds == 0b00000110, f"racket at {leds:08b} after 2 periods"
+    _hold(harness, [3, 4], 500)
+    leds = _get(harness, "racket_left.leds")
+    assert leds == 0b00011000, f"racket at {leds:08b} with both buttons pressed"
+
+
+# Step 3: the ball, moving every 143 cycles, rebounding on the rackets, scores and the reset button. Served from
+# its reset position (column 1, row 3), it rebounds on racket two, then goes through row 3 in column 6.
+
+def _serve(harness):
+    _hold(harness, [3, 4], 10)
+
+
+def _ball_columns(harness, moves):
+    """Run until the ball has moved `moves` times (its row changes at every move), and return its columns"""
+    columns = []
+    for _ in range(moves):
+        row = _get(harness, "ball.row")
+        while _get(harness, "ball.row") == row and _get(harness, "ball.moving"):
+            harness.run(1)
+        columns.append(_get(harness, "ball.col"))
+    return columns
+
+
+def _miss(harness):
+    """Move racket one to the top of its row, out of the way of the ball, serve and wait for the score"""
+    _hold(harness, [2], 350)
+    _serve(harness)
+    harness.run(8 * 143)
+
+
+def _press_reset(harness):
+    _hold(harness, [5], 5)
+    harness.run(20)
+
+
+@check("step_3")
+def ball_rebounds_on_the_rackets(harness):
+    _serve(harness)
+    columns = _ball_columns(harness, 8)
+    assert columns == [1, 2, 3, 4, 5, 6, 6, 5], f"ball went through the columns {columns}"
+    scores = _get(harness, "score_one"), _get(harness, "score_two")
+    assert scores == (0, 0), f"scores {scores} after the rebounds"
+
+
+@check("step_3")
+def missed_ball_scores_and_is_reset(harness):
+    _miss(harness)
+    scores = _get(harness, "score_one"), _get(harness, "score_two")
+    assert scores == (1, 0), f"scores {scores} after a miss by racket one"
+    ball = _get(harness, "ball.col"), _get(harness, "ball.moving")
+    assert ball == (6, 0), f"ball (column, moving) {ball} instead of waiting for racket one to serve"
+    _press_reset(harness)
+    scores = _get(harness, "score_one"), _get(harness, "score_two")
+    assert scores == (0, 0), f"scores {scores} after the reset button"
+
+
+# Step 4: the scores sent on the UART, "{score two}-{score one}\r\n", after each change
+
+@check("step_4", uart_model=True)
+def score_messages(harness):
+    _miss(harness)
+    sent = harness.uart_bytes()
+    assert sent == b"0-1\r\n", f"{sent!r} sent after the first score"
+    _press_reset(harness)
+    sent = harness.uart_bytes()  # the message is sent again while the reset button is held
+    assert sent and sent.split(b"\r\n") == [b"0-0"] * sent.count(b"\r\n") + [b""], \
+        f"{sent!r} sent after the reset button"
+
+
+@check("step_4", uart_model=True)
+def matches_the_golden_model(harness):
+    model = PongModel(harness.clk_frequency, uart_latency=harness.uart_latency)
+    registers = harness.registers()
+    rng = random.Random(0)
+    pressed = set()
+    for _ in range(200):
+        cycles = rng.randrange(1, 400)
+        harness.run(cycles)
+        model.run(cycles)
+        different = [path for path, signal in registers if harness.value(signal) != model.registers[path]]
+        assert not different, f"{', '.join(different)} differ from the model at cycle {harness.cycles}"
+        number = rng.choice([1, 2, 3, 4])
+        pressed ^= {number}
+        _set_button(harness, number, number in pressed)
+        (model.press if number in pressed else model.release)(number)
+    sent = harness.uart_bytes()
+    assert sent == bytes(model.sent), f"{sent!r} sent instead of {bytes(model.sent)!r}"
+
+
+# The step 4 exercise, completed with the states sending the characters of the message, is graded as correct
+
+EXERCISE_COMPLETION = """\
+for state, data, following in [("LEFT", ord('0') + score_two, "DASH"),
+                               ("DASH", ord('-'), "RIGHT"),
+                               ("RIGHT", ord('0') + score_one, "NEWLINE"),
+                               ("NEWLINE", ord('\\r'), "NEWLINE2"),
+                               ("NEWLINE2", ord('\\n'), "IDLE")]:
+    with m.State(state):
+        m.d.comb += [
+            uart.data.eq(data),
+            uart.ack.eq(1),
+        ]
+        with m.If(uart.rdy):
+            m.next = following
+"""
+
+
+@check("step_4", uart_model=True)
+def completed_exercise_is_graded_ok(harness):
+    cycles = 20000  # the default of `tools.grade`
+    with open(os.path.join(ROOT, EXERCISES["step_4"])) as f:
+        exercise = f.read()
+    # the "Write your HDL here" banner, replaced by the completion at its indentation
+    banner = re.compile(r"^( +)#+\n(?:\1#.*\n)+", re.MULTILINE)
+    exercise, count = banner.subn(lambda match: textwrap.indent(EXERCISE_COMPLETION, match[1]), exercise)
+    assert count == 1, f"{count} places to complete in {EXERCISES['step_4']}"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(EXERCISES["step_4"]))
+        with open(path, "w") as f:
+            f.write(exercise)
+        completed = simulate(f"{path}:Pong", cycles=cycles)
+    divergence = first_divergence(record(harness, cycles=cycles), completed, cycles)
+    assert divergence is None, "the completed exercise diverges at cycle {}: {}".format(*divergence or (0, ""))
+
+
+# Step 4 with `latency_meter=True` and `perf_counters=True`: a report sent for each command received on the UART
+
+@check("step_4", uart_model=True, latency_meter=True, perf_counters=True)
+def report_commands(harness):
+    for commands in [b"LP", b"P"]:
+        harness.uart_send(commands)
+        harness.run(3000)
+        sent = harness.uart_bytes()
+        reports = bytes(line[0] for line in sent.split(b"\r\n")[:-1])
+        assert reports == commands, f"{reports!r} reports sent after the commands {commands!r}: {sent!r}"
+
+
+# Step 4 with `latency_meter=True` and `perf_counters=True`, racket one played at random and the ball served by racket
+# two every 5000 cycles: the statistics and the counters reported are those of the latencies and the events seen in
+# the simulation, between the command and the snapshot of the report. The latency of a press moving the racket lasts
+# until one of the rows it changed is displayed. Meanwhile, the line composed for each display row holds the pixels of
+# the rackets and the ball on it
+
+def _report_values(line):
+    """Hexadecimal numbers of a report line, by name: `{"n": [3], ..., "h": [0, 1, ...]}`"""
+    return {name: [int(number, 16) for number in numbers.split()]
+            for name, numbers in re.findall(r"(\w+)=([0-9A-F]+(?: [0-9A-F]+)*)", line)}
+
+
+@check("step_4", uart_model=True, latency_meter=True, perf_counters=True)
+def reports_hold_the_measured_values(harness):
+    width, height, scan = 8, 8, harness.module.LEDMatrix.SCAN_CYCLES
+    harness.add_process(harness.random_buttons(5, buttons=[1, 2]))
+
+    def serve():
+        while True:
+            yield harness.wait(5000)
+            for number in [3, 4]:
+                yield harness.press(number)
+            yield harness.wait(10)
+            for number in [3, 4]:
+                yield harness.release(number)
+    harness.add_process(serve)
+    signals = {name: harness.signal(path) for name, path in [
+        ("press", "press0"), ("leds", "racket_one.leds"), ("two", "racket_two.leds"), ("row", "ledm.row"),
+        ("timer", "ledm.timer"), ("line", "display.line"), ("frames", "ledm.frame"), ("ball_row", "ball.row"),
+        ("ball_col", "ball.col"), ("moves", "ball.moved"), ("rebounds", "ball.rebounded"),
+        ("one_scored", "ball.one_scored"), ("two_scored", "ball.two_scored"), ("bytes", "uart.sent"),
+        ("busy", "uart.busy"), ("starved", "uart.starved"), ("L", "latency.report.snapshot"),
+        ("P", "perf.report.snapshot"),
+    ]}
+    latencies = []
+    counts = dict.fromkeys(["frames", "moves", "rebounds", "scores", "bytes", "busy", "starved", "rally"], 0)
+    rally = 0
+    pressing = False
+    start = rows = None  # cycle of the press being measured, and rows it changed
+    leds = None
+    commands = "LPLPLP"
+    models = []  # [command, model at the command, model at the snapshot] of each report
+    snapshots = {"L": 0, "P": 0}
+    measuring = False  # a latency is measured in 35 cycles
+    for cycle in range(15000 * len(commands) + 3000):
+        # the latencies are reported while a new one is accumulated, to check the snapshot
+        if len(models) < cycle // 15000 and (commands[len(models)] == "P" or measuring):
+            command = commands[len(models)]
+            models.append([command, (len(latencies), dict(counts))])
+            harness.uart_send(command.encode())
+        harness.run(1)
+        values = {name: harness.value(signal) for name, signal in signals.items()}
+        # composed line
+        row = values["row"]
+        expected = (values["two"] >> row & 1) | (values["leds"] >> row & 1) << width - 1
+        if values["ball_row"] == row:
+            expected |= 1 << values["ball_col"]
+        assert values["line"] == expected, \
+            f"{values['line']:08b} composed on row {row} instead of {expected:08b}, cycle {harness.cycles}"
+        # latency
+        pressed = values["press"]
+        # the changed rows are displayed from the second cycle of the next row
+        measuring = rows is not None and rows >> (row + 1) % height & 1 and (1 - values["timer"]) % scan == 35
+        if start is None:
+            if pressed and not pressing:
+                start, leds = harness.cycles, values["leds"]
+        elif rows is None:
+            if values["leds"] != leds:
+                rows = values["leds"] ^ leds
+            elif not pressed:
+                start = None
+        elif rows >> row & 1:
+            latencies.append(harness.cycles - start)
+            start = rows = None
+        pressing = pressed
+        # events
+        for name in ["frames", "moves", "rebounds", "bytes", "busy", "starved"]:
+            counts[name] += values[name]
+        if values["one_scored"] or values["two_scored"]:
+            counts["scores"] += 1
+            rally = 0
+        elif values["rebounds"]:
+            rally += 1
+            counts["rally"] = max(counts["rally"], rally)
+        # the snapshot is taken when the report leaves its SNAPSHOT state
+        for command in snapshots:
+            if snapshots[command] and not values[command]:
+                next(model for model in models if model[0] == command and len(model) == 2).append(
+                    (len(latencies), dict(counts)))
+            snapshots[command] = values[command]
+
+    reports = [line for line in harness.uart_bytes().decode().split("\r\n") if line[:1] in ["L", "P"]]
+    assert [line[0] for line in reports] == list(commands), f"reports {reports} sent after the commands {commands}"
+    for line, (command, (first, low), (last, high)) in zip(reports, models):
+        values = _report_values(line)
+        if command == "L":
+            n = values["n"][0]
+            assert first <= n <= last, f"{n} latencies reported, {first} to {last} measured: {line!r}"
+            measured = latencies[:n]
+            bins = [0] * 8
+            for latency in measured:
+                bins[min(max(latency.bit_length() - 11, 0), 7)] += 1
+            expected = {"n": [n], "min": [min(measured)], "max": [max(measured)], "sum": [sum(measured)], "h": bins}
+            assert values == expected, f"report {line!r}, latencies measured {measured}"
+        else:
+            assert values.keys() == counts.keys(), f"report {line!r}"
+            for name, (value,) in values.items():
+                assert low[name] <= value <= high[name], \
+                    f"{name}={value} reported, {low[name]} to {high[name]} counted: {line!r}"
+    assert len(latencies) >= 20 and counts["scores"] and counts["rebounds"], \
+        f"only {len(latencies)} latencies measured, {counts['scores']} scores and {counts['rebounds']} rebounds"
+
+
+# Step 4 on a 32x16 display, 8 boards: the rows shifted out through the 74HC595 chain and latched are the rows
+# scanned by the LED matrix, one after the other, with the line composed for them when they started. Racket one is
+# moved away from racket two, so that each racket is displayed on rows of its own
+
+@check("step_4", uart_model=True, width=32, height=16)
+def cascaded_boards_latch_the_lines(harness):
+    width, height = 32, 16
+    chain = harness.pins["led_chain", 0]
+
+    def move_racket_one():
+        yield harness.wait(2000)
+        yield harness.press(1)
+        yield harness.wait(1000)
+        yield harness.release(1)
+    harness.add_process(move_racket_one)
+    shifted = 0  # bits sampled on the rising edges of the shift clock, the first one in the most significant bit
+    clk = latch = 0
+    composed = None  # (row, line) when the current row started
+    latched = []
+    while len(latched) < 3 * height:
+        harness.run(1)
+        if _get(harness, "ledm.timer") == 1:
+            composed = _get(harness, "ledm.row"), _get(harness, "display.line")
+        previous_clk, clk = clk, harness.value(chain.clk.o)
+        if clk and not previous_clk:
+            shifted = shifted << 1 | harness.value(chain.data.o)
+        previous_latch, latch = latch, harness.value(chain.latch.o)
+        if latch and not previous_latch:
+            # the register of each board holds its columns in its lower byte and its rows in its upper byte
+            boards = [shifted >> 16 * index & 0xffff for index in range(width // 8 * height // 8)]
+            line = sum((boards[x] & 0xff) << 8 * x for x in range(width // 8))
+            rows = sum((boards[y * width // 8] >> 8) << 8 * y for y in range(height // 8))
+            for y in range(height // 8):
+                for x in range(width // 8):
+                    board = boards[y * width // 8 + x]
+                    assert board & 0xff == line >> 8 * x & 0xff and board >> 8 == rows >> 8 * y & 0xff, \
+                        f"board {x}, {y} latched {board:016b} at cycle {harness.cycles}"
+            assert rows.bit_count() == 1, f"rows {rows:0{height}b} latched at cycle {harness.cycles}"
+            latched.append((rows.bit_length() - 1, line))
+            assert latched[-1] == composed, \
+                f"row {latched[-1][0]} latched with {line:0{width}b} at cycle {harness.cycles}, " \
+                f"row {composed[0]} composed with {composed[1]:0{width}b}"
+            shifted = 0
+    rows = [row for row, _ in latched]
+    assert rows == [(rows[0] + index) % height for index in range(len(rows))], f"rows latched in the order {rows}"
+    lines = {line for _, line in latched}
+    assert {1, 1 << width - 1} <= lines, f"the rackets are not displayed on rows of their own: {lines}"
+
+
+# Step 4 with `ai=True` on a 16x8 display: the row predicted by the AI at each move of the ball, until it reaches
+# the column of racket two (1), is the row it reaches, the ball rebounding on racket one played at random
+
+@check("step_4", uart_model=True, ai=True, width=16, height=8)
+def ai_predicts_the_landing_row(harness):
+    harness.add_process(harness.random_buttons(1, buttons=[1, 2]))
+    predictions = []  # (cycle, row) predicted at each move since the ball left column 1
+    checked = 0
+    position = None
+    for _ in range(20000):
+        harness.run(1)
+        current = _get(harness, "ball.row"), _get(harness, "ball.col"), _get(harness, "ball.moving")
+        if current == position:
+            continue
+        row, col, moving = position = current
+        if not moving:  # scored, the predictions made while the ball went past racket one are void
+            predictions = []
+        elif col == 1 and not _get(harness, "ball.move_col"):
+            wrong = [(cycle, prediction) for cycle, prediction in predictions if prediction != row]
+            assert not wrong, f"ball reached row {row} at cycle {harness.cycles}, predicted (cycle, row) {wrong}"
+            checked += len(predictions)
+            predictions = []
+        else:
+            predictions.append((harness.cycles, _get(harness, "ai.intercept")))
+    assert checked >= 50, f"only {checked} predictions checked"
+
+
+# Step 4 with `ai_reaction=0.5` and `ai_error=2`: the AI takes a new target every 4 moves of the ball (0.5 s at
+# 7 moves per second), and only then. The target is the row it predicts, half of the time, or 2 rows above or below
+# it, within the display
+
+@check("step_4", uart_model=True, ai=True, ai_reaction=0.5, ai_error=2)
+def ai_aims_with_its_reaction_and_error(harness):
+    height, reaction, error = 8, round(0.5 * harness.module.Ball.move_speed), 2
+    harness.add_process(harness.random_buttons(4, buttons=[1, 2]))
+    moves = 0
+    offsets = {0: 0, error: 0, -error: 0}  # targets aimed at each offset from the prediction
+    for _ in range(60000):
+        harness.run(1)
+        if not _get(harness, "ball.tick"):
+            continue
+        moves += 1
+        intercept, target = _get(harness, "ai.intercept"), _get(harness, "ai.target")
+        harness.run(1)
+        aimed = _get(harness, "ai.target")
+        if moves % reaction:
+            assert aimed == target, f"target changed at ball move {moves}, the AI reacts every {reaction} moves"
+            continue
+        candidates = [offset for offset in offsets if min(max(intercept + offset, 0), height - 1) == aimed]
+        assert candidates, f"target {aimed} for the predicted row {intercept} at ball move {moves}"
+        if len(candidates) == 1:
+            offsets[candidates[0]] += 1
+    aims = sum(offsets.values())
+    assert aims >= 80 and min(offsets.values()) > 0 and 0.35 < offsets[0] / aims < 0.65, \
+        f"targets aimed at the offsets {offsets} from the prediction"
+
+
+# Step 4 with `ai=True`: `Ball.will_rebound` is set a move before each rebound the rackets do not dodge, and never
+# otherwise. The AI, aiming 2 rows away from its prediction half of the time, holds racket two still from then on
+
+@check("step_4", uart_model=True, ai=True, ai_error=2)
+def rebounds_are_predicted_a_move_early(harness):
+    harness.add_process(harness.random_buttons(3, buttons=[1, 2]))
+    previous = None  # will_rebound, rebounded, move_col and the racket pixels at the last move
+    predicted = {0: 0, 1: 0}  # rebounds predicted on racket two (0) and one (1)
+    for _ in range(100000):
+        harness.run(1)
+        if not _get(harness, "ball.moving"):
+            previous = None
+        if not _get(harness, "ball.moved"):
+            continue
+        current = (_get(harness, "ball.will_rebound"), _get(harness, "ball.rebounded"), _get(harness, "ball.move_col"),
+                   _get(harness, "racket_two.leds"), _get(harness, "racket_one.leds"))
+        if previous is not None:
+            will_rebound, rebounded, move_col, *rackets = previous
+            stayed = rackets == list(current[3:])
+            if will_rebound and not rebounded:
+                assert current[1] or not stayed, f"rebound predicted but missed at cycle {harness.cycles}"
+                assert current[1] or move_col, f"racket two moved away from the ball at cycle {harness.cycles}"
+                predicted[move_col] += current[1]
+            if current[1]:
+                assert will_rebound or not stayed, f"rebound at cycle {harness.cycles} not predicted a move early"
+        previous = current
+    assert min(predicted.values()) >= 5, f"only {predicted} rebounds predicted on racket two and one"
+
+
+# Step 4 with `balls=3`: the line drawn on each display row holds the balls of the block RAM on that row from the
+# cycle the row is displayed, and each ball reaching a side is scored once, then served again. The clock runs at
+# 20 kHz, so that the balls often stay still for more than 2 rows, and the line can be compared with the RAM
+
+@check("step_4", uart_model=True, balls=3, clk_frequency=20e3)
+def balls_are_drawn_and_scored(harness):
+    width = 8
+    registers = dict(harness.registers())
+    # ball states: row (3 bits), col (3 bits), move_row, move_col, moving
+    memory = [registers[f"ball.read.memory({index})"] for index in range(3)]
+
+    def serve():
+        while True:
+            for number in [1, 2, 3, 4]:
+                yield harness.press(number)
+            yield harness.wait(100)
+            for number in [1, 2, 3, 4]:
+                yield harness.release(number)
+            yield harness.wait(20000)
+    harness.add_process(serve)
+
+    balls = None
+    moved = 0  # cycle the balls last changed
+    rows = [0, 0]  # cycles the previous and the current display rows started
+    row = None
+    served = None  # (index, column) of the ball scored at the previous cycle
+    scores = {"one": 0, "two": 0}
+    checked = 0
+    for _ in range(100000):
+        harness.run(1)
+        previous, balls = balls, [harness.value(word) for word in memory]
+        if balls != previous:
+            moved = harness.cycles
+        if served is not None:
+            index, col = served
+            assert (balls[index] >> 3) & 7 == col and not balls[index] >> 8, \
+                f"ball {index} state {balls[index]:09b} after scoring, cycle {harness.cycles}"
+            served = None
+        if _get(harness, "ledm.row") != row:
+            row = _get(harness, "ledm.row")
+            rows = [rows[1], harness.cycles]
+        if moved < rows[0]:  # the line has been drawn after the last move
+            expected = 0
+            for ball in balls:
+                if ball & 7 == row:
+                    expected |= 1 << ((ball >> 3) & 7)
+            line = _get(harness, "ball.line")
+            assert line == expected, f"{line:08b} drawn on row {row} instead of {expected:08b}, cycle {harness.cycles}"
+            checked += 1
+        for side, col in [("one", width - 2), ("two", 1)]:
+            if _get(harness, f"ball.{side}_scored"):
+                scores[side] += 1
+                served = _get(harness, "ball.index"), col
+    assert checked >= 10000, f"only {checked} lines checked"
+    assert min(scores.values()) >= 3, f"only {scores} balls scored"
+    assert [harness.value(registers[f"score_{side}"]) for side in scores] == list(scores.values()), \
+        f"scores {harness.value(registers['score_one'])} and {harness.value(registers['score_two'])} after " \
+        f"{scores} balls scored"
+
+
+# Step 4 with `registered_io=True`: the flip-flops of the IO tiles delay the buttons and the LEDs by a cycle each. With
+# its buttons pressed a cycle earlier, the design goes through the same states as the default one, and its LED pads
+# follow the LED pins of the default design a cycle later
+
+@check("step_4", uart_model=True)
+def registered_io_adds_a_cycle(harness):
+    registered = Harness("step_4", uart_model=True, registered_io=True)
+    rng = random.Random(0)
+    changes = []  # (cycle, button, pressed)
+    cycle = 0
+    pressed = set()
+    while cycle < 20000:
+        cycle += rng.randrange(1, 400)
+        number = rng.choice([1, 2, 3, 4, 5])
+        pressed ^= {number}
+        changes.append((cycle, number, number in pressed))
+
+    def buttons(harness, advance):
+        def process():
+            now = 0
+            for cycle, number, pressed in changes:
+                yield harness.wait(cycle - advance - now)
+                now = cycle - advance
+                yield harness.press(number) if pressed else harness.release(number)
+        return process
+    harness.add_process(buttons(harness, 0))
+    registered.add_process(buttons(registered, 1))
+
+    others = dict(registered.registers())
+    registers = [(path, signal, others[path]) for path, signal in harness.registers() if not path.startswith("button_")]
+    leds = [(harness.pins[name, 0].o, registered.pins[name, 0].o) for name in ["led_row", "led_col"]]
+    previous = None
+    for _ in range(22000):
+        harness.run(1)
+        registered.run(1)
+        different = [path for path, signal, other in registers if harness.value(signal) != registered.value(other)]
+        assert not different, f"{', '.join(different)} differ at cycle {harness.cycles}"
+        current = [harness.value(pin) for pin, _ in leds]
+        pads = [registered.value(pad) for _, pad in leds]
+        assert previous is None or pads == previous, \
+            f"LED pads {pads} at cycle {harness.cycles}, the pins were {previous} a cycle before"
+        previous = current
+    sent = harness.uart_bytes()
+    assert sent.count(b"\r\n") >= 5 and registered.uart_bytes() == sent, "different scores sent"
+
+
+# Settings of the PLL printed by `icepll -i 12 -o <MHz>`: MHz requested, MHz generated, DIVR, DIVF, DIVQ, FILTER_RANGE
+ICEPLL = [
+    (16, 15.938, 0, 84, 6, 1), (20, 19.875, 0, 52, 5, 1), (24, 24.000, 0, 63, 5, 1), (30, 30.000, 0, 79, 5, 1),
+    (32, 31.875, 0, 84, 5, 1), (36, 36.000, 0, 47, 4, 1), (40, 39.750, 0, 52, 4, 1), (48, 48.000, 0, 63, 4, 1),
+    (50, 50.250, 0, 66, 4, 1), (60, 60.000, 0, 79, 4, 1), (64, 63.750, 0, 84, 4, 1), (72, 72.000, 0, 47, 3, 1),
+    (80, 79.500, 0, 52, 3, 1), (90, 90.000, 0, 59, 3, 1), (96, 96.000, 0, 63, 3, 1), (100, 100.500, 0, 66, 3, 1),
+    (120, 120.000, 0, 79, 3, 1), (144, 144.000, 0, 47, 2, 1), (150, 150.000, 0, 49, 2, 1), (200, 201.000, 0, 66, 2, 1),
+    (250, 249.000, 0, 82, 2, 1),
+]
+
+
+@check("step_4", uart_model=True)
+def pll_settings_match_icepll(harness):
+    for mhz, output, *settings in ICEPLL:
+        *computed, frequency = harness.module.pll_parameters(12e6, mhz * 1e6)
+        assert computed == settings and round(frequency / 1e6, 3) == output, \
+            f"{mhz} MHz: {computed} at {frequency / 1e6:.3f} MHz, icepll gives {settings} at {output} MHz"
+    for mhz in [12, 300]:
+        try:
+            harness.module.pll_parameters(12e6, mhz * 1e6)
+        except ValueError:
+            continue
+        raise AssertionError(f"{mhz} MHz is out of the range of the PLL")
+
+
+# `python step_4/solution.py --pll 48e6 --baudrate 3000000`, elaborated with the UART models in place of amlib
+
+@check("step_4", uart_model=True)
+def pll_clocks_the_design(harness):
+    module = harness.module
+    platform = make_platform(module, module.PLLPlatform, frequency=48e6)
+    uarts = []
+
+    def uart_tx_model(**kwargs):
+        uarts.append(UARTModel(**kwargs))
+        return uarts[-1]
+    platform.uart_tx_model = uart_tx_model
+    rtlil = platform.prepare(module.Pong(baudrate=3_000_000), name="top").files["top.il"]
+    pll = re.search(r"cell \\SB_PLL40_CORE \\pll\n(.*?)\n  end", rtlil, re.S)
+    assert pll, "no SB_PLL40_CORE instance"
+    parameters = dict(re.findall(r"parameter \\(\w+) (\S+)", pll[1]))
+    expected = {"FEEDBACK_PATH": '"SIMPLE"', "DIVR": "0", "DIVF": "63", "DIVQ": "4", "FILTER_RANGE": "1"}
+    assert parameters == expected, f"PLL parameters {parameters}"
+    assert uarts[0].divisor == 16, f"UART divisor {uarts[0].divisor}"
+    # 2.5 Mbaud is 3 Mbaud from the 12 MHz board clock, but 2.53 Mbaud from 48 MHz
+    try:
+        Fragment.get(module.Pong(baudrate=2_500_000), make_platform(module))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("2.5 Mbaud accepted at 12 MHz")
+
+
+# Step 4 with `accelerate_rackets=True`: a move at the press, then after each of `Racket.REPEAT_INTERVALS` ms. The
+# clock runs at 10 kHz, so that the millisecond tick is not every cycle: the first interval starts at the press,
+# between two ticks, and is up to a tick shorter
+
+@check("step_4", uart_model=True, accelerate_rackets=True, clk_frequency=10e3)
+def accelerating_racket(harness):
+    ms = 10  # cycles
+    _hold(harness, [2], 50 * ms)  # a tap shorter than the repeat delay
+    leds = _get(harness, "racket_one.leds")
+    assert leds == 0b00110000, f"racket at {leds:08b} after a tap"
+    _hold(harness, [1], 1000 * ms)
+    leds = _get(harness, "racket_one.leds")
+    # crossing the field: the moves follow the repeat intervals
+    _set_button(harness, 2, True)
+    moves = []
+    for cycle in range(1000 * ms):
+        harness.run(1)
+        if _get(harness, "racket_one.leds") != leds:
+            leds = _get(harness, "racket_one.leds")
+            moves.append(cycle)
+    intervals = [after - before for before, after in zip(moves, moves[1:])]
+    expected = [interval * ms for interval in [120, 70, 50, 35, 25]]
+    assert moves[0] <= 3 and expected[0] - ms < intervals[0] <= expected[0] and intervals[1:] == expected[1:], \
+        f"racket moved at the cycles {moves} after the press (10 kHz clock)"
+    assert leds == 0b11000000, f"racket at {leds:08b} after crossing the field"
+
+
+# tools.toggles: the random presses of the active phase end within its cycles, and close to its end
+
+@check("step_1")
+def presses_end_with_the_active_phase(harness):
+    active, mean_interval = 20000, 200
+    for seed in range(5):
+        if seed:
+            harness = Harness("step_1")
+        buttons = {f"button{number}": harness.button(number)
+                   for name, number in harness.pins if name == "button" and number <= 4}
+        counter = ToggleCounter(harness, buttons)
+        harness.add_process(_presses(harness, active, seed, mean_interval=mean_interval))
+        # the last delay drawn is less than 2 * mean_interval cycles
+        for phase, cycles in [("active", active - 2 * mean_interval), ("end", 2 * mean_interval), ("quiet", 2000)]:
+            counter.phase = phase
+            harness.run(cycles)
+        toggles = {phase: sum(count for (name_phase, _), count in counter.toggles.items() if name_phase == phase)
+                   for phase in ["end", "quiet"]}
+        assert toggles["end"] and not toggles["quiet"], \
+            f"{toggles['end']} button changes in the last {2 * mean_interval} active cycles, {toggles['quiet']} " \
+            f"after the {active} active cycles (seed {seed})"
+
+
+# Step 4 with `input_recorder=True`: the recording sent after `R`, replayed by `tools.replay` from the reset, brings
+# a design built with the same options to the same state, at the cycle the recording was made
+
+@check("step_4", uart_model=True, input_recorder=True)
+def recording_replays_the_game(harness):
+    cycles = 40000
+    # more than 1024 cycles between some changes, so that the recording holds wait words
+    harness.add_process(harness.random_buttons(2, mean_interval=600))
+    harness.run(cycles)
+    registers = harness.registers()
+    recorded = {path: harness.value(signal) for path, signal in registers}
+    harness.uart_bytes()
+    harness.uart_send(b"R")
+    harness.run(30000)
+    lines = harness.uart_bytes().decode().split("\r\n")
+    recording = next((line for line in lines if line.startswith("R ")), None)
+    assert recording, f"no recording sent after R: {lines!r}"
+    changes = decode(recording)
+    assert len(changes) >= 30, f"only {len(changes)} changes recorded"
+
+    replayed = Harness("step_4", uart_model=True, input_recorder=True)
+    replayed.add_process(replay_buttons(replayed, changes))
+    replayed.run(cycles)
+    different = [path for path, signal in replayed.registers() if replayed.value(signal) != recorded[path]]
+    assert not different, f"{', '.join(different)} differ after replaying the {len(changes)} changes"
+
+
+def run_check(name, fast_forward=False):
+    """Run a check in the current process, and return `(name, error, cycles, seconds)`"""
+    function, design, options = CHECKS[name]
+    start = time.perf_counter()
+    harness = None
+    try:
+        harness = Harness(design, fast_forward=fast_forward, **options)
+        function(harness)
+        error = None
+    except AssertionError as exception:
+        error = str(exception)
+    except Exception:
+        error = traceback.format_exc()
+    return name, error, harness.cycles if harness else 0, time.perf_counter() - start
+
+
+def _run_check(arguments):
+    return run_check(*arguments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="number of processes")
+    parser.add_argument("-k", metavar="PATTERN", action="append",
+                        help="run the checks whose name contains PATTERN (shell wildcards allowed)")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="skip the cycles where only the timers count")
+    args = parser.parse_args()
+
+    names = [name for name in CHECKS
+             if not args.k or any(fnmatch.fnmatch(name, f"*{pattern}*") for pattern in args.k)]
+    if not names:
+        parser.error("no check matches")
+    start = time.perf_counter()
+    failed = 0
+    with multiprocessing.Pool(min(args.jobs, len(names))) as pool:
+        print(f'{"check":<44} {"result":<6} {"cycles":>8} {"time s":>7} {"cycles/s":>9}')
+        for name, error, cycles, seconds in pool.imap_unordered(_run_check,
+                                                                [(name, args.fast_forward) for name in names]):
+            failed += error is not None
+            print(f"{name:<44} {'FAIL' if error else 'ok':<6} {cycles:>8} {seconds:>7.2f} {cycles / seconds:>9.0f}")
+            if error:
+                print("    " + error.rstrip().replace("\n", "\n    "))
+    print(f"\n{len(names) - failed} of {len(names)} checks passed in {time.perf_counter() - start:.2f} s "
+          f"with {min(args.jobs, len(names))} processes")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,83 @@
+"""Replay in simulation the button presses recorded on a board by `Pong(input_recorder=True)`.
+
+    python -m tools.replay step_4 recording.txt --frequency 12e6 --option input_recorder=True [--option ai=True]
+                           [--cycles N] [--vcd replay.vcd] [--uart-model]
+
+The recording is the line sent on the UART when `R` is received (`R n=<words> <word> ...`, see
+`instrumentation.InputRecorder`). The buttons are driven so that the design sees each change at the cycle it was
+recorded, counted from the reset: the simulation is cycle-exact when it runs at the clock frequency of the board
+(`--frequency 12e6` for the ICEStick), and the design is built with the same options, given by `--option` (the
+constructor arguments of `Pong` used for the board, `input_recorder=True` included). Without `--cycles`, the
+simulation stops a second after the last change.
+"""
+from amaranth.sim import Passive
+
+from .sim import Harness, argument_parser
+
+
+BUTTONS = [1, 2, 3, 4, 5]  # buttons recorded, from bit 0
+DEPTH = 256  # words of the recorder
+DELTA_BITS = 10
+SYNC_STAGES = 2  # the buttons are seen by the design through 2 flip-flops
+
+
+def decode(line):
+    """Changes of a recording, as a list of `(cycle, buttons)` tuples"""
+    header, *words = line.split()
+    if header != "R" or not words or not words[0].startswith("n="):
+        raise ValueError("not a recording")
+    total = int(words[0][2:], 16)
+    if total > DEPTH:
+        raise ValueError("the oldest words of the recording have been overwritten, "
+                         "it cannot be replayed from the reset")
+    changes = []
+    cycle = 0
+    periods = 0
+    for word in words[1:]:
+        word = int(word, 16)
+        if word >> 15:
+            periods += word & 0x7fff
+        else:
+            cycle += (periods << DELTA_BITS) + (word & (2**DELTA_BITS - 1))
+            periods = 0
+            changes.append((cycle, (word >> DELTA_BITS) & 0x1f))
+    return changes
+
+
+def replay_buttons(harness, changes):
+    """Process pressing and releasing the buttons at the recorded cycles"""
+    def process():
+        yield Passive()
+        now = 0
+        for cycle, buttons in changes:
+            cycle -= SYNC_STAGES
+            yield harness.wait(cycle - now)
+            now = cycle
+            for bit, number in enumerate(BUTTONS):
+                if ("button", number) in harness.pins:
+                    yield harness.button(number).eq(~(buttons >> bit) & 1)
+    return process
+
+
+if __name__ == "__main__":
+    parser = argument_parser(__doc__)
+    parser.set_defaults(cycles=None)
+    parser.add_argument("recording", help="file holding the line sent by the recorder")
+    args = parser.parse_args()
+
+    with open(args.recording) as f:
+        changes = decode(next(line for line in f if line.startswith("R ")))
+    harness = Harness(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                      fast_forward=args.fast_forward, **dict(args.option))
+    harness.add_process(replay_buttons(harness, changes))
+    cycles = args.cycles
+    if cycles is None:
+        cycles = (changes[-1][0] if changes else 0) + int(args.frequency)
+    if args.vcd:
+        with harness.write_vcd(args.vcd):
+            harness.run(cycles)
+    else:
+        harness.run(cycles)
+    print(f"{len(changes)} changes replayed in {cycles} cycles")
+    if harness.uart_models:
+        print(harness.uart_bytes().decode(errors="replace"), end="")
@@ -0,0 +1,393 @@
+"""Simulation harness for the workshop designs.
+
+    python -m tools.sim step_3 --cycles 20000 [--frequency 1000] [--seed 0] [--vcd pong.vcd] [--fast-forward [--check]]
+    python -m tools.sim step_4 --uart-model --restore warm.ckpt --cycles 20000
+    python -m tools.sim step_4 --uart-model --option balls=2 --option accelerate_rackets=True
+
+The design is elaborated for the ICEStick platform with a scaled-down clock frequency: every timer derived from
+`platform.default_clk_frequency` expires after a few cycles instead of millions, so that a game can be simulated in
+seconds. The board pins requested by the design (buttons, LED matrix, UART) are available in `Harness.pins`.
+
+With `--fast-forward`, the cycles where only the timers count are skipped (see `Harness.run`), and `--check` runs a
+full simulation alongside, comparing the registers every `--check-interval` cycles. `--restore` starts the
+simulation from a checkpoint saved by `tools.checkpoint` instead of the reset. `--option` passes an argument to the
+constructor of the design, as a Python literal.
+"""
+import argparse
+import ast
+import random
+import sys
+from collections import Counter
+from types import SimpleNamespace
+
+from amaranth import Fragment, Signal
+from amaranth.sim import Delay, Simulator
+from amaranth_boards.icestick import ICEStickPlatform
+
+from . import pysim
+from .steps import load_design, make_platform
+from .uart_model import UARTModel, UARTRxModel
+
+
+# Default simulated clock frequency. At 1 kHz the rackets move every 100 cycles, the ball every 142 cycles and the
+# buttons are debounced for 50 cycles.
+SIM_CLK_FREQUENCY = 1000
+
+# Names of the counters the fast-forward updates in bulk: the timers of the rackets, the ball and the LED matrix, the
+# time stamp of the latency meter and the cycles counted by the input recorder
+FAST_FORWARD_COUNTERS = ("timer", "now", "elapsed")
+
+
+class SimPlatform(ICEStickPlatform):
+    """ICEStick platform used to elaborate a design for simulation
+
+    It records the pins requested by the design, and reports `clk_frequency` as the board clock frequency. The pins
+    requested with `xdr=1` are registered in their IO tile: `pins` holds their pads, and `io_registers` the
+    `(destination, source)` signals of the flip-flops between the pads and the design, clocked by the `sync` domain.
+    """
+    def __init__(self, clk_frequency=SIM_CLK_FREQUENCY):
+        super().__init__()
+        self._clk_frequency = clk_frequency
+        self.pins = {}
+        self.io_registers = []
+
+    @property
+    def default_clk_frequency(self):
+        return self._clk_frequency
+
+    def request(self, name, number=0, *args, **kwargs):
+        pins = super().request(name, number, *args, **kwargs)
+        if kwargs.get("xdr"):
+            pads = SimpleNamespace()
+            for direction in ["i", "o"]:
+                if hasattr(pins, direction):
+                    pin = getattr(pins, direction)
+                    pad = Signal.like(pin, name=f"{pin.name}_pad")
+                    setattr(pads, direction, pad)
+                    self.io_registers.append((pin, pad) if direction == "i" else (pad, pin))
+            self.pins[name, number] = pads
+        else:
+            self.pins[name, number] = pins
+        return pins
+
+
+class Harness:
+    """Simulate a workshop design
+
+    `design` is a step name or `path/to/file.py[:ClassName]`, and `kwargs` are passed to the design constructor.
+    Buttons are active low, like on the board: they are released (1) until a process presses them. The UART rx
+    line is idle (1).
+
+    With `uart_model=True`, the UART transmitters are replaced by `UARTModel`s accepting a byte every
+    `uart_latency + 1` cycles, and the bytes sent are returned by `uart_bytes()`. The UART receivers are replaced
+    by `UARTRxModel`s, and `uart_send()` sends them bytes.
+
+    With `fast_forward=True`, `run()` skips the quiescent periods of the design, updating the signals named in
+    `counters` in bulk.
+    """
+    def __init__(self, design, *, clk_frequency=SIM_CLK_FREQUENCY, uart_model=False, uart_latency=1,
+                 fast_forward=False, counters=FAST_FORWARD_COUNTERS, **kwargs):
+        self.design = design
+        self.kwargs = kwargs
+        self.uart_model = uart_model
+        self.uart_latency = uart_latency
+        self.module, top = load_design(design)
+        self.platform = make_platform(self.module, SimPlatform, clk_frequency=clk_frequency)
+        self.uart_models = []
+        self.uart_rx_models = []
+        if uart_model:
+            def uart_tx_model(**kwargs):
+                model = UARTModel(latency=uart_latency, **kwargs)
+                self.uart_models.append(model)
+                return model
+
+            def uart_rx_model(**kwargs):
+                model = UARTRxModel(period=1 / clk_frequency, **kwargs)
+                self.uart_rx_models.append(model)
+                return model
+            self.platform.uart_tx_model = uart_tx_model
+            self.platform.uart_rx_model = uart_rx_model
+        self.top = top(**kwargs)
+        self.fragment = Fragment.get(self.top, self.platform)
+        self.pins = self.platform.pins
+        for (name, number), pins in self.pins.items():
+            if name == "button":
+                pins.i.reset = 1
+            if name == "uart":
+                pins.rx.i.reset = 1  # idle line
+        for destination, source in self.platform.io_registers:
+            destination.reset = source.reset
+            self.fragment.add_statements(destination.eq(source))
+            self.fragment.add_driver(destination, "sync")
+
+        self.clk_frequency = clk_frequency
+        self.period = 1 / clk_frequency
+        self.cycles = 0
+        self.sim = Simulator(self.fragment)
+        self.sim.add_clock(self.period)
+        (self._clock,) = [process for process in pysim.processes(self.sim)
+                          if isinstance(process, pysim.PyClockProcess)]
+        # the clock toggles every `period // 2` picoseconds: cycles are counted in multiples of twice that
+        self._clock_period = self._clock.period // 2 * 2
+        self._pollers = {}  # process of each UART receiver model
+        for model in self.uart_models + self.uart_rx_models:
+            processes = set(pysim.processes(self.sim))
+            self.sim.add_process(model.process)
+            if model in self.uart_rx_models:
+                (process,) = pysim.processes(self.sim) - processes
+                self._pollers[process] = model
+        self.skipped = 0  # cycles skipped by the fast-forward
+        self._fast_forward = fast_forward
+        if fast_forward:
+            self._counters = [pysim.slot(self.sim, signal) for path, signal in self.registers()
+                              if signal.name in counters]
+            self._others = []  # every other signal, updated when the simulator adds signals
+
+    def button(self, number):
+        """Input signal of a button. Use `yield harness.press(number)` from a process to press it"""
+        return self.pins["button", number].i
+
+    def press(self, number):
+        return self.button(number).eq(0)
+
+    def release(self, number):
+        return self.button(number).eq(1)
+
+    def uart_bytes(self):
+        """Bytes sent on the UART since the last call, when the UART is modeled"""
+        return b"".join(model.received() for model in self.uart_models)
+
+    def signal(self, path):
+        """Signal of the design, named by the path of the module driving it, e.g. `"uart.ack"` or `"is_pressed"`"""
+        *modules, name = path.split(".")
+        fragment = self.fragment
+        for module in modules:
+            for subfragment, subname in fragment.subfragments:
+                if subname == module:
+                    fragment = subfragment
+                    break
+            else:
+                raise KeyError(f"no module {module!r} in {path!r}")
+        signals = [signal for signals in fragment.drivers.values() for signal in signals if signal.name == name]
+        if len(signals) != 1:
+            raise KeyError(f"{len(signals)} signals are named {path!r}")
+        return signals[0]
+
+    def registers(self):
+        """Paths and signals driven by a clock domain, in the order of the hierarchy
+
+        The unnamed modules are named `U$<index>` like in the generated Verilog, and `$<n>` is appended to the
+        paths already used.
+        """
+        def walk(fragment, prefix):
+            for domain, signals in fragment.drivers.items():
+                if domain is not None:
+                    for signal in signals:
+                        yield prefix + signal.name, signal
+            for index, (subfragment, subname) in enumerate(fragment.subfragments):
+                yield from walk(subfragment, f"{prefix}{subname if subname else f'U${index}'}.")
+
+        registers = []
+        used = Counter()
+        for path, signal in walk(self.fragment, ""):
+            used[path] += 1
+            registers.append((path if used[path] == 1 else f"{path}${used[path] - 1}", signal))
+        return registers
+
+    def value(self, signal):
+        """Current value of a signal, outside of the simulation processes"""
+        return pysim.slot(self.sim, signal).curr
+
+    def uart_send(self, data):
+        """Send bytes to the design, when the UART is modeled. They are received while the simulation runs"""
+        if not self.uart_rx_models:
+            raise ValueError("the design has no modeled UART receiver")
+        for model in self.uart_rx_models:
+            model.send(data)
+
+    def add_process(self, process):
+        self.sim.add_process(process)
+
+    def add_sync_process(self, process, *, domain="sync"):
+        self.sim.add_sync_process(process, domain=domain)
+
+    def wait(self, cycles):
+        """Command for processes: wait for a number of clock cycles, without waking up at every clock edge"""
+        return Delay(cycles * self._clock_period / 1e12)
+
+    def run(self, cycles):
+        """Simulate `cycles` more clock cycles
+
+        With `fast_forward`, the state is compared after each cycle with the state after the previous one. When only
+        the counters have changed, by one, the design is quiescent: while no counter reaches zero (or wraps around)
+        and no process changes an input, the next cycles only count. The counters are then set to their value
+        some cycles later, and the time is advanced by as many cycles at once. A process waiting for every clock
+        edge prevents skipping cycles, and the UART receiver models are only woken up when they have bytes to send.
+        """
+        end = self.cycles + cycles
+        previous = None
+        while self.cycles < end:
+            self.cycles += 1
+            while pysim.now(self.sim) < self.cycles * self._clock_period:
+                self.sim.advance()
+            if not self._fast_forward:
+                continue
+            slots = pysim.slots(self.sim)
+            if len(slots) != len(self._others) + len(self._counters):
+                self._others = [slot for slot in slots if all(slot is not counter for counter in self._counters)]
+                previous = None
+            values = [slot.curr for slot in self._others], [slot.curr for slot in self._counters]
+            if previous is not None and values[0] == previous[0]:
+                skip = self._quiescent_cycles(previous[1], values[1], end - self.cycles - 1)
+                if skip > 0:
+                    self._skip(skip, previous[1], values[1])
+            previous = values
+
+    def _quiescent_cycles(self, previous, counters, limit):
+        """Number of cycles which can be skipped, given the counters after the last two cycles"""
+        for slot, before, after in zip(self._counters, previous, counters):
+            width = len(slot.signal)
+            step = (after - before) % 2**width
+            if step == 1:  # up to the wrap around
+                limit = min(limit, 2**width - 1 - after if after else 0)
+            elif step == 2**width - 1:  # down to 1
+                limit = min(limit, after - 1)
+            elif step != 0:
+                return 0
+        if limit <= 0:
+            return 0
+
+        now = pysim.now(self.sim)
+        for process in pysim.processes(self.sim):
+            if process.runnable and process is not self._clock:
+                return 0
+        for process in pysim.slots(self.sim)[self._clock.slot].waiters:
+            if isinstance(process, pysim.PyCoroProcess):  # `Tick()`
+                return 0
+        for process, deadline in pysim.deadlines(self.sim).items():
+            if process is self._clock or process in self._pollers and self._pollers[process].queue.empty():
+                continue
+            if deadline is None:
+                return 0
+            limit = min(limit, (deadline - now) // self._clock_period)
+        return limit
+
+    def _skip(self, cycles, previous, counters):
+        for index, (slot, before, after) in enumerate(zip(self._counters, previous, counters)):
+            if after != before:
+                counters[index] = (after + (after - before) * cycles) % 2**len(slot.signal)
+                slot.set(counters[index])
+        now = pysim.now(self.sim) + cycles * self._clock_period
+        pysim.set_now(self.sim, now)
+        deadlines = pysim.deadlines(self.sim)
+        for process, model in self._pollers.items():
+            deadline = deadlines.get(process)
+            if deadline is not None and deadline < now:  # keep polling at the same times
+                poll = int(model._poll_time * 1e12)
+                deadlines[process] = deadline - (deadline - now) // poll * poll
+        self.cycles += cycles
+        self.skipped += cycles
+
+    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=()):
+        return self.sim.write_vcd(vcd_file, gtkw_file, traces=traces)
+
+    def random_buttons(self, seed=0, *, buttons=None, mean_interval=200):
+        """Process pressing and releasing buttons at random, with `mean_interval` cycles between changes
+
+        By default only the racket buttons (1 to 4) are used. The same seed always yields the same stimulus, so that
+        two designs can be compared.
+        """
+        rng = random.Random(seed)
+        if buttons is None:
+            buttons = sorted(number for name, number in self.pins if name == "button" and number <= 4)
+
+        def process():
+            pressed = set()
+            while True:
+                yield self.wait(rng.randrange(1, 2 * mean_interval))
+                number = rng.choice(buttons)
+                if number in pressed:
+                    pressed.remove(number)
+                    yield self.release(number)
+                else:
+                    pressed.add(number)
+                    yield self.press(number)
+        return process
+
+
+def design_option(text):
+    """`(name, value)` of a design constructor argument given as `NAME=VALUE`, the value being a Python literal"""
+    name, _, value = text.partition("=")
+    return name, ast.literal_eval(value)
+
+
+def argument_parser(description=__doc__):
+    """Command line arguments shared by the simulation tools"""
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("design", help="step name or path/to/file.py[:ClassName]")
+    parser.add_argument("--cycles", type=int, default=20000, help="number of clock cycles to simulate")
+    parser.add_argument("--frequency", type=float, default=SIM_CLK_FREQUENCY, help="simulated clock frequency")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random button presses")
+    parser.add_argument("--vcd", metavar="FILE", help="write the waveforms to a VCD file")
+    parser.add_argument("--uart-model", action="store_true",
+                        help="replace the UART transmitter and receiver with transaction-level models")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="skip the cycles where only the timers count")
+    parser.add_argument("--option", type=design_option, action="append", default=[], metavar="NAME=VALUE",
+                        help="argument of the design constructor, e.g. balls=2, may be repeated")
+    return parser
+
+
+def differences(harness, reference):
+    """Paths of the registers whose values differ between two harnesses simulating the same design"""
+    return [path for (path, signal), (_, other) in zip(harness.registers(), reference.registers())
+            if harness.value(signal) != reference.value(other)]
+
+
+if __name__ == "__main__":
+    parser = argument_parser()
+    parser.add_argument("--check", action="store_true",
+                        help="compare the fast-forwarded simulation with a full simulation")
+    parser.add_argument("--check-interval", type=int, default=1000, metavar="CYCLES",
+                        help="cycles between the comparisons")
+    parser.add_argument("--restore", metavar="FILE", help="start from a checkpoint saved by tools.checkpoint")
+    args = parser.parse_args()
+    checkpoint = None
+    if args.restore:
+        from .checkpoint import load, restore
+        checkpoint = load(args.restore)
+    harness = Harness(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                      fast_forward=args.fast_forward, **dict(args.option))
+    if checkpoint:
+        restore(harness, checkpoint)
+    harness.add_process(harness.random_buttons(args.seed))
+    if not args.check:
+        if args.vcd:
+            with harness.write_vcd(args.vcd):
+                harness.run(args.cycles)
+        else:
+            harness.run(args.cycles)
+        sent = harness.uart_bytes()
+    else:
+        reference = Harness(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                            **dict(args.option))
+        if checkpoint:
+            restore(reference, checkpoint)
+        reference.add_process(reference.random_buttons(args.seed))
+        sent = b""
+        end = harness.cycles + args.cycles
+        while harness.cycles < end:
+            cycles = min(args.check_interval, end - harness.cycles)
+            harness.run(cycles)
+            reference.run(cycles)
+            data = harness.uart_bytes()
+            different = differences(harness, reference)
+            if data != reference.uart_bytes():
+                different.append("UART bytes")
+            if different:
+                parser.exit(1, f"cycle {harness.cycles}: {', '.join(different)} differ from the full simulation\n")
+            sent += data
+    if harness.uart_models:
+        print(sent.decode(errors="replace"), end="")
+    if args.fast_forward:
+        print(f"{harness.skipped} of {harness.cycles} cycles skipped", file=sys.stderr)
@@ -0,0 +1,174 @@
+"""Find the hot spots of a workshop design simulation.
+
+    python -m tools.simprof step_3 --cycles 20000 [--top 15]
+
+The simulator time is attributed to each module and clock domain of the design (the Python code the simulator
+compiled from its statements), to the testbench processes and to the clock generator. The signals which change most
+often are listed with the module driving them. Free-running timers show up at the top of both lists, which tells what
+is worth abstracting away (e.g. replacing a timer with a tick strobe, or a module with a transaction-level model).
+
+This relies on the internals of the Amaranth Python simulator (see `tools.pysim`).
+"""
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from amaranth.hdl.ast import SignalDict
+
+from . import pysim
+from .sim import Harness, argument_parser
+
+
+@contextmanager
+def _tag_rtl_processes(tags):
+    """Record the module path of each process compiled from the design statements"""
+    original_call = pysim.FragmentCompiler.__call__
+    paths = {}
+
+    def tagged_call(self, fragment):
+        if not paths:
+            def visit(fragment, path):
+                paths[id(fragment)] = path
+                for index, (subfragment, name) in enumerate(fragment.subfragments):
+                    visit(subfragment, f"{path}.{name if name is not None else f'U${index}'}")
+            visit(fragment, "top")
+        processes = original_call(self, fragment)
+        for process in processes:
+            # the processes of the subfragments have already been tagged by the nested calls
+            tags.setdefault(process, paths[id(fragment)])
+        return processes
+
+    pysim.FragmentCompiler.__call__ = tagged_call
+    try:
+        yield
+    finally:
+        pysim.FragmentCompiler.__call__ = original_call
+
+
+class _ChangeCounter:
+    """Count the value changes of every signal. Registered with the simulator as if it was a VCD writer"""
+
+    def __init__(self):
+        self.changes = SignalDict()
+        self.values = SignalDict()
+
+    def update(self, timestamp, signal, value):
+        if self.values.get(signal, signal.reset) != value:
+            self.values[signal] = value
+            self.changes[signal] = self.changes.get(signal, 0) + 1
+
+    def close(self, timestamp):
+        pass
+
+
+class SimProfiler:
+    """Profile a simulation harness. The harness is built by `SimProfiler.build()` so that its processes are tagged"""
+
+    def __init__(self):
+        self._tags = {}
+        self.times = defaultdict(float)
+        self.calls = Counter()
+        self.changes = _ChangeCounter()
+        self.harness = None
+        self.wall_time = 0.0
+        self._instrumented = set()
+
+    def build(self, *args, **kwargs):
+        with _tag_rtl_processes(self._tags):
+            self.harness = Harness(*args, **kwargs)
+        return self.harness
+
+    def _label(self, process, sim):
+        if isinstance(process, pysim.PyRTLProcess):
+            path = self._tags.get(process, "?")
+            if process.is_comb:
+                return path, "comb"
+            for domain in pysim.fragment(sim).domains.values():
+                if process in pysim.slot(sim, domain.clk).waiters:
+                    return path, domain.name
+            return path, "?"
+        if isinstance(process, pysim.PyClockProcess):
+            return "(clock)", ""
+        if isinstance(process, pysim.PyCoroProcess):
+            # `Simulator.add_process()` wraps the user process in a closure
+            constructor = process.constructor
+            for cell in constructor.__closure__ or ():
+                if callable(cell.cell_contents):
+                    constructor = cell.cell_contents
+            return f"(process {constructor.__qualname__})", ""
+        return f"({type(process).__name__})", ""
+
+    def _instrument(self):
+        sim = self.harness.sim
+        for process in pysim.processes(sim) - self._instrumented:
+            self._instrumented.add(process)
+            label = self._label(process, sim)
+            run = process.run
+
+            def timed_run(run=run, label=label):
+                start = time.perf_counter()
+                run()
+                self.times[label] += time.perf_counter() - start
+                self.calls[label] += 1
+
+            process.run = timed_run
+        if self.changes not in pysim.observers(sim):
+            pysim.observers(sim).append(self.changes)
+
+    def run(self, cycles):
+        """Run the harness for `cycles` cycles, profiling the processes (the ones added so far included)"""
+        self._instrument()
+        start = time.perf_counter()
+        self.harness.run(cycles)
+        self.wall_time += time.perf_counter() - start
+
+    def drivers(self):
+        """Module path driving each signal of the design"""
+        drivers = SignalDict()
+
+        def visit(fragment, path):
+            for signals in fragment.drivers.values():
+                for signal in signals:
+                    drivers[signal] = path
+            for index, (subfragment, name) in enumerate(fragment.subfragments):
+                visit(subfragment, f"{path}.{name if name is not None else f'U${index}'}")
+        visit(pysim.fragment(self.harness.sim), "top")
+        return drivers
+
+    def report(self, top=15):
+        cycles = self.harness.cycles
+        print(f"{cycles} cycles in {self.wall_time:.2f} s: {cycles / self.wall_time:.0f} cycles/s\n")
+
+        print(f'{"module":<40} {"domain":<8} {"time %":>7} {"runs":>9} {"us/run":>8}')
+        measured = sum(self.times.values())
+        by_module = defaultdict(float)
+        for (path, domain), elapsed in sorted(self.times.items(), key=lambda item: -item[1]):
+            by_module[path] += elapsed
+            calls = self.calls[path, domain]
+            print(f"{path:<40} {domain:<8} {100 * elapsed / measured:>7.1f} {calls:>9} "
+                  f"{1e6 * elapsed / calls:>8.2f}")
+        print(f"{'(simulator kernel)':<40} {'':<8} {100 * (1 - measured / self.wall_time):>7.1f} "
+              f"(% of wall time)\n")
+
+        print(f'{"module":<40} {"time %":>7} {"cycles/s if alone":>18}')
+        for path, elapsed in sorted(by_module.items(), key=lambda item: -item[1]):
+            print(f"{path:<40} {100 * elapsed / measured:>7.1f} {cycles / elapsed:>18.0f}")
+        print()
+
+        drivers = self.drivers()
+        print(f'{"signal":<32} {"module":<40} {"changes":>9} {"per cycle":>9}')
+        for signal, count in sorted(self.changes.changes.items(), key=lambda item: -item[1])[:top]:
+            print(f"{signal.name:<32} {drivers.get(signal, '(testbench)'):<40} {count:>9} {count / cycles:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argument_parser(__doc__)
+    parser.add_argument("--top", type=int, default=15, help="number of signals to list")
+    args = parser.parse_args()
+
+    profiler = SimProfiler()
+    harness = profiler.build(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                             fast_forward=args.fast_forward)
+    harness.add_process(harness.random_buttons(args.seed))
+    profiler.run(args.cycles)
+    profiler.report(args.top)
@@ -0,0 +1,67 @@
+"""Load the workshop step designs so that the tools can build, profile or simulate them.
+
+The workshop files are standalone scripts (they are not part of a Python package), so they are imported from their
+path. A design is designated as `path/to/file.py` or `path/to/file.py:ClassName`, or by one of the `DESIGNS` names.
+"""
+import importlib.util
+import os
+import re
+import sys
+
+from amaranth import Elaboratable
+from amaranth_boards.icestick import ICEStickPlatform
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The top-level design of each workshop step
+DESIGNS = {
+    "step_1": "step_1/solution.py:Top",
+    "step_2": "step_2/solution.py:Pong",
+    "step_3": "step_3/solution.py:Pong",
+    "step_4": "step_4/solution.py:Pong",
+    "uart_demo": "step_4/uart_demo.py:UartDemo",
+}
+
+
+def load_module(path):
+    """Import a workshop file from its path. Its directory is added to `sys.path` so that siblings can be imported"""
+    path = os.path.abspath(os.path.join(ROOT, path))
+    # e.g. `step_4_solution`: the `..` of the paths outside of the repository are replaced too
+    name = re.sub(r"\W", "_", os.path.relpath(os.path.splitext(path)[0], ROOT))
+    if name in sys.modules:
+        return sys.modules[name]
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_design(design):
+    """Return `(module, top_class)` for a design name or `path[:ClassName]`.
+
+    When no class is given, the top-level design is the last Elaboratable defined in the file, like in every step.
+    """
+    design = DESIGNS.get(design, design)
+    path, _, class_name = design.partition(":")
+    module = load_module(path)
+    if class_name:
+        return module, getattr(module, class_name)
+    elaboratables = [obj for obj in vars(module).values()
+                     if isinstance(obj, type) and issubclass(obj, Elaboratable)
+                     and obj.__module__ == module.__name__]
+    if not elaboratables:
+        raise ValueError(f"{path} does not define any Elaboratable")
+    return module, elaboratables[-1]
+
+
+def make_platform(module, platform_class=ICEStickPlatform, **kwargs):
+    """Instantiate the board platform, with the workshop extension board resources when the step declares them"""
+    platform = platform_class(**kwargs)
+    if hasattr(module, "workshop_pcba"):
+        platform.add_resources(module.workshop_pcba)
+    return platform
@@ -0,0 +1,128 @@
+"""Report the FPGA resources used by a workshop design, for a sweep of one of its parameters.
+
+    python -m tools.synth step_4 [--param balls=1,2,4,8,16] [--pll 48e6,96e6] [--place] [--json synth.json]
+    python -m tools.synth step_4 --param width=8,16,32 --param height=8,16 --place
+
+Each variant is built with the toolchain commands of the platform build script, in `{build_dir}/{name}`: yosys, then
+nextpnr, which stops after packing the design into logic cells unless `--place` is given. The resources are read from
+the utilisation report of nextpnr: logic cells (`ICESTORM_LC`, a LUT4 and a flip-flop each), block RAMs
+(`ICESTORM_RAM`), IOs... A design too large for the FPGA is still reported. With `--place`, the maximum clock
+frequency and the delays of the paths from the input pads and to the output pads are reported too. `--param` values
+are Python literals passed to the design constructor; with several `--param`, every combination of their values is
+built. `--pll` builds the variants with the `PLLPlatform` of the step (see `step_4/solution.py`) for each clock
+frequency.
+"""
+import argparse
+import ast
+import itertools
+import json
+import os
+import re
+import subprocess
+
+from amaranth import Fragment
+
+from .build import script_commands
+from .steps import load_design, make_platform
+
+
+# nextpnr utilisation lines, e.g. "Info:          ICESTORM_LC:   386/ 1280    30%"
+UTILISATION = re.compile(r"^Info:\s+(\w+):\s+(\d+)/\s*(\d+)\s+\d+%$")
+# nextpnr timing lines, e.g. "Info: Max frequency for clock 'cd_sync_clk12_0__i': 126.69 MHz (PASS at 12.00 MHz)"
+# and "Info: Max delay posedge cd_sync_clk12_0__i -> <async>                   : 8.35 ns"
+FMAX = re.compile(r"^Info: Max frequency for clock\s+'(\S+)': ([\d.]+) MHz")
+MAX_DELAY = re.compile(r"^Info: Max delay (.+?)\s*->\s*(.+?)\s*: ([\d.]+) ns$")
+
+
+def utilisation(log_path):
+    """Resources used by a design, from the nextpnr log, as a dict of `(used, available)` tuples"""
+    resources = {}
+    with open(log_path) as f:
+        for line in f:
+            match = UTILISATION.match(line.strip())
+            if match:
+                resources[match[1]] = int(match[2]), int(match[3])
+    return resources
+
+
+def timing(log_path):
+    """Timing of a placed design, from the nextpnr log: the maximum frequency of each clock in MHz (`Fmax <clock>`),
+    and the maximum delays from the input pads to the flip-flops (`input`) and from the flip-flops to the output
+    pads (`output`) in ns. The last report of the log is kept, the one after routing"""
+    results = {}
+    with open(log_path) as f:
+        for line in f:
+            line = line.strip()
+            match = FMAX.match(line)
+            if match:
+                results[f"Fmax {match[1]}"] = float(match[2])
+            match = MAX_DELAY.match(line)
+            if match and match[1] == "<async>":
+                results["input"] = float(match[3])
+            elif match and match[2] == "<async>":
+                results["output"] = float(match[3])
+    return results
+
+
+def synthesize(design, build_dir, *, name="top", place=False, platform=None, **kwargs):
+    """Build `design` with the arguments `kwargs`, and return the resources it uses, and its timing when placed"""
+    module, top = load_design(design)
+    if platform is None:
+        platform = make_platform(module)
+    os.makedirs(build_dir, exist_ok=True)
+    plan = platform.prepare(Fragment.get(top(**kwargs), platform), name)
+    plan.execute_local(build_dir, run_script=False)
+
+    preamble, commands = script_commands(os.path.join(build_dir, f"{plan.script}.sh"))
+    for variable, command in commands:
+        if variable == "NEXTPNR_ICE40":
+            if not place:
+                command = re.sub(r" --asc \S+", "", command) + " --pack-only"
+            # nextpnr fails when the design does not fit, after writing its utilisation report
+            subprocess.run(["sh", "-c", f"{preamble}\n{command}"], cwd=build_dir)
+            log_path = os.path.join(build_dir, f"{name}.tim")
+            return utilisation(log_path), timing(log_path) if place else {}
+        subprocess.run(["sh", "-c", f"{preamble}\n{command}"], cwd=build_dir, check=True)
+    raise ValueError(f"{design} is not built with nextpnr-ice40")
+
+
+def parameter(text):
+    name, _, values = text.partition("=")
+    return name, [ast.literal_eval(value) for value in values.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("design", help="step name or path/to/file.py[:ClassName]")
+    parser.add_argument("--param", type=parameter, action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="constructor argument to sweep, may be repeated")
+    parser.add_argument("--pll", type=lambda text: [float(value) for value in text.split(",")], metavar="HZ,...",
+                        help="clock the design from the PLL at each of these frequencies")
+    parser.add_argument("--place", action="store_true", help="place and route the designs, instead of packing only")
+    parser.add_argument("--build-dir", default="build/synth")
+    parser.add_argument("--json", metavar="FILE", help="write the results to a JSON file")
+    args = parser.parse_args()
+
+    names = [name for name, _ in args.param]
+    module, _ = load_design(args.design)
+    results = []
+    for frequency in args.pll or [None]:
+        for values in itertools.product(*(values for _, values in args.param)):
+            kwargs = dict(zip(names, values))
+            # a platform is built once: each variant needs its own, its resources being requested again
+            platform = None if frequency is None else make_platform(module, module.PLLPlatform, frequency=frequency)
+            variant = "_".join(([] if frequency is None else [f"pll_{frequency:g}"])
+                               + [f"{name}_{value}" for name, value in kwargs.items()]) or "top"
+            resources, timings = synthesize(args.design, os.path.join(args.build_dir, variant), place=args.place,
+                                            platform=platform, **kwargs)
+            results.append({"args": kwargs, "pll": frequency, "resources": resources, "timing": timings})
+            used = "  ".join(f"{resource} {used}/{available}" for resource, (used, available) in resources.items()
+                             if used)
+            used += "".join(f"  {key} {delay:.2f} {'MHz' if key.startswith('Fmax') else 'ns'}"
+                            for key, delay in timings.items())
+            label = " ".join(([] if frequency is None else [f"{frequency / 1e6:g} MHz"])
+                             + [f"{name}={value}" for name, value in kwargs.items()])
+            print(f"{label:>20}  {used}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
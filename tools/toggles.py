@@ -0,0 +1,119 @@
+"""Estimate the switching activity of a design in simulation, while it is played and once it is left alone.
+
+    python -m tools.toggles step_4 [--param idle_after=None,5] [--active 20000] [--cycles 100000]
+
+The dynamic power of an FPGA design is proportional to the toggle rate of its nets. The design is simulated with
+random button presses for `--active` cycles, then without any press for `--cycles` cycles (quiet), and the bits of its
+registers and output pins which toggle are counted in both phases. The toggles per cycle are reported for each
+module, and for each value of the `--param` constructor argument, to compare variants (e.g. with and without the
+idle mode of `Pong`).
+"""
+import argparse
+import random
+from collections import Counter
+
+from amaranth.hdl.ast import SignalDict
+
+from . import pysim
+from .sim import SIM_CLK_FREQUENCY, Harness
+from .synth import parameter
+
+
+class ToggleCounter:
+    """Count the bits toggling in `signals` (a dict of names and signals), by phase.
+    Registered with the simulator as if it was a VCD writer"""
+
+    def __init__(self, harness, signals):
+        self.phase = None  # toggles are not counted until a phase is set
+        self.toggles = Counter()  # of each `(phase, name)`
+        self._names = SignalDict((signal, name) for name, signal in signals.items())
+        self._values = SignalDict((signal, harness.value(signal)) for signal in self._names)
+        pysim.observers(harness.sim).append(self)
+
+    def update(self, timestamp, signal, value):
+        if signal in self._names:
+            if self.phase is not None:
+                self.toggles[self.phase, self._names[signal]] += bin(self._values[signal] ^ value).count("1")
+            self._values[signal] = value
+
+    def close(self, timestamp):
+        pass
+
+
+def _presses(harness, cycles, seed, *, mean_interval=200):
+    """Process pressing and releasing the racket buttons at random for `cycles` cycles, then releasing them all"""
+    rng = random.Random(seed)
+    buttons = sorted(number for name, number in harness.pins if name == "button" and number <= 4)
+
+    def process():
+        pressed = set()
+        waited = 0
+        while True:
+            delay = rng.randrange(1, 2 * mean_interval)
+            if waited + delay >= cycles:  # the buttons are released before the end of the `cycles` cycles
+                break
+            yield harness.wait(delay)
+            waited += delay
+            number = rng.choice(buttons)
+            pressed ^= {number}
+            yield harness.press(number) if number in pressed else harness.release(number)
+        for number in pressed:
+            yield harness.release(number)
+    return process
+
+
+def _module(name):
+    """Module of a register path, e.g. `ledm` for `ledm.col`"""
+    return name.rpartition(".")[0] or "(top)"
+
+
+def measure(design, *, active, cycles, seed=0, frequency=SIM_CLK_FREQUENCY, **kwargs):
+    """Bits toggling per cycle in each module of `design` built with the arguments `kwargs`, while buttons are
+    pressed for `active` cycles (`"active"`), then for the `cycles` cycles without any press (`"quiet"`):
+    `{"active": {module: rate}, "quiet": {module: rate}}`"""
+    harness = Harness(design, clk_frequency=frequency, uart_model=True, **kwargs)
+    signals = dict(harness.registers())
+    for (name, number), pins in harness.pins.items():
+        if hasattr(pins, "o"):
+            signals[f"(pins).{name}{number}"] = pins.o
+    counter = ToggleCounter(harness, signals)
+    harness.add_process(_presses(harness, active, seed))
+    for phase, phase_cycles in [("active", active), ("quiet", cycles)]:
+        counter.phase = phase
+        harness.run(phase_cycles)
+    rates = {"active": Counter(), "quiet": Counter()}
+    for (phase, name), toggles in counter.toggles.items():
+        rates[phase][_module(name)] += toggles / (active if phase == "active" else cycles)
+    return rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("design", help="step name or path/to/file.py[:ClassName]")
+    parser.add_argument("--param", type=parameter, metavar="NAME=V1,V2,...", help="constructor argument to compare")
+    parser.add_argument("--active", type=int, default=20000, help="number of cycles with random button presses")
+    parser.add_argument("--cycles", type=int, default=100000, help="number of cycles without any press")
+    parser.add_argument("--frequency", type=float, default=SIM_CLK_FREQUENCY, help="simulated clock frequency")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random button presses")
+    args = parser.parse_args()
+
+    name, values = args.param or (None, [None])
+    results = {}
+    for value in values:
+        kwargs = {} if name is None else {name: value}
+        results[value] = measure(args.design, active=args.active, cycles=args.cycles, seed=args.seed,
+                                 frequency=args.frequency, **kwargs)
+
+    labels = [f"{name}={value}" if name is not None else "toggles/cycle" for value in values]
+    width = max(len(label) for label in labels)
+    modules = sorted({module for rates in results.values() for phase in rates.values() for module in phase})
+    print(f'{"module":<16}' + "".join(f"  {label:>{width + 9}}" for label in labels))
+    print(f'{"":<16}' + "".join(f"  {'active':>{width // 2 + 4}} {'quiet':>{width - width // 2 + 4}}"
+                                 for _ in labels))
+    for module in modules + [None]:
+        cells = []
+        for value in values:
+            active, quiet = (sum(rates.values()) if module is None else rates[module]
+                             for rates in (results[value]["active"], results[value]["quiet"]))
+            cells.append(f"  {active:>{width // 2 + 4}.3f} {quiet:>{width - width // 2 + 4}.3f}")
+        print(f"{module or 'total':<16}" + "".join(cells))
@@ -0,0 +1,181 @@
+"""Record selected signals of a long simulation to a compressed VCD file.
+
+    python -m tools.tracewriter step_4 --cycles 1000000 -o pong.vcd.gz \\
+        --signal ball.row --signal ball.col --signal racket_one.leds --signal score_one \\
+        --trigger ball.one_scored=1 --pre 2000 --post 500
+
+`Harness.write_vcd()` records every signal of the design for the whole simulation, and the free-running timers
+alone change at every cycle. The trace writer only records the signals of an allow-list, named by the path of the
+module driving them (see `Harness.signal()`), during time windows: fixed ones (`--window START:STOP`, in cycles)
+and the ones opened by a trigger, from `--pre` cycles before the trigger signal takes its value to `--post` cycles
+after. The changes are streamed to disk, compressed with gzip when the file name ends with `.gz` (GTKWave opens
+`.vcd.gz` files directly). The `trace_active` variable is 1 while recording.
+"""
+import gzip
+from collections import deque
+
+from amaranth.hdl.ast import SignalDict
+
+from . import pysim
+from .sim import Harness, argument_parser
+
+
+class TraceWriter:
+    """Stream the changes of `signals` (a dict of names and signals) to a VCD file, during time windows
+
+    Windows are given in cycles: `windows` is a list of `(start, stop)` tuples, and `trigger` a `(signal, value)`
+    tuple opening a window from `pre` cycles before the signal takes the value to `post` cycles after (the window is
+    extended when the trigger happens again). Without windows nor trigger, the signals are always recorded.
+    """
+    def __init__(self, harness, path, signals, *, windows=(), trigger=None, pre=0, post=0):
+        self.harness = harness
+        self.changes = 0
+        self._period = int(harness.period * 1e12)  # the simulator counts time in picoseconds
+        self._windows = sorted((start * self._period, stop * self._period) for start, stop in windows)
+        self._always = not windows and trigger is None
+        self._trigger = trigger
+        self._pre = pre * self._period
+        self._post = post * self._period
+        self._trigger_window = None  # window opened by the trigger
+        self._active = None  # window being recorded
+        self._time = 0  # last timestamp written
+
+        self._file = gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")
+        self._ids = SignalDict()
+        self._values = SignalDict()  # current values of the traced signals
+        self._base = SignalDict()  # values `pre` cycles ago
+        self._history = deque()  # changes of the last `pre` cycles, not written yet
+
+        self._file.write("$timescale 1 ps $end\n$scope module top $end\n")
+        self._file.write("$var wire 1 ! trace_active $end\n")
+        for index, (name, signal) in enumerate(signals.items()):
+            self._ids[signal] = self._identifier(index + 1)
+            self._values[signal] = self._base[signal] = signal.reset
+            self._file.write(f"$var wire {len(signal)} {self._ids[signal]} {name} $end\n")
+        self._file.write("$upscope $end\n$enddefinitions $end\n#0\n0!\n")
+
+        pysim.observers(harness.sim).append(self)
+
+    @staticmethod
+    def _identifier(index):
+        chars = ""
+        while True:
+            chars += chr(33 + index % 94)
+            index //= 94
+            if not index:
+                return chars
+
+    def _timestamp(self, timestamp):
+        if timestamp > self._time:
+            self._time = timestamp
+            self._file.write(f"#{timestamp}\n")
+
+    def _write(self, timestamp, signal, value):
+        self._timestamp(timestamp)
+        if len(signal) == 1:
+            self._file.write(f"{value}{self._ids[signal]}\n")
+        else:
+            self._file.write(f"b{value:b} {self._ids[signal]}\n")
+        self.changes += 1
+
+    def _open(self, window):
+        self._active = window
+        while self._history and self._history[0][0] <= window[0]:
+            _, signal, value = self._history.popleft()
+            self._base[signal] = value
+        self._timestamp(window[0])
+        self._file.write("1!\n")
+        for signal, value in self._base.items():  # the values when the window opens
+            self._write(window[0], signal, value)
+        for change in self._history:  # the window opened in the past
+            self._write(*change)
+        self._history.clear()
+
+    def _close(self):
+        self._timestamp(self._active[1])
+        self._file.write("0!\n")
+        self._active = None
+
+    def _window(self, timestamp):
+        """Window containing `timestamp`, or None"""
+        if self._always:
+            return 0, float("inf")
+        while self._windows and self._windows[0][1] < timestamp:
+            self._windows.pop(0)
+        windows = [window for window in [self._trigger_window, *self._windows[:1]]
+                   if window is not None and window[0] <= timestamp <= window[1]]
+        if windows:
+            return min(window[0] for window in windows), max(window[1] for window in windows)
+
+    def update(self, timestamp, signal, value):
+        """Called by the simulator for every signal change"""
+        if self._trigger is not None and signal is self._trigger[0] and value == self._trigger[1]:
+            if self._active is None:
+                self._open((max(timestamp - self._pre, self._time), timestamp + self._post))
+            self._trigger_window = (self._active[0], timestamp + self._post)
+
+        window = self._window(timestamp)
+        if self._active is not None and window is None:
+            self._close()
+        elif window is not None:
+            if self._active is None:
+                self._open(window)
+            self._active = window
+
+        if signal not in self._ids:
+            return
+        self._values[signal] = value
+        if self._active:
+            self._base[signal] = value
+            self._write(timestamp, signal, value)
+        elif self._pre:
+            self._history.append((timestamp, signal, value))
+            while self._history and self._history[0][0] < timestamp - self._pre:
+                _, old_signal, old_value = self._history.popleft()
+                self._base[old_signal] = old_value
+        else:
+            self._base[signal] = value
+
+    def close(self, timestamp=None):
+        if self._file.closed:
+            return
+        if self._active is not None:
+            if timestamp is None:
+                timestamp = pysim.now(self.harness.sim)
+            self._active = (self._active[0], min(self._active[1], timestamp))
+            self._close()
+        self._file.close()
+        if self in pysim.observers(self.harness.sim):
+            pysim.observers(self.harness.sim).remove(self)
+
+
+def _cycles_range(text):
+    start, stop = text.split(":")
+    return int(start), int(stop)
+
+
+if __name__ == "__main__":
+    parser = argument_parser(__doc__)
+    parser.add_argument("-o", "--output", default="trace.vcd.gz", help="VCD file, compressed if it ends with .gz")
+    parser.add_argument("--signal", action="append", default=[], metavar="PATH", help="signal to record")
+    parser.add_argument("--window", action="append", default=[], type=_cycles_range, metavar="START:STOP",
+                        help="record between these cycles")
+    parser.add_argument("--trigger", metavar="PATH=VALUE", help="record around the cycles the signal has the value")
+    parser.add_argument("--pre", type=int, default=0, help="cycles recorded before the trigger")
+    parser.add_argument("--post", type=int, default=0, help="cycles recorded after the trigger")
+    args = parser.parse_args()
+
+    harness = Harness(args.design, clk_frequency=args.frequency, uart_model=args.uart_model,
+                      fast_forward=args.fast_forward)
+    harness.add_process(harness.random_buttons(args.seed))
+    trigger = None
+    if args.trigger:
+        path, value = args.trigger.split("=")
+        trigger = harness.signal(path), int(value, 0)
+    writer = TraceWriter(harness, args.output, {path: harness.signal(path) for path in args.signal},
+                         windows=args.window, trigger=trigger, pre=args.pre, post=args.post)
+    try:
+        harness.run(args.cycles)
+    finally:
+        writer.close()
+    print(f"{writer.changes} changes written to {args.output}")
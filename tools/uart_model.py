@@ -0,0 +1,121 @@
+"""Transaction-level models of amlib's `AsyncSerialTX` and `AsyncSerialRX`, for simulation only.
+
+Simulating the real transmitter costs `10 * divisor` clock cycles per byte (104 cycles per bit at 115200 baud and
+12 MHz), with the `tx` pin toggling bit by bit. The model has the same `data`/`ack`/`rdy` stream interface, but the
+bytes are put in a Python queue and `rdy` goes back to 1 after a configurable number of cycles. Tests which only
+care about the messages run orders of magnitude faster.
+
+    harness = Harness("step_4", uart_model=True)
+    ...
+    harness.uart_bytes()  # b"0-1\\r\\n"
+
+The receiver model delivers the bytes given to `Harness.uart_send()` to the design, one every few cycles.
+
+Without `uart_model=True`, the design keeps the bit-accurate transmitter and receiver.
+"""
+import queue
+
+from amaranth import *
+from amaranth.sim import Delay, Passive, Tick
+
+
+class UARTModel(Elaboratable):
+    """Drop-in replacement of `AsyncSerialTX` accepting a byte every `latency + 1` cycles
+
+    `latency` is the number of cycles `rdy` stays low after a byte has been accepted, at least 1. `10 * divisor`
+    models the duration of the real transmission.
+    """
+    def __init__(self, *, divisor, data_bits=8, latency=1, pins=None):
+        if latency < 1:
+            raise ValueError("latency must be at least 1 cycle")
+        self.divisor = divisor
+        self.latency = latency
+        self.data = Signal(data_bits)
+        self.rdy = Signal()
+        self.ack = Signal()
+        self.o = Signal(reset=1)  # the line stays idle
+        self.queue = queue.Queue()
+        self._pins = pins
+        # The simulation process only wakes up when a byte has been accepted: `_sent` is the clock of a dedicated
+        # domain, pulsed for a cycle after each transfer, and `_byte` holds the byte.
+        self._byte = Signal(data_bits)
+        self._sent = Signal()
+        self._domain = ClockDomain("uart_model", reset_less=True, local=True)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        if self._pins is not None:
+            m.d.comb += self._pins.tx.o.eq(self.o)
+
+        busy = Signal(range(self.latency + 1))
+        m.d.comb += self.rdy.eq(busy == 0)
+        m.d.sync += self._sent.eq(0)
+        with m.If(busy != 0):
+            m.d.sync += busy.eq(busy - 1)
+        with m.Elif(self.ack):
+            m.d.sync += [
+                busy.eq(self.latency),
+                self._byte.eq(self.data),
+                self._sent.eq(1),
+            ]
+
+        m.domains += self._domain
+        m.d.comb += self._domain.clk.eq(self._sent)
+
+        return m
+
+    def process(self):
+        """Simulation process putting each byte in `queue` when it has been accepted"""
+        yield Passive()
+        while True:
+            yield Tick(self._domain)
+            self.queue.put((yield self._byte))
+
+    def received(self):
+        """Bytes accepted so far and not read yet"""
+        data = bytearray()
+        while not self.queue.empty():
+            data.append(self.queue.get_nowait())
+        return bytes(data)
+
+
+class UARTRxModel(Elaboratable):
+    """Drop-in replacement of `AsyncSerialRX` delivering the bytes put in `queue`
+
+    The queue is checked every `interval` cycles of `period` seconds, and a byte is presented on `data` with `rdy`
+    set until the design sets `ack`. `rdy` and `data` change just after a clock edge, so that they are sampled at
+    the next one.
+    """
+    def __init__(self, *, divisor, period, interval=10, data_bits=8, pins=None):
+        self.divisor = divisor
+        self.data = Signal(data_bits)  # driven by the simulation process
+        self.rdy = Signal()  # driven by the simulation process
+        self.ack = Signal()
+        self.queue = queue.Queue()
+        self._poll_time = interval * period
+
+    def elaborate(self, platform):
+        return Module()
+
+    def process(self):
+        """Simulation process presenting the bytes of `queue` to the design"""
+        yield Passive()
+        while True:
+            yield Delay(self._poll_time)
+            if self.queue.empty():
+                continue
+            # the poll may end at any time of a cycle, or at the time of a clock edge: align on the next edge
+            yield Tick()
+            while not self.queue.empty():
+                yield self.data.eq(self.queue.get_nowait())
+                yield self.rdy.eq(1)
+                yield Tick()
+                while not (yield self.ack):
+                    yield Tick()
+                yield self.rdy.eq(0)
+
+    def send(self, data):
+        """Queue bytes to be received by the design"""
+        for byte in data:
+            self.queue.put(byte)
@@ -0,0 +1,184 @@
+"""Generate the README timing diagrams from simulation traces.
+
+    python -m tools.wavetrace [--out doc]
+
+Each diagram is a short simulation of a workshop design at a scaled-down clock frequency. Selected signals are
+sampled after every clock edge and converted to WaveDrom JSON, written to `doc/diagramNN.json` for `build_doc.py`.
+A value held for several cycles is written as `.`, and when no traced signal changes for more than `max_run` cycles
+the run is cut and marked with a gap (`|`), so that slow timers (e.g. the LED matrix refresh) do not make the
+diagrams wide.
+"""
+import argparse
+import json
+import os
+
+from amaranth import Cat
+from amaranth.sim import Settle, Tick
+
+from .sim import Harness
+
+
+class WaveTrace:
+    """Record signals of a harness, one sample per clock cycle, while `record()` runs
+
+    `signals` is a list of `(label, signal, format=str, valid=None)` tuples, where `format` turns a value into the
+    text of a data slot (one bit signals are drawn as levels), and the value is drawn as undefined (`x`) while the
+    `valid` signal is 0. `None` adds an empty row.
+    """
+    def __init__(self, harness, signals, *, max_run=3):
+        self.harness = harness
+        self.signals = signals
+        self.max_run = max_run
+        self.samples = []
+        self._recording = False
+        harness.add_process(self._process)
+
+    def _process(self):
+        traced = [signal for row in self.signals if row is not None for signal in row[1::2]]
+        # a single read per cycle: each value read from a process costs as much as a whole design update
+        sample = Cat(*traced)
+        while True:
+            yield Tick()
+            if self._recording:
+                yield Settle()
+                bits = yield sample
+                values = []
+                for signal in traced:
+                    values.append(bits & ((1 << len(signal)) - 1))
+                    bits >>= len(signal)
+                self.samples.append(tuple(values))
+
+    def record(self, cycles):
+        """Run the harness for `cycles` cycles, recording the signals"""
+        self._recording = True
+        self.harness.run(cycles)
+        self._recording = False
+
+    def _slots(self):
+        """Indices of the samples to draw, and whether each one is a gap"""
+        slots = []
+        run = 0
+        for index, sample in enumerate(self.samples):
+            run = run + 1 if index and sample == self.samples[index - 1] else 0
+            if run < self.max_run:
+                slots.append((index, False))
+            elif run == self.max_run:
+                slots.append((index, True))
+        return slots
+
+    def wavedrom(self, title):
+        """WaveDrom description of the recording"""
+        slots = self._slots()
+        rows = [{"name": "CK", "wave": "".join("|" if gap else "p" if not i else "." for i, (_, gap) in
+                                              enumerate(slots))}]
+        column = 0
+        for row in self.signals:
+            if row is None:
+                rows.append({})
+                continue
+            label, signal, format, valid = (*row, *(str, None)[len(row) - 2:])
+            wave = ""
+            data = []
+            previous = ()  # no value yet
+            for index, gap in slots:
+                value = self.samples[index][column]
+                if valid is not None and not self.samples[index][column + 1]:
+                    value = None
+                if gap:
+                    wave += "|"
+                elif value == previous:
+                    wave += "."
+                elif value is None:
+                    wave += "x"
+                elif len(signal) == 1:
+                    wave += str(value)
+                else:
+                    wave += "="
+                    data.append(format(value))
+                previous = value
+            column += 1 if valid is None else 2
+            rows.append({"name": label, "wave": wave, **({"data": data} if data else {})})
+        return {"head": {"text": title}, "signal": rows}
+
+
+def debouncing():
+    # 60 Hz: the debounce timer counts 3 cycles
+    harness = Harness("step_1", clk_frequency=60)
+    button = harness.button(1)
+    trace = WaveTrace(harness, [
+        ("button", button),
+        ("debounce_timer", harness.signal("debounce_timer")),
+        ("is_pressed", harness.signal("is_pressed")),
+        ("counter", harness.signal("counter")),
+    ])
+
+    def bouncing():
+        for level in [1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1]:
+            yield button.eq(level)
+            yield harness.wait(1)
+    harness.add_process(bouncing)
+    trace.record(16)
+    return trace.wavedrom("Button debouncing")
+
+
+def led_scanning():
+    # the LED matrix of step 2 alone, showing a diagonal: each column is lit on its row
+    harness = Harness("step_2/solution.py:LEDMatrix")
+    pixels = harness.top.pixels
+
+    def diagonal():
+        for i in range(8):
+            yield pixels[i][i].eq(1)
+    harness.add_process(diagonal)
+    trace = WaveTrace(harness, [
+        *((f"led_col[{i}]", harness.pins["led_col", 0].o[i]) for i in range(8)),
+        None,
+        ("led_row[0:8]", harness.pins["led_row", 0].o, lambda value: f"row {value.bit_length() - 1}"),
+    ])
+    harness.run(7 * 1024 - 3)  # just before row 0, the rows change when the 10 bit timer wraps around
+    trace.record(8 * 1024 + 10)
+    return trace.wavedrom("LED scanning")
+
+
+CHARACTER_NAMES = {ord('\r'): "CR", ord('\n'): "LF"}  # labels of the control characters sent
+
+
+def stream_interface():
+    # the transmitter model accepts a byte every 4 cycles
+    harness = Harness("step_4", uart_model=True, uart_latency=3)
+    trace = WaveTrace(harness, [
+        ("rdy (from sink)", harness.signal("uart.uart.rdy")),
+        ("ack (from source)", harness.signal("uart.ack")),
+        ("data (from source)", harness.signal("uart.data"), lambda value: CHARACTER_NAMES.get(value, chr(value)),
+         harness.signal("uart.ack")),
+    ])
+
+    def reset():
+        yield harness.press(5)
+        yield harness.wait(1)
+        yield harness.release(5)
+    harness.add_process(reset)
+    harness.run(1)
+    trace.record(24)
+    return trace.wavedrom("Stream interface")
+
+
+# README diagrams generated from traces, by number
+DIAGRAMS = {
+    2: debouncing,
+    3: led_scanning,
+    4: stream_interface,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="doc", help="output directory")
+    args = parser.parse_args()
+
+    for number, diagram in DIAGRAMS.items():
+        path = os.path.join(args.out, f"diagram{number:02}.json")
+        print(f"Tracing {path}")
+        with open(path, "w") as f:
+            json.dump(diagram(), f, indent=1)
+            f.write("\n")